@@ -1,5 +1,7 @@
 import pandas as pd
+import hashlib
 import os
+import threading
 from pathlib import Path
 
 # Usar rutas relativas desde la raíz del proyecto
@@ -7,17 +9,202 @@ DATA_PATH = Path("data")
 USERS_FILE = DATA_PATH / "usuarios.csv"
 CAMPAIGNS_FILE = DATA_PATH / "campanas_email.csv"
 SOCIAL_POSTS_FILE = DATA_PATH / "posts_redes_sociales.csv"
+SNAPSHOT_PATH = DATA_PATH / "snapshots"
+
+# Tipos columnares de cada dataset. Los valores numéricos quedan en float64,
+# tal como los lee pandas del CSV (las tasas y scores se redondean en la API).
+DATASET_SCHEMAS = {
+    USERS_FILE.name: {
+        'categorical': ['Ciudad', 'Tipo Usuario'],
+        'dates': [],
+    },
+    CAMPAIGNS_FILE.name: {
+        'categorical': [],
+        'dates': ['Fecha Envío'],
+    },
+    SOCIAL_POSTS_FILE.name: {
+        'categorical': ['Plataforma'],
+        'dates': ['Fecha'],
+    },
+}
+
+# Versión del formato de los snapshots: incrementar al cambiar DATASET_SCHEMAS
+SNAPSHOT_FORMAT_VERSION = 2
+
+
+# Clave de DataFrame.attrs con el origen de cada dataset del registro: archivo,
+# firma con la que se cargó y cantidad de filas (se conserva en las copias)
+SOURCE_ATTR = 'source'
+
+
+def _copy_on_write_enabled():
+    """Copy-on-Write está activo por defecto desde pandas 3.0; antes depende de la opción de la aplicación."""
+    try:
+        if int(pd.__version__.split('.')[0]) >= 3:
+            return True
+        return pd.get_option('mode.copy_on_write') is True
+    except (ValueError, KeyError):
+        return False
+
+
+class DatasetRegistry:
+    """
+    Registro en memoria de los datasets, compartido por todo el proceso.
+
+    Cada archivo se parsea una sola vez y solo se vuelve a cargar cuando cambia
+    su mtime o su tamaño. Los consumidores reciben copias superficiales (copias
+    completas si Copy-on-Write no está activo): pueden modificarlas sin afectar
+    al DataFrame compartido.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._registry_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def file_signature(path):
+        """Firma (mtime_ns, tamaño) usada para detectar cambios en el archivo."""
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path, loader):
+        """Devuelve una vista del DataFrame de `path`, recargándolo con `loader` si cambió."""
+        key = str(path)
+        signature = self.file_signature(path)
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != signature:
+            with self._lock_for(key):
+                # Otro hilo pudo haberlo recargado mientras esperábamos el lock
+                entry = self._entries.get(key)
+                if entry is None or entry[0] != signature:
+                    df = loader(path)
+                    df.attrs[SOURCE_ATTR] = {'path': key, 'signature': list(signature), 'rows': len(df)}
+                    entry = (signature, df)
+                    self._entries[key] = entry
+
+        # Con Copy-on-Write una copia superficial nunca escribe sobre el
+        # DataFrame compartido; sin él se entrega una copia completa
+        return entry[1].copy(deep=not _copy_on_write_enabled())
+
+    def invalidate(self, path=None):
+        """Descarta un dataset (o todos) para forzar su recarga."""
+        if path is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(str(path), None)
+
+
+registry = DatasetRegistry()
+
+
+def snapshot_file(csv_path):
+    """Ruta del snapshot columnar (Feather) correspondiente a un CSV."""
+    return SNAPSHOT_PATH / f"{Path(csv_path).stem}.v{SNAPSHOT_FORMAT_VERSION}.feather"
+
+
+def _apply_schema(df, schema):
+    """Aplica los tipos del snapshot: categorías y fechas parseadas."""
+    for col in schema['categorical']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in schema['dates']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+
+def _read_typed_csv(csv_path):
+    df = pd.read_csv(csv_path, encoding='utf-8')
+    schema = DATASET_SCHEMAS.get(Path(csv_path).name)
+    return _apply_schema(df, schema) if schema else df
+
+
+def _write_snapshot(df, csv_path):
+    """Escribe el snapshot de forma atómica (archivo temporal + rename)."""
+    SNAPSHOT_PATH.mkdir(parents=True, exist_ok=True)
+    target = snapshot_file(csv_path)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    df.reset_index(drop=True).to_feather(tmp)
+    os.replace(tmp, target)
+    # Snapshots de formatos anteriores del mismo dataset
+    for old in SNAPSHOT_PATH.glob(f"{Path(csv_path).stem}*.feather"):
+        if old != target:
+            old.unlink(missing_ok=True)
+    return target
+
+
+def build_snapshot(csv_path):
+    """Convierte un CSV de `data/` en su snapshot columnar tipado."""
+    return _write_snapshot(_read_typed_csv(csv_path), csv_path)
+
+
+def ingest_snapshots():
+    """Genera los snapshots de todos los datasets. Devuelve las rutas escritas."""
+    return [build_snapshot(path) for path in (USERS_FILE, CAMPAIGNS_FILE, SOCIAL_POSTS_FILE) if path.exists()]
+
+
+def _load_dataset(csv_path):
+    """
+    Carga un dataset desde su snapshot si es más reciente que el CSV.
+    En caso contrario parsea el CSV y regenera el snapshot (si pyarrow está disponible).
+    """
+    snapshot = snapshot_file(csv_path)
+    csv_mtime = os.stat(csv_path).st_mtime_ns
+
+    if snapshot.exists() and snapshot.stat().st_mtime_ns >= csv_mtime:
+        try:
+            return pd.read_feather(snapshot)
+        except Exception as e:
+            print(f"Snapshot inválido {snapshot}, se usará el CSV: {str(e)}")
+
+    df = _read_typed_csv(csv_path)
+    try:
+        _write_snapshot(df, csv_path)
+    except ImportError:
+        # pyarrow no instalado: se sigue trabajando solo con el CSV
+        pass
+    except OSError as e:
+        print(f"No se pudo escribir el snapshot de {csv_path}: {str(e)}")
+    return df
+
+
+def get_data_version(*paths):
+    """
+    Huella de la versión actual de los datasets, derivada de las firmas de sus archivos.
+    Sin argumentos cubre los tres datasets; sirve como clave de caché de resultados derivados.
+    """
+    paths = paths or (USERS_FILE, CAMPAIGNS_FILE, SOCIAL_POSTS_FILE)
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            signature = registry.file_signature(path)
+        except OSError:
+            signature = None
+        digest.update(f"{Path(path).name}:{signature};".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
 
 def load_data():
-    """Carga los dataframes desde los archivos CSV."""
+    """Carga los dataframes desde los snapshots o los CSV (vía el registro en memoria)."""
     try:
-        users_df = pd.read_csv(USERS_FILE, encoding='utf-8')
-        campaigns_df = pd.read_csv(CAMPAIGNS_FILE, encoding='utf-8')
-        social_df = pd.read_csv(SOCIAL_POSTS_FILE, encoding='utf-8')
+        users_df = registry.get(USERS_FILE, _load_dataset)
+        campaigns_df = registry.get(CAMPAIGNS_FILE, _load_dataset)
+        social_df = registry.get(SOCIAL_POSTS_FILE, _load_dataset)
         return users_df, campaigns_df, social_df
     except FileNotFoundError as e:
         print(f"Error: No se encontró el archivo {e.filename}")
         return None, None, None
     except Exception as e:
         print(f"Error al cargar datos: {str(e)}")
-        return None, None, None
\ No newline at end of file
+        return None, None, None
+
+
+if __name__ == '__main__':
+    for written in ingest_snapshots():
+        print(f"Snapshot generado: {written}")
@@ -0,0 +1,156 @@
+"""
+Matriz de features numéricas de los usuarios, persistida en `data/snapshots`
+y abierta con memory-map: varios workers de uvicorn comparten las mismas
+páginas del archivo y los servicios la leen sin copiar el DataFrame.
+"""
+import json
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from . import data_handler
+
+FEATURE_COLUMNS = ['Engagement Score', 'Total Compras', 'CLV', 'Riesgo Churn']
+ID_COLUMN = 'ID'
+
+FEATURES_FILE = data_handler.SNAPSHOT_PATH / "user_features.npy"
+IDS_FILE = data_handler.SNAPSHOT_PATH / "user_features_ids.npy"
+META_FILE = data_handler.SNAPSHOT_PATH / "user_features.json"
+
+
+class UserFeatureMatrix:
+    """Matriz (usuarios x FEATURE_COLUMNS) de solo lectura, indexable por ID de usuario."""
+
+    def __init__(self, ids: np.ndarray, matrix: np.ndarray):
+        self.ids = ids
+        self.matrix = matrix
+        self._index = None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def column(self, name: str) -> np.ndarray:
+        """Vista (sin copia) de una columna de features."""
+        return self.matrix[:, FEATURE_COLUMNS.index(name)]
+
+    def index_of(self, user_id: str) -> Optional[int]:
+        if self._index is None:
+            self._index = {uid: i for i, uid in enumerate(self.ids.tolist())}
+        return self._index.get(user_id)
+
+    def row(self, user_id: str) -> Optional[np.ndarray]:
+        pos = self.index_of(user_id)
+        return None if pos is None else self.matrix[pos]
+
+    def matches(self, users_df) -> bool:
+        """Indica si la matriz está alineada fila a fila con `users_df`."""
+        if len(self) != len(users_df):
+            return False
+        if ID_COLUMN not in users_df.columns or len(self) == 0:
+            return True
+        # Se comparan todos los IDs: un CSV reordenado o editado en el medio
+        # conserva la cantidad de filas y los extremos
+        ids = users_df[ID_COLUMN].astype(str).to_numpy(dtype=str)
+        return np.array_equal(ids, self.ids)
+
+    @classmethod
+    def from_frame(cls, users_df) -> 'UserFeatureMatrix':
+        matrix = np.asfortranarray(users_df[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+        if ID_COLUMN in users_df.columns:
+            ids = users_df[ID_COLUMN].astype(str).to_numpy(dtype=str)
+        else:
+            ids = np.arange(len(users_df)).astype(str)
+        return cls(ids, matrix)
+
+
+_lock = threading.Lock()
+_current = {'signature': None, 'features': None}
+
+
+def _source_signature(users_df):
+    """
+    Firma del CSV de usuarios con la que el registro cargó `users_df`, o None
+    si el DataFrame no es ese dataset completo (otro origen o un subconjunto).
+    """
+    source = users_df.attrs.get(data_handler.SOURCE_ATTR)
+    if not source or source['path'] != str(data_handler.USERS_FILE) or source['rows'] != len(users_df):
+        return None
+    return source['signature']
+
+
+def _read_meta():
+    try:
+        with open(META_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_atomic(path, array):
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def build_feature_matrix(users_df, signature=None) -> UserFeatureMatrix:
+    """Escribe la matriz de features y sus IDs en disco y la devuelve mapeada en memoria."""
+    features = UserFeatureMatrix.from_frame(users_df)
+    data_handler.SNAPSHOT_PATH.mkdir(parents=True, exist_ok=True)
+
+    _save_atomic(FEATURES_FILE, features.matrix)
+    _save_atomic(IDS_FILE, features.ids)
+
+    # El meta se escribe al final: marca la matriz como válida para esta versión del CSV
+    tmp_meta = META_FILE.with_name(f"{META_FILE.name}.{os.getpid()}.tmp")
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump({
+            'signature': signature if signature is not None else _source_signature(users_df),
+            'columns': FEATURE_COLUMNS,
+            'rows': len(features),
+        }, f)
+    os.replace(tmp_meta, META_FILE)
+
+    return _open_mapped()
+
+
+def _open_mapped() -> UserFeatureMatrix:
+    matrix = np.load(FEATURES_FILE, mmap_mode='r')
+    ids = np.load(IDS_FILE, mmap_mode='r')
+    return UserFeatureMatrix(ids, matrix)
+
+
+def get_user_features(users_df) -> UserFeatureMatrix:
+    """
+    Devuelve la matriz de features alineada con `users_df`.
+
+    Reutiliza el archivo mapeado mientras la firma del CSV de usuarios con la que
+    se cargó `users_df` no cambie; si no existe o está desactualizado lo
+    reconstruye. Si `users_df` no corresponde al dataset completo del registro
+    (p. ej. un subconjunto), se arma una matriz en memoria.
+    """
+    # La firma viaja con el DataFrame: si el CSV cambió después de cargarlo,
+    # la matriz de este DataFrame no se guarda bajo la firma nueva
+    signature = _source_signature(users_df)
+    if signature is None:
+        return UserFeatureMatrix.from_frame(users_df)
+
+    with _lock:
+        features = _current['features']
+        if features is None or _current['signature'] != signature:
+            meta = _read_meta()
+            try:
+                if meta and meta.get('signature') == signature and meta.get('columns') == FEATURE_COLUMNS:
+                    features = _open_mapped()
+                else:
+                    features = build_feature_matrix(users_df, signature)
+            except (OSError, ValueError) as e:
+                print(f"No se pudo usar la matriz de features mapeada: {str(e)}")
+                return UserFeatureMatrix.from_frame(users_df)
+            _current['signature'] = signature
+            _current['features'] = features
+
+    if not features.matches(users_df):
+        return UserFeatureMatrix.from_frame(users_df)
+    return features
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -6,7 +8,14 @@ from dotenv import load_dotenv
 load_dotenv()
 from .routers import ai_content, analytics, automation, campaigns, dashboard, segmentation, social, company, view_states
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Planificador de las ejecuciones de flujos de automatización
+    automation.automation_service.start_scheduler()
+    yield
+    automation.automation_service.stop_scheduler()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configuración de CORS
 # Esto permite que tu frontend (que se ejecuta en un origen diferente) 
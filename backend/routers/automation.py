@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Body
-from typing import List, Optional
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Union
+from pydantic import BaseModel, Field
 
 # Importar los servicios
 import sys
@@ -111,6 +112,39 @@ async def toggle_flow_status(flow_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ========== ENDPOINTS DE EVENTOS ==========
+
+class AutomationEvent(BaseModel):
+    event_type: str = Field(..., min_length=1)
+    user_id: str = Field(..., min_length=1)
+    data: Optional[dict] = None
+
+@router.post("/automation/events")
+async def ingest_events(events: Union[List[AutomationEvent], AutomationEvent] = Body(...)):
+    """Recibe un evento o una lista de eventos e inicia los flujos activos que correspondan"""
+    try:
+        batch = events if isinstance(events, list) else [events]
+        result = await run_in_threadpool(
+            automation_service.ingest_events, [event.model_dump() for event in batch]
+        )
+        data = {
+            "received": result['received'],
+            "matched": result['matched'],
+            "executions_started": result['executions_started']
+        }
+        # Para un evento individual se devuelven las ejecuciones creadas
+        if not isinstance(events, list):
+            data["executions"] = [
+                {"id": e['id'], "flow_id": e['flow_id'], "current_step_id": e['current_step_id']}
+                for e in result['executions']
+            ]
+        return {
+            "status": "success",
+            "data": data
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ========== ENDPOINTS DE PLANTILLAS ==========
 
 @router.get("/automation/templates")
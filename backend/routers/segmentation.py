@@ -1,45 +1,32 @@
-from fastapi import APIRouter, HTTPException
-from ..services import segmentation_service, segmentation_ai_service
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import List
+from ..services import segmentation_service, segmentation_ai_service, cluster_model
 
 router = APIRouter()
 
-@router.get("/segmentation")
-def get_segmentation_data():
-    """Endpoint para obtener todos los datos de segmentación con RFM y ML."""
-    return segmentation_service.get_segmentation_data()
-
-@router.get("/segmentation/ai/status")
-def check_ai_status():
-    """Verifica si la API de IA está configurada."""
-    return segmentation_ai_service.check_api_status()
+# Mapear nombres de frontend a backend
+SEGMENT_MAPPING = {
+    "compradores_vip": "VIP Champions",
+    "en_riesgo_churn": "En Riesgo",
+    "promesa": "Promesa",
+    "leales": "Leales",
+    "hibernando": "Hibernando",
+    "perdidos": "Perdidos"
+}
 
-@router.post("/segmentation/ai/persona/{segment_name}")
-def generate_persona(segment_name: str):
+def _get_segment(segment_name: str):
     """
-    Genera un perfil de cliente (persona) para un segmento específico.
-    
-    Args:
-        segment_name: Nombre del segmento (ej: "compradores_vip", "en_riesgo_churn")
+    Busca un segmento en el artefacto de segmentación (en `segments` o `segments_summary`).
+    Devuelve (datos completos, nombre de backend, datos del segmento).
     """
-    # Obtener datos del segmento
     seg_data = segmentation_service.get_segmentation_data()
     
     if seg_data.get("status") == "error":
         raise HTTPException(status_code=500, detail=seg_data.get("error"))
     
-    # Mapear nombres de frontend a backend
-    segment_mapping = {
-        "compradores_vip": "VIP Champions",
-        "en_riesgo_churn": "En Riesgo",
-        "promesa": "Promesa",
-        "leales": "Leales",
-        "hibernando": "Hibernando",
-        "perdidos": "Perdidos"
-    }
+    mapped_name = SEGMENT_MAPPING.get(segment_name, segment_name)
     
-    mapped_name = segment_mapping.get(segment_name, segment_name)
-    
-    # Buscar datos del segmento en segments o segments_summary
     segment_data = None
     if segment_name in seg_data.get("segments", {}):
         segment_data = seg_data["segments"][segment_name]
@@ -49,6 +36,80 @@ def generate_persona(segment_name: str):
     if not segment_data:
         raise HTTPException(status_code=404, detail=f"Segmento {segment_name} no encontrado")
     
+    return seg_data, mapped_name, segment_data
+
+@router.get("/segmentation")
+def get_segmentation_data(mode: str = Query('batch', pattern='^(batch|streaming)$')):
+    """
+    Endpoint para obtener todos los datos de segmentación con RFM y ML.
+    `mode=streaming` procesa el CSV por bloques con MiniBatchKMeans (listas de millones de usuarios).
+    """
+    return segmentation_service.get_segmentation_data(mode=mode)
+
+class UserSegmentsRequest(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, max_length=10000)
+
+@router.get("/segmentation/users/{user_id}")
+def get_user_segment(user_id: str):
+    """Segmento, cluster IA y scores RFM de un usuario (consulta por índice, sin recalcular)."""
+    try:
+        users = segmentation_service.get_user_segments([user_id])
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if user_id not in users:
+        raise HTTPException(status_code=404, detail=f"Usuario {user_id} no encontrado")
+    
+    return {"status": "success", "data": users[user_id]}
+
+@router.post("/segmentation/users/batch")
+def get_user_segments_batch(request: UserSegmentsRequest):
+    """Versión por lote de /segmentation/users/{user_id}."""
+    try:
+        users = segmentation_service.get_user_segments(request.user_ids)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "status": "success",
+        "data": [users[uid] for uid in request.user_ids if uid in users],
+        "not_found": [uid for uid in request.user_ids if uid not in users]
+    }
+
+@router.get("/segmentation/model")
+def get_cluster_model():
+    """Información del modelo K-Means vigente (versión, tamaño de entrenamiento, inercia)."""
+    model = cluster_model.get_model()
+    if model is None:
+        raise HTTPException(status_code=404, detail="Todavía no hay un modelo de clustering entrenado")
+    return {"status": "success", "model": model.info()}
+
+@router.post("/segmentation/model/refit")
+def refit_cluster_model():
+    """Reentrena el modelo K-Means (partiendo de los centroides vigentes) y recalcula la segmentación."""
+    seg_data = segmentation_service.get_segmentation_data(refit_model=True)
+    
+    if seg_data.get("status") != "success":
+        raise HTTPException(status_code=500, detail=seg_data.get("error"))
+    
+    return {"status": "success", "model": cluster_model.get_model().info()}
+
+@router.get("/segmentation/ai/status")
+def check_ai_status():
+    """Verifica si la API de IA está configurada."""
+    return segmentation_ai_service.check_api_status()
+
+@router.post("/segmentation/ai/persona/{segment_name}")
+def generate_persona(segment_name: str):
+    """
+    Genera un perfil de cliente (persona) para un segmento específico.
+    
+    Args:
+        segment_name: Nombre del segmento (ej: "compradores_vip", "en_riesgo_churn")
+    """
+    # Leer el segmento del artefacto de segmentación (no recalcula el clustering)
+    seg_data, mapped_name, segment_data = _get_segment(segment_name)
+    
     # Generar persona con ChatGPT
     persona = segmentation_ai_service.generate_customer_persona(mapped_name, segment_data)
     
@@ -66,33 +127,8 @@ def generate_recommendations(segment_name: str):
     Args:
         segment_name: Nombre del segmento
     """
-    # Obtener datos del segmento
-    seg_data = segmentation_service.get_segmentation_data()
-    
-    if seg_data.get("status") == "error":
-        raise HTTPException(status_code=500, detail=seg_data.get("error"))
-    
-    # Mapear nombres
-    segment_mapping = {
-        "compradores_vip": "VIP Champions",
-        "en_riesgo_churn": "En Riesgo",
-        "promesa": "Promesa",
-        "leales": "Leales",
-        "hibernando": "Hibernando",
-        "perdidos": "Perdidos"
-    }
-    
-    mapped_name = segment_mapping.get(segment_name, segment_name)
-    
-    # Buscar datos del segmento
-    segment_data = None
-    if segment_name in seg_data.get("segments", {}):
-        segment_data = seg_data["segments"][segment_name]
-    elif mapped_name in seg_data.get("segments_summary", {}):
-        segment_data = seg_data["segments_summary"][mapped_name]
-    
-    if not segment_data:
-        raise HTTPException(status_code=404, detail=f"Segmento {segment_name} no encontrado")
+    # Leer el segmento del artefacto de segmentación (no recalcula el clustering)
+    seg_data, mapped_name, segment_data = _get_segment(segment_name)
     
     # Generar recomendaciones con ChatGPT
     recommendations = segmentation_ai_service.generate_marketing_recommendations(mapped_name, segment_data)
@@ -111,33 +147,8 @@ def generate_insights(segment_name: str):
     Args:
         segment_name: Nombre del segmento
     """
-    # Obtener todos los datos
-    seg_data = segmentation_service.get_segmentation_data()
-    
-    if seg_data.get("status") == "error":
-        raise HTTPException(status_code=500, detail=seg_data.get("error"))
-    
-    # Mapear nombres
-    segment_mapping = {
-        "compradores_vip": "VIP Champions",
-        "en_riesgo_churn": "En Riesgo",
-        "promesa": "Promesa",
-        "leales": "Leales",
-        "hibernando": "Hibernando",
-        "perdidos": "Perdidos"
-    }
-    
-    mapped_name = segment_mapping.get(segment_name, segment_name)
-    
-    # Buscar datos del segmento
-    segment_data = None
-    if segment_name in seg_data.get("segments", {}):
-        segment_data = seg_data["segments"][segment_name]
-    elif mapped_name in seg_data.get("segments_summary", {}):
-        segment_data = seg_data["segments_summary"][mapped_name]
-    
-    if not segment_data:
-        raise HTTPException(status_code=404, detail=f"Segmento {segment_name} no encontrado")
+    # Leer el segmento del artefacto de segmentación (no recalcula el clustering)
+    seg_data, mapped_name, segment_data = _get_segment(segment_name)
     
     # Obtener datos de todos los segmentos para comparación
     all_segments = seg_data.get("segments_summary", {})
@@ -7,6 +7,8 @@ class AnalyticsAIService:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY", "")
         self.client = None
+        # True si alguna llamada a la IA falló y se usó el contenido de respaldo
+        self.ai_failed = False
         
         if self.api_key and self.api_key != "":
             try:
@@ -71,6 +73,7 @@ class AnalyticsAIService:
             
         except Exception as e:
             print(f"Error generando insights con IA: {e}")
+            self.ai_failed = True
             return self._get_fallback_insights(analytics_data)
     
     def _prepare_context(self, analytics_data: Dict) -> str:
@@ -186,6 +189,7 @@ class AnalyticsAIService:
             
         except Exception as e:
             print(f"Error generando resumen: {e}")
+            self.ai_failed = True
             return self._get_fallback_summary(analytics_data)
     
     def _get_fallback_summary(self, analytics_data: Dict) -> str:
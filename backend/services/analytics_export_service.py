@@ -0,0 +1,165 @@
+"""
+Exportaciones de analytics generadas por streaming: las filas se escriben a
+medida que se producen y se envían por bloques, sin armar el archivo
+completo en memoria.
+"""
+import csv
+import io
+from datetime import datetime
+
+import xlsxwriter
+
+from . import segmentation_service
+
+# Columnas del detalle de campañas (mismo orden que get_top_campaigns)
+CAMPAIGN_EXPORT_COLUMNS = ['name', 'channel', 'sent', 'open_rate', 'ctr', 'conversion_rate', 'revenue']
+
+EXPORT_CHUNK_SIZE = 5000
+
+# Por debajo de este tamaño el Excel generado queda en memoria; por encima pasa a un archivo temporal
+EXCEL_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# Filas de datos por hoja (Excel admite 1.048.576 filas, una es el encabezado)
+EXCEL_MAX_ROWS = 1048575
+
+USER_SEGMENT_HEADERS = ['ID', 'Segmento', 'Cluster AI', 'R Score', 'F Score', 'M Score', 'RFM Score']
+
+
+def summary_rows(overview, include_campaigns=False):
+    """Filas (métrica, valor) del resumen de un período."""
+    rows = [
+        ('Total Conversiones', overview['total_conversions']),
+        ('Total Enviados', overview['total_sent']),
+        ('Tasa Apertura', f"{overview['open_rate']}%"),
+        ('CTR', f"{overview['ctr']}%"),
+        ('Tasa Conversión', f"{overview['conversion_rate']}%"),
+        ('ROI', f"{overview['roi']}x"),
+    ]
+    if include_campaigns:
+        rows.append(('Total Campañas', overview.get('total_campaigns', 0)))
+    return rows
+
+
+def iter_csv_export(service, period: str, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Genera el CSV de analytics como bloques de bytes UTF-8: primero el resumen
+    y luego todas las campañas del período, `chunk_size` filas por bloque.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data.encode('utf-8')
+
+    overview = service.get_overview_metrics(period)
+
+    buffer.write("RESUMEN DE ANALYTICS\n")
+    buffer.write(f"Período: {period}\n")
+    buffer.write(f"Generado: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+    writer.writerow(['Métrica', 'Valor'])
+    writer.writerows(summary_rows(overview))
+
+    buffer.write("\n\nDETALLE DE CAMPAÑAS\n")
+    writer.writerow(CAMPAIGN_EXPORT_COLUMNS)
+    yield flush()
+
+    for chunk in service.iter_campaigns(period, chunk_size):
+        writer.writerows([row[col] for col in CAMPAIGN_EXPORT_COLUMNS] for row in chunk)
+        yield flush()
+
+
+class _SheetWriter:
+    """Escribe filas en orden en una hoja de un workbook en modo constant_memory."""
+
+    def __init__(self, workbook, name, headers, header_format):
+        self.workbook = workbook
+        self.name = name
+        self.headers = headers
+        self.header_format = header_format
+        self.sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheets += 1
+        name = self.name if self.sheets == 1 else f"{self.name} ({self.sheets})"
+        self.worksheet = self.workbook.add_worksheet(name)
+        self.worksheet.set_column(0, 25, 15)
+        self.worksheet.write_row(0, 0, self.headers, self.header_format)
+        self.row = 1
+
+    def write_rows(self, rows):
+        for values in rows:
+            # Al llenar una hoja se continúa en otra con el mismo encabezado
+            if self.row > EXCEL_MAX_ROWS:
+                self._new_sheet()
+            self.worksheet.write_row(self.row, 0, values)
+            self.row += 1
+
+
+def write_excel_export(service, period: str, output, include_users: bool = True):
+    """
+    Escribe el Excel de analytics en `output` (archivo o file object) con
+    xlsxwriter en modo constant_memory: cada fila se vuelca a disco apenas se
+    escribe. Las campañas y los usuarios por segmento se leen por lotes.
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'nan_inf_to_errors': True})
+    try:
+        header_format = workbook.add_format({
+            'bold': True,
+            'bg_color': '#6366f1',
+            'font_color': 'white',
+            'border': 1
+        })
+
+        # Hoja 1: Resumen
+        overview = service.get_overview_metrics(period)
+        _SheetWriter(workbook, 'Resumen', ['Métrica', 'Valor'], header_format).write_rows(
+            summary_rows(overview, include_campaigns=True)
+        )
+
+        # Hoja 2: Campañas del período, de mayor a menor conversión
+        campaigns_sheet = _SheetWriter(workbook, 'Top Campañas', CAMPAIGN_EXPORT_COLUMNS, header_format)
+        for chunk in service.iter_campaigns(period, EXPORT_CHUNK_SIZE):
+            campaigns_sheet.write_rows([row[col] for col in CAMPAIGN_EXPORT_COLUMNS] for row in chunk)
+
+        # Hoja 3: Segmentos
+        segments = service.get_segment_performance()
+        segment_columns = list(segments[0].keys()) if segments else []
+        _SheetWriter(workbook, 'Segmentos', segment_columns, header_format).write_rows(
+            [seg[col] for col in segment_columns] for seg in segments
+        )
+
+        # Hoja 4: Evolución
+        evolution = service.get_conversion_evolution(period)
+        _SheetWriter(workbook, 'Evolución', ['Fecha', 'Conversiones', 'Aperturas', 'Clicks'], header_format).write_rows(
+            zip(evolution.get('labels', []), evolution.get('conversions', []),
+                evolution.get('opens', []), evolution.get('clicks', []))
+        )
+
+        # Hoja 5: Segmento de cada usuario (índice de segmentación)
+        if include_users:
+            try:
+                batches = segmentation_service.iter_user_segments(EXPORT_CHUNK_SIZE)
+            except Exception as e:
+                print(f"Error al obtener los segmentos por usuario para el Excel: {str(e)}")
+                batches = []
+            users_sheet = _SheetWriter(workbook, 'Usuarios por Segmento', USER_SEGMENT_HEADERS, header_format)
+            for batch in batches:
+                users_sheet.write_rows(batch)
+    finally:
+        workbook.close()
+
+
+def iter_file(fileobj, chunk_size: int = 64 * 1024):
+    """Lee un archivo desde el inicio por bloques y lo cierra al terminar."""
+    try:
+        fileobj.seek(0)
+        while True:
+            data = fileobj.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        fileobj.close()
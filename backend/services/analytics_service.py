@@ -2,50 +2,344 @@ import pandas as pd
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import numpy as np
+import copy
+import hashlib
+import inspect
+import threading
 import unicodedata
+from functools import lru_cache, wraps
+
+# Campos lógicos -> nombres de columna candidatos, en orden de preferencia
+CAMPAIGN_FIELDS = {
+    'date': ('Fecha Envío', 'fechaenvio', 'fecha'),
+    'sent': ('enviados', 'Destinatarios', 'sent', 'recipients', 'destinatarios'),
+    'opens': ('aperturas', 'opens', 'Tasa Apertura', 'open_rate'),
+    'clicks': ('clicks', 'clicks_total', 'clics', 'CTR'),
+    'conversions': ('Conversiones', 'conversion', 'conversions'),
+    'name': ('nombre', 'name', 'campaign_name', 'titulo'),
+    'channel': ('canal', 'channel', 'media'),
+    'revenue': ('Revenue', 'ingresos'),
+    'id': ('ID', 'campaign_id', 'id'),
+}
+
+USER_FIELDS = {
+    'segment': ('segment', 'segmento', 'Tipo Usuario'),
+    'user_id': ('user_id', 'userid', 'id'),
+    'clv': ('clv', 'lifetimevalue'),
+}
+
+_FIELD_SETS = {
+    'campaigns': CAMPAIGN_FIELDS,
+    'users': USER_FIELDS,
+}
+
+
+def _normalize(name: str) -> str:
+    if not isinstance(name, str):
+        return ''
+    nk = unicodedata.normalize('NFKD', name)
+    ascii_name = nk.encode('ASCII', 'ignore').decode('ASCII')
+    return ascii_name.lower().replace(' ', '').replace('-', '').replace('_', '')
+
+
+@lru_cache(maxsize=64)
+def bind_schema(kind: str, columns: tuple) -> Dict[str, Optional[str]]:
+    """
+    Resuelve cada campo lógico de `kind` a su columna física.
+    Se calcula una vez por esquema (tupla de columnas) y queda en caché.
+    """
+    col_map = {_normalize(c): c for c in columns}
+
+    binding = {}
+    for field, candidates in _FIELD_SETS[kind].items():
+        binding[field] = next((col_map[_normalize(c)] for c in candidates if _normalize(c) in col_map), None)
+    return binding
+
+
+class CampaignIndex:
+    """
+    Campañas ordenadas por fecha de envío, con la fecha ya parseada.
+    Cada período se resuelve con búsqueda binaria a un slice contiguo,
+    sin volver a recorrer ni a parsear la tabla.
+    """
+
+    def __init__(self, campaigns_df: pd.DataFrame, date_col: Optional[str] = None):
+        self.date_col = date_col if date_col in campaigns_df.columns else None
+        self.frame = campaigns_df
+        self.dates = None
+        if self.date_col is None:
+            return
+
+        dates = pd.to_datetime(campaigns_df[self.date_col], errors='coerce')
+        frame = campaigns_df.assign(**{self.date_col: dates})
+        if not dates.is_monotonic_increasing:
+            # Orden estable; las fechas inválidas (NaT) quedan al final
+            frame = frame.iloc[np.argsort(dates.to_numpy(), kind='stable')]
+
+        self.frame = frame
+        self.n_valid = int(frame[self.date_col].notna().sum())
+        self.dates = frame[self.date_col].to_numpy()[:self.n_valid]
+
+    def since(self, start_date: datetime) -> pd.DataFrame:
+        """Campañas enviadas desde `start_date` (todas si no hay columna de fecha)."""
+        if self.dates is None:
+            return self.frame
+        pos = int(np.searchsorted(self.dates, pd.Timestamp(start_date).to_datetime64(), side='left'))
+        return self.frame.iloc[pos:self.n_valid]
+
+
+class DailyRollup:
+    """
+    Cubo diario materializado: fecha x canal x campaña con las sumas de
+    enviados, aperturas, clicks, conversiones e ingresos (y cantidad de envíos).
+    Sobre los totales por día se guardan sumas acumuladas, así cada período
+    es una suma por rango sobre a lo sumo 365 días. Un hash de las filas ya
+    agregadas permite saber si una versión nueva del dataset solo agregó filas.
+    """
+
+    MEASURES = ('sent', 'opens', 'clicks', 'conversions', 'revenue', 'campaigns')
+    DIMENSIONS = ('day', 'channel', 'campaign')
+
+    def __init__(self, cols: Dict[str, Optional[str]]):
+        self.cols = cols
+        self.cube = pd.DataFrame(
+            {m: pd.Series(dtype='float64') for m in self.MEASURES},
+            index=pd.MultiIndex.from_arrays([[], [], []], names=self.DIMENSIONS)
+        )
+        self.n_rows = 0
+        self._digest = hashlib.sha1()
+        self._refresh_daily()
+
+    @classmethod
+    def from_frame(cls, campaigns_df: pd.DataFrame, cols: Dict[str, Optional[str]]) -> 'DailyRollup':
+        rollup = cls(cols)
+        rollup.add_campaigns(campaigns_df)
+        return rollup
+
+    def _row_hashes(self, campaigns_df: pd.DataFrame) -> bytes:
+        """Hash por fila de las columnas que usa el cubo."""
+        columns = [col for col in dict.fromkeys(self.cols.values()) if col and col in campaigns_df.columns]
+        return pd.util.hash_pandas_object(campaigns_df[columns], index=False).to_numpy().tobytes()
+
+    def prefix_matches(self, campaigns_df: pd.DataFrame) -> bool:
+        """Indica si las primeras `n_rows` filas de `campaigns_df` son las ya agregadas."""
+        if len(campaigns_df) < self.n_rows:
+            return False
+        return hashlib.sha1(self._row_hashes(campaigns_df.iloc[:self.n_rows])).digest() == self._digest.digest()
+
+    def extended(self, campaigns_df: pd.DataFrame) -> 'DailyRollup':
+        """Copia del cubo con las filas de `campaigns_df` posteriores a las ya agregadas."""
+        # Copia superficial: add_campaigns reasigna el cubo, esta versión queda intacta
+        rollup = copy.copy(self)
+        rollup._digest = self._digest.copy()
+        rollup.add_campaigns(campaigns_df.iloc[self.n_rows:])
+        return rollup
+
+    def _aggregate(self, campaigns_df: pd.DataFrame) -> pd.DataFrame:
+        cols = self.cols
+        n = len(campaigns_df)
+
+        def numeric(field):
+            col = cols[field]
+            if col is None or col not in campaigns_df.columns:
+                return np.zeros(n)
+            return pd.to_numeric(campaigns_df[col], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+        days = pd.to_datetime(campaigns_df[cols['date']], errors='coerce').dt.normalize()
+        frame = pd.DataFrame({
+            'day': days.to_numpy(),
+            'channel': campaigns_df[cols['channel']].to_numpy() if cols['channel'] else 'email',
+            'campaign': campaigns_df[cols['name']].to_numpy() if cols['name'] else 'Sin nombre',
+            'sent': numeric('sent'),
+            'opens': numeric('opens'),
+            'clicks': numeric('clicks'),
+            'conversions': numeric('conversions'),
+            'revenue': numeric('revenue'),
+            'campaigns': np.ones(n),
+        })
+        # Las campañas sin fecha válida no caen en ningún período
+        frame = frame[frame['day'].notna()]
+        return frame.groupby(list(self.DIMENSIONS), dropna=False).sum()
+
+    def add_campaigns(self, campaigns_df: pd.DataFrame):
+        """Suma nuevas campañas al cubo sin reprocesar las ya agregadas."""
+        if len(campaigns_df) == 0:
+            return
+        part = self._aggregate(campaigns_df)
+        if len(self.cube):
+            part = pd.concat([self.cube, part]).groupby(level=list(self.DIMENSIONS), dropna=False).sum()
+        self.cube = part.sort_index()
+        self.n_rows += len(campaigns_df)
+        self._digest.update(self._row_hashes(campaigns_df))
+        self._refresh_daily()
+
+    def _refresh_daily(self):
+        daily = self.cube.groupby(level='day').sum()
+        self.days = daily.index.to_numpy(dtype='datetime64[D]')
+        values = daily[list(self.MEASURES)].to_numpy(dtype=np.float64).reshape(-1, len(self.MEASURES))
+        self.prefix = np.vstack([np.zeros((1, len(self.MEASURES))), np.cumsum(values, axis=0)])
+        self.daily = values
+
+    def _day_bounds(self, start_date: datetime, end_date: Optional[datetime] = None):
+        """Posiciones [inicio, fin) de los días >= start_date (y <= end_date)."""
+        # Solo cuentan los días completos desde start_date (los envíos tienen fecha sin hora)
+        first_day = pd.Timestamp(start_date).ceil('D').to_datetime64().astype('datetime64[D]')
+        lo = int(np.searchsorted(self.days, first_day, side='left'))
+        if end_date is None:
+            return lo, len(self.days)
+        last_day = np.datetime64(pd.Timestamp(end_date).date(), 'D')
+        return lo, max(lo, int(np.searchsorted(self.days, last_day, side='right')))
+
+    def totals(self, start_date: datetime, end_date: Optional[datetime] = None) -> Dict[str, float]:
+        """Suma de cada medida en el rango (diferencia de sumas acumuladas)."""
+        lo, hi = self._day_bounds(start_date, end_date)
+        return dict(zip(self.MEASURES, (self.prefix[hi] - self.prefix[lo]).tolist()))
+
+    def daily_series(self, start_date: datetime, labels: List[str]) -> Dict[str, List[float]]:
+        """Valores por día de cada medida, alineados con `labels` (ceros en días sin envíos)."""
+        lo, hi = self._day_bounds(start_date)
+        positions = {str(day): i for i, day in enumerate(self.days[lo:hi].astype(str).tolist(), start=lo)}
+        rows = [positions.get(label) for label in labels]
+        return {
+            measure: [self.daily[r, j] if r is not None else 0.0 for r in rows]
+            for j, measure in enumerate(self.MEASURES)
+        }
+
+    def by_channel(self, start_date: datetime, measure: str) -> pd.Series:
+        """Suma de `measure` por canal en el rango, ordenada por canal."""
+        lo, hi = self._day_bounds(start_date)
+        if lo >= hi:
+            return pd.Series(dtype='float64')
+        cube = self.cube.loc[pd.Timestamp(self.days[lo]):]
+        return cube[measure].groupby(level='channel').sum()
+
+
+_index_lock = threading.Lock()
+_index_cache = {'key': None, 'index': None}
+
+
+def get_campaign_index(campaigns_df: pd.DataFrame, date_col: Optional[str], data_version: str) -> CampaignIndex:
+    """Índice por fecha de la versión `data_version` del dataset de campañas."""
+    key = (data_version, date_col)
+    with _index_lock:
+        if _index_cache['key'] == key:
+            return _index_cache['index']
+
+    index = CampaignIndex(campaigns_df, date_col)
+
+    with _index_lock:
+        _index_cache['key'] = key
+        _index_cache['index'] = index
+    return index
+
+
+_rollup_lock = threading.Lock()
+_rollup_cache = {'version': None, 'rollup': None}
+
+
+def get_daily_rollup(campaigns_df: pd.DataFrame, cols: Dict[str, Optional[str]], data_version: str) -> DailyRollup:
+    """
+    Cubo diario de la versión `data_version` del dataset de campañas.
+
+    Si la nueva versión solo agrega filas al final (las filas previas no
+    cambiaron, según el hash de las ya agregadas), se incorporan solo las nuevas;
+    si alguna se editó o se eliminó, el cubo se rearma completo.
+    """
+    with _rollup_lock:
+        if _rollup_cache['version'] == data_version:
+            return _rollup_cache['rollup']
+        previous = _rollup_cache['rollup']
+
+    if previous is not None and previous.cols == cols and previous.prefix_matches(campaigns_df):
+        rollup = previous.extended(campaigns_df)
+    else:
+        rollup = DailyRollup.from_frame(campaigns_df, cols)
+
+    with _rollup_lock:
+        _rollup_cache['version'] = data_version
+        _rollup_cache['rollup'] = rollup
+    return rollup
+
+
+def _memoized(method):
+    """
+    Memoiza una métrica por (método, argumentos) dentro de la instancia del
+    servicio: cada combinación se calcula una vez por request. Se devuelve una
+    copia para que los consumidores no alteren el resultado compartido.
+    """
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__,) + tuple(bound.arguments.items())[1:]
+        if key not in self._memo:
+            self._memo[key] = method(self, *args, **kwargs)
+        return copy.deepcopy(self._memo[key])
+
+    return wrapper
+
 
 class AnalyticsService:
-    def __init__(self, users_df, campaigns_df, social_df):
+    def __init__(self, users_df, campaigns_df, social_df, data_version: Optional[str] = None):
         self.users_df = users_df if users_df is not None else pd.DataFrame()
         self.campaigns_df = campaigns_df if campaigns_df is not None else pd.DataFrame()
         self.social_df = social_df if social_df is not None else pd.DataFrame()
 
-        # Map de columnas normalizadas -> nombre original (para campaigns y users)
-        self.campaigns_col_map = {self._normalize(c): c for c in self.campaigns_df.columns}
-        self.users_col_map = {self._normalize(c): c for c in self.users_df.columns}
-        self.social_col_map = {self._normalize(c): c for c in self.social_df.columns}
-
-    def _normalize(self, name: str) -> str:
-        if not isinstance(name, str):
-            return ''
-        nk = unicodedata.normalize('NFKD', name)
-        ascii_name = nk.encode('ASCII', 'ignore').decode('ASCII')
-        return ascii_name.lower().replace(' ', '').replace('-', '').replace('_', '')
-
-    def _find_col(self, col_map: Dict[str, str], *candidates: str) -> Optional[str]:
-        for cand in candidates:
-            if not cand:
-                continue
-            norm = self._normalize(cand)
-            if norm in col_map:
-                return col_map[norm]
-        return None
-
-    def _sum_col(self, df: pd.DataFrame, col_map: Dict[str, str], *candidates: str) -> float:
-        col = self._find_col(col_map, *candidates)
+        # Columnas físicas de cada campo lógico (resueltas una vez por esquema)
+        self.campaign_cols = bind_schema('campaigns', tuple(self.campaigns_df.columns))
+        self.user_cols = bind_schema('users', tuple(self.users_df.columns))
+
+        # Con la versión del dataset, el índice y el cubo diario se comparten entre requests
+        self.data_version = data_version
+        self._campaign_index = None
+        self._daily_rollup = None
+        self._periods = {}
+        self._memo = {}
+        self._metrics = {}
+
+    @property
+    def campaign_index(self) -> CampaignIndex:
+        if self._campaign_index is None:
+            if self.data_version is not None:
+                self._campaign_index = get_campaign_index(self.campaigns_df, self.campaign_cols['date'], self.data_version)
+            else:
+                self._campaign_index = CampaignIndex(self.campaigns_df, self.campaign_cols['date'])
+        return self._campaign_index
+
+    @property
+    def daily_rollup(self) -> Optional[DailyRollup]:
+        """Cubo diario de las campañas (None si no hay columna de fecha)."""
+        if self.campaign_index.date_col is None:
+            return None
+        if self._daily_rollup is None:
+            if self.data_version is not None:
+                self._daily_rollup = get_daily_rollup(self.campaigns_df, self.campaign_cols, self.data_version)
+            else:
+                self._daily_rollup = DailyRollup.from_frame(self.campaigns_df, self.campaign_cols)
+        return self._daily_rollup
+
+    def _period_campaigns(self, period: str):
+        """
+        (fecha de inicio, campañas del período). Se resuelve una vez por período
+        y lo comparten todas las métricas calculadas con este servicio.
+        """
+        if period not in self._periods:
+            start_date = self.get_period_filter(period)
+            self._periods[period] = (start_date, self.campaign_index.since(start_date))
+        return self._periods[period]
+
+    def _sum_col(self, df: pd.DataFrame, col: Optional[str]) -> float:
         if col and col in df.columns:
             return float(df[col].fillna(0).astype(float).sum())
         return 0.0
 
-    def _row_value(self, row, col_map: Dict[str, str], *candidates: str):
-        col = self._find_col(col_map, *candidates)
-        if col and col in row:
-            val = row.get(col, 0)
-            try:
-                return float(val) if pd.notnull(val) else 0.0
-            except Exception:
-                return 0.0
-        return 0.0
+    def _numeric_col(self, df: pd.DataFrame, col: Optional[str]) -> np.ndarray:
+        """Columna como float64 (ceros si falta la columna o el valor no es numérico)."""
+        if col is None or col not in df.columns:
+            return np.zeros(len(df))
+        return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
 
     def _date_labels_range(self, start_date: datetime) -> List[str]:
         today = datetime.now().date()
@@ -66,23 +360,25 @@ class AnalyticsService:
         
         return period_map.get(period, today - timedelta(days=30))
     
+    @_memoized
     def get_overview_metrics(self, period: str = '30days') -> Dict:
         """Calcula métricas generales del período"""
         start_date = self.get_period_filter(period)
         
-        # Convertir columnas de fecha si existen
-        fecha_col = self._find_col(self.campaigns_col_map, 'Fecha Envío', 'fechaenvio', 'fecha')
-        if fecha_col and fecha_col in self.campaigns_df.columns:
-            self.campaigns_df[fecha_col] = pd.to_datetime(self.campaigns_df[fecha_col], errors='coerce')
-            filtered_campaigns = self.campaigns_df[self.campaigns_df[fecha_col] >= start_date]
+        rollup = self.daily_rollup
+        if rollup is not None:
+            # Suma por rango sobre el cubo diario
+            totals = rollup.totals(start_date)
         else:
-            filtered_campaigns = self.campaigns_df.copy()
+            _, filtered_campaigns = self._period_campaigns(period)
+            totals = {field: self._sum_col(filtered_campaigns, self.campaign_cols[field])
+                      for field in ('conversions', 'sent', 'opens', 'clicks')}
+            totals['campaigns'] = len(filtered_campaigns)
         
-        # Calcular métricas con búsqueda robusta de columnas
-        total_conversions = self._sum_col(filtered_campaigns, self.campaigns_col_map, 'Conversiones', 'conversion', 'conversions')
-        total_sent = self._sum_col(filtered_campaigns, self.campaigns_col_map, 'enviados', 'Destinatarios', 'recipients', 'destinatarios')
-        total_opens = self._sum_col(filtered_campaigns, self.campaigns_col_map, 'Tasa Apertura', 'opens', 'open_rate')
-        total_clicks = self._sum_col(filtered_campaigns, self.campaigns_col_map, 'CTR', 'clicks_total', 'clics')
+        total_conversions = totals['conversions']
+        total_sent = totals['sent']
+        total_opens = totals['opens']
+        total_clicks = totals['clicks']
         
         # Tasas
         open_rate = (total_opens / total_sent * 100) if total_sent > 0 else 0
@@ -100,21 +396,18 @@ class AnalyticsService:
             'ctr': round(ctr, 2),
             'conversion_rate': round(conversion_rate, 2),
             'roi': round(roi, 2),
-            'total_campaigns': int(len(filtered_campaigns)),
+            'total_campaigns': int(totals['campaigns']),
             'period': period
         }
     
+    @_memoized
     def get_conversion_evolution(self, period: str = '30days') -> Dict:
         """Obtiene la evolución de conversiones día a día"""
         start_date = self.get_period_filter(period)
-        
-        fecha_col = self._find_col(self.campaigns_col_map, 'Fecha Envío', 'fechaenvio', 'fecha')
-        conv_col = self._find_col(self.campaigns_col_map, 'Conversiones', 'conversion', 'conversions')
-        opens_col = self._find_col(self.campaigns_col_map, 'Tasa Apertura', 'opens')
-        clicks_col = self._find_col(self.campaigns_col_map, 'CTR', 'clics')
+        rollup = self.daily_rollup
         
         # Si no hay columna de fecha, generar datos sintéticos como antes
-        if not fecha_col or fecha_col not in self.campaigns_df.columns:
+        if rollup is None:
             days = 30 if period == '30days' else 7
             dates = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days-1, -1, -1)]
             conversions = [int(np.random.randint(50, 200)) for _ in range(days)]
@@ -122,98 +415,102 @@ class AnalyticsService:
             clicks = [int(c * np.random.uniform(1.2, 2)) for c in conversions]
             return {'labels': dates, 'conversions': conversions, 'opens': opens, 'clicks': clicks}
         
-        self.campaigns_df[fecha_col] = pd.to_datetime(self.campaigns_df[fecha_col], errors='coerce')
-        filtered = self.campaigns_df[self.campaigns_df[fecha_col] >= start_date].copy()
-        
         labels = self._date_labels_range(start_date)
-        if filtered.empty or conv_col is None:
+        if self.campaign_cols['conversions'] is None:
             # devolver rango de fechas con ceros si no hay datos
             zeros = [0] * len(labels)
             return {'labels': labels, 'conversions': zeros, 'opens': zeros.copy(), 'clicks': zeros.copy()}
         
-        # Agrupar por día usando la columna de fecha encontrada
-        grouped = filtered.groupby(filtered[fecha_col].dt.date).agg({conv_col: 'sum'})
-        if opens_col:
-            grouped[opens_col] = filtered.groupby(filtered[fecha_col].dt.date).agg({opens_col: 'sum'})
-        if clicks_col:
-            grouped[clicks_col] = filtered.groupby(filtered[fecha_col].dt.date).agg({clicks_col: 'sum'})
+        # Valores diarios leídos del cubo, alineados con labels
+        series = rollup.daily_series(start_date, labels)
         
-        # Construir arrays alineados con labels
-        conv_map = {str(k): int(v[conv_col]) for k, v in grouped.iterrows()} if conv_col else {}
-        opens_map = {}
-        clicks_map = {}
-        if opens_col:
-            opens_map = {str(k): int(v[opens_col]) for k, v in grouped.iterrows()}
-        if clicks_col:
-            clicks_map = {str(k): int(v[clicks_col]) for k, v in grouped.iterrows()}
-        
-        conversions = [conv_map.get(label, 0) for label in labels]
-        opens = [opens_map.get(label, 0) for label in labels] if opens_col else [0]*len(labels)
-        clicks = [clicks_map.get(label, 0) for label in labels] if clicks_col else [0]*len(labels)
-        
-        return {'labels': labels, 'conversions': conversions, 'opens': opens, 'clicks': clicks}
+        return {
+            'labels': labels,
+            'conversions': [int(v) for v in series['conversions']],
+            'opens': [int(v) for v in series['opens']],
+            'clicks': [int(v) for v in series['clicks']]
+        }
     
-    def get_top_campaigns(self, period: str = '30days', limit: int = 10) -> List[Dict]:
-        """Obtiene las mejores campañas del período"""
-        start_date = self.get_period_filter(period)
+    def _campaign_metrics(self, period: str) -> Dict[str, np.ndarray]:
+        """Métricas de cada campaña del período como columnas (tasas sin redondear)."""
+        if period in self._metrics:
+            return self._metrics[period]
         
-        fecha_col = self._find_col(self.campaigns_col_map, 'Fecha Envío', 'fechaenvio', 'fecha')
-        if fecha_col and fecha_col in self.campaigns_df.columns:
-            self.campaigns_df[fecha_col] = pd.to_datetime(self.campaigns_df[fecha_col], errors='coerce')
-            filtered = self.campaigns_df[self.campaigns_df[fecha_col] >= start_date]
-        else:
-            filtered = self.campaigns_df.copy()
+        _, filtered = self._period_campaigns(period)
+        cols = self.campaign_cols
+        enviados = self._numeric_col(filtered, cols['sent'])
+        aperturas = self._numeric_col(filtered, cols['opens'])
+        clicks = self._numeric_col(filtered, cols['clicks'])
+        conversiones = self._numeric_col(filtered, cols['conversions'])
         
-        campaigns = []
-        # prepare column candidates
-        sent_candidates = ('Destinatarios', 'sent', 'recipients', 'destinatarios')
-        opens_candidates = ('aperturas', 'opens', 'Tasa Apertura')
-        clicks_candidates = ('clicks', 'CTR')
-        conv_candidates = ('Conversiones', 'conversion', 'conversions')
-        name_candidates = ('nombre', 'name', 'campaign_name', 'titulo')
-        channel_candidates = ('canal', 'channel', 'media')
+        # Tasas de todas las campañas del período en una sola pasada
+        with np.errstate(divide='ignore', invalid='ignore'):
+            has_sent = enviados > 0
+            open_rate = np.where(has_sent, aperturas / enviados * 100, 0.0)
+            ctr = np.where(has_sent, clicks / enviados * 100, 0.0)
+            conversion_rate = np.where(has_sent, conversiones / enviados * 100, 0.0)
         
-        for _, row in filtered.head(limit).iterrows():
-            enviados = self._row_value(row, self.campaigns_col_map, *sent_candidates)
-            aperturas = self._row_value(row, self.campaigns_col_map, *opens_candidates)
-            clicks = self._row_value(row, self.campaigns_col_map, *clicks_candidates)
-            conversiones = self._row_value(row, self.campaigns_col_map, *conv_candidates)
-            
-            open_rate = (aperturas / enviados * 100) if enviados > 0 else 0
-            ctr = (clicks / enviados * 100) if enviados > 0 else 0
-            conversion_rate = (conversiones / enviados * 100) if enviados > 0 else 0
-            
-            name_col = self._find_col(self.campaigns_col_map, *name_candidates)
-            channel_col = self._find_col(self.campaigns_col_map, *channel_candidates)
-            name = row.get(name_col, 'Sin nombre') if name_col else row.get('campaign_name', 'Sin nombre')
-            channel = row.get(channel_col, 'email') if channel_col else 'email'
-            
-            campaigns.append({
+        n = len(filtered)
+        metrics = {
+            'name': filtered[cols['name']].to_numpy() if cols['name'] else np.full(n, 'Sin nombre', dtype=object),
+            'channel': filtered[cols['channel']].to_numpy() if cols['channel'] else np.full(n, 'email', dtype=object),
+            'sent': enviados,
+            'open_rate': open_rate,
+            'ctr': ctr,
+            'conversion_rate': conversion_rate,
+            'conversions': conversiones,
+        }
+        self._metrics[period] = metrics
+        return metrics
+    
+    def _campaign_records(self, metrics: Dict[str, np.ndarray], positions: np.ndarray) -> List[Dict]:
+        """Filas de campañas (formato de la API) para las posiciones indicadas."""
+        return [
+            {
                 'name': name,
                 'channel': channel,
-                'sent': int(enviados),
-                'open_rate': round(open_rate, 2),
-                'ctr': round(ctr, 2),
-                'conversion_rate': round(conversion_rate, 2),
-                'revenue': round(conversiones * 75, 2)
-            })
+                'sent': int(sent),
+                'open_rate': round(float(o), 2),
+                'ctr': round(float(c), 2),
+                'conversion_rate': round(float(cr), 2),
+                'revenue': round(float(conv) * 75, 2)
+            }
+            for name, channel, sent, o, c, cr, conv in zip(
+                metrics['name'][positions].tolist(), metrics['channel'][positions].tolist(),
+                metrics['sent'][positions], metrics['open_rate'][positions], metrics['ctr'][positions],
+                metrics['conversion_rate'][positions], metrics['conversions'][positions]
+            )
+        ]
+    
+    @_memoized
+    def get_top_campaigns(self, period: str = '30days', limit: int = 10) -> List[Dict]:
+        """Obtiene las mejores campañas del período"""
+        metrics = self._campaign_metrics(period)
+        
+        if len(metrics['sent']) == 0 or limit <= 0:
+            return []
         
-        campaigns.sort(key=lambda x: x['conversion_rate'], reverse=True)
-        return campaigns
+        # Top-k por tasa de conversión redondeada (empates en el orden original, como un sort estable)
+        top = pd.Series(metrics['conversion_rate'].round(2)).nlargest(limit, keep='first').index.to_numpy()
+        return self._campaign_records(metrics, top)
     
+    def iter_campaigns(self, period: str = '30days', chunk_size: int = 5000):
+        """
+        Todas las campañas del período, ordenadas como get_top_campaigns y
+        entregadas por bloques de `chunk_size` filas (sin límite de filas).
+        """
+        metrics = self._campaign_metrics(period)
+        order = np.argsort(-metrics['conversion_rate'].round(2), kind='stable')
+        for start in range(0, len(order), chunk_size):
+            yield self._campaign_records(metrics, order[start:start + chunk_size])
+    
+    @_memoized
     def get_channel_performance(self, period: str = '30days') -> Dict:
         """Analiza el rendimiento por canal"""
-        start_date = self.get_period_filter(period)
+        _, filtered = self._period_campaigns(period)
         
-        fecha_col = self._find_col(self.campaigns_col_map, 'Fecha Envío', 'fechaenvio', 'fecha')
-        if fecha_col and fecha_col in self.campaigns_df.columns:
-            self.campaigns_df[fecha_col] = pd.to_datetime(self.campaigns_df[fecha_col], errors='coerce')
-            filtered = self.campaigns_df[self.campaigns_df[fecha_col] >= start_date]
-        else:
-            filtered = self.campaigns_df.copy()
-        
-        channel_col = self._find_col(self.campaigns_col_map, 'canal', 'channel', 'media')
-        conv_col = self._find_col(self.campaigns_col_map, 'conversiones', 'conversion', 'conversions')
+        channel_col = self.campaign_cols['channel']
+        conv_col = self.campaign_cols['conversions']
         
         if conv_col is None or conv_col not in filtered.columns:
             return {'email': 45.2, 'social': 38.5, 'sms': 16.3}
@@ -226,22 +523,25 @@ class AnalyticsService:
             else:
                 return {'email': 0.0}
         
-        channel_data = filtered.groupby(channel_col).agg({conv_col: 'sum'}).reset_index()
-        total = float(channel_data[conv_col].sum())
+        if self.daily_rollup is not None:
+            channel_data = self.daily_rollup.by_channel(self.get_period_filter(period), 'conversions')
+        else:
+            channel_data = filtered.groupby(channel_col)[conv_col].sum()
+        total = float(channel_data.sum())
         result = {}
         
-        for _, row in channel_data.iterrows():
-            channel = row[channel_col]
-            percentage = (row[conv_col] / total * 100) if total > 0 else 0
+        for channel, conversions in channel_data.items():
+            percentage = (conversions / total * 100) if total > 0 else 0
             result[channel] = round(percentage, 2)
         
         return result
     
+    @_memoized
     def get_segment_performance(self) -> List[Dict]:
         """Analiza el rendimiento por segmento de usuario"""
-        segment_col = self._find_col(self.users_col_map, 'segment', 'segmento', 'Tipo Usuario')
-        user_id_col = self._find_col(self.users_col_map, 'user_id', 'userid', 'id')
-        clv_col = self._find_col(self.users_col_map, 'clv', 'lifetimevalue')
+        segment_col = self.user_cols['segment']
+        user_id_col = self.user_cols['user_id']
+        clv_col = self.user_cols['clv']
         
         if segment_col is None or user_id_col is None:
             # Datos de ejemplo
@@ -279,9 +579,14 @@ class AnalyticsService:
         return export_data
 
 
-def get_analytics_data(users_df, campaigns_df, social_df, period: str = '30days'):
-    """Función principal para obtener todos los datos de analytics"""
-    service = AnalyticsService(users_df, campaigns_df, social_df)
+def get_analytics_data(users_df, campaigns_df, social_df, period: str = '30days', data_version: Optional[str] = None,
+                       service: Optional[AnalyticsService] = None):
+    """
+    Función principal para obtener todos los datos de analytics.
+    Si se pasa `service`, reutiliza las métricas que ese servicio ya calculó en el request.
+    """
+    if service is None:
+        service = AnalyticsService(users_df, campaigns_df, social_df, data_version=data_version)
     
     return {
         'overview': service.get_overview_metrics(period),
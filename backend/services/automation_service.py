@@ -1,20 +1,59 @@
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+import os
 import random
-from .database import AutomationDB
+import threading
+from collections import defaultdict
+from .database import AutomationDB, empty_flow_metrics
+from .flow_scheduler import ExecutionScheduler
+
+# Las ejecuciones de flujos pausados o con error se reintentan con esta espera
+EXECUTION_RETRY_MINUTES = 60
+# Plazo de una ejecución reclamada: si el proceso cae sin guardar su avance,
+# otro la retoma al vencer
+CLAIM_LEASE_MINUTES = 15
+# Pasos sin espera que una ejecución puede encadenar en una misma ronda
+MAX_STEPS_PER_RUN = 50
+# Usuarios que ejecutan juntos un mismo paso (un envío y un executemany por lote)
+STEP_BATCH_SIZE = int(os.getenv("AUTOMATION_STEP_BATCH_SIZE", "500"))
+
+# Eventos de otros módulos y el trigger de flujo que activan; un evento que no
+# figura aquí activa los flujos cuyo trigger_type tiene su mismo nombre
+EVENT_TRIGGERS = {
+    'user_registered': 'new_user',
+    'cart_abandoned': 'cart_abandoned',
+    'purchase_completed': 'purchase',
+    'user_birthday': 'birthday',
+    'user_inactive': 'inactive_user'
+}
 
 class AutomationService:
-    def __init__(self):
-        self.db = AutomationDB()
+    def __init__(self, step_batch_size: int = STEP_BATCH_SIZE, db: Optional[AutomationDB] = None):
+        self.db = db or AutomationDB()
+        self.step_batch_size = max(int(step_batch_size), 1)
+        self.scheduler = ExecutionScheduler(self.db, self.process_scheduled_steps)
+        self._processing_lock = threading.Lock()
+        # Índice en memoria de flujos activos por trigger, válido para una
+        # versión de los flujos (se rearma cuando cualquier proceso los modifica)
+        self._trigger_index = None
+        self._trigger_index_version = None
+        self._trigger_index_lock = threading.Lock()
+    
+    def start_scheduler(self):
+        """Carga las ejecuciones pendientes desde SQLite e inicia el planificador"""
+        self.scheduler.start()
+    
+    def stop_scheduler(self):
+        self.scheduler.stop()
     
     def get_all_flows(self) -> List[Dict[str, Any]]:
         """Obtiene todos los flujos con sus métricas calculadas"""
         flows = self.db.get_all_flows()
+        all_metrics = self.db.get_all_flow_metrics()
         
         # Enriquecer con métricas calculadas
         for flow in flows:
-            metrics = self._calculate_flow_metrics(flow['id'])
-            flow['metrics'] = metrics
+            flow['metrics'] = self._calculate_flow_metrics(flow, all_metrics.get(flow['id']))
         
         return flows
     
@@ -22,7 +61,7 @@ class AutomationService:
         """Obtiene un flujo específico con sus métricas"""
         flow = self.db.get_flow(flow_id)
         if flow:
-            flow['metrics'] = self._calculate_flow_metrics(flow_id)
+            flow['metrics'] = self._calculate_flow_metrics(flow, self.db.get_flow_metrics(flow_id))
         return flow
     
     def create_flow(self, flow_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -121,6 +160,7 @@ class AutomationService:
     def get_dashboard_stats(self) -> Dict[str, Any]:
         """Obtiene estadísticas generales para el dashboard"""
         flows = self.db.get_all_flows()
+        all_metrics = self.db.get_all_flow_metrics()
         
         active_flows = [f for f in flows if f['status'] == 'active']
         total_users_in_flows = sum(f['users_in_flow'] for f in active_flows)
@@ -130,7 +170,7 @@ class AutomationService:
         total_time_saved = 0
         
         for flow in active_flows:
-            metrics = self.db.get_flow_metrics(flow['id'])
+            metrics = all_metrics.get(flow['id'], {})
             total_revenue += metrics.get('revenue_generated', 0)
         
         # Estimación de tiempo ahorrado (heurística simple)
@@ -144,13 +184,13 @@ class AutomationService:
             'revenue_increase_vs_manual': 23  # Porcentaje promedio
         }
     
-    def _calculate_flow_metrics(self, flow_id: str) -> Dict[str, Any]:
-        """Calcula métricas de rendimiento para un flujo"""
-        metrics = self.db.get_flow_metrics(flow_id)
-        flow = self.db.get_flow(flow_id)
-        
-        if not flow:
-            return metrics
+    def _calculate_flow_metrics(self, flow: Dict[str, Any], metrics: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Calcula métricas de rendimiento para un flujo a partir de sus métricas
+        agregadas (las de get_all_flow_metrics o get_flow_metrics)
+        """
+        if metrics is None:
+            metrics = empty_flow_metrics(flow['id'])
         
         # Si no hay datos reales, generar métricas de ejemplo basadas en el tipo
         if metrics['total_sent'] == 0:
@@ -204,97 +244,285 @@ class AutomationService:
     
     # Métodos para ejecución de flujos (lógica mecánica)
     
-    def check_and_trigger_flows(self, user_data: Dict[str, Any], event_type: str):
+    def check_and_trigger_flows(self, user_data: Dict[str, Any], event_type: str) -> List[Dict[str, Any]]:
         """
         Verifica si un evento del usuario debe activar algún flujo
         Esta función se llamaría desde otros módulos cuando ocurran eventos
         """
-        active_flows = [f for f in self.db.get_all_flows() if f['status'] == 'active']
+        return self.ingest_events([{
+            'event_type': event_type,
+            'user_id': user_data['user_id'],
+            'data': user_data.get('data')
+        }])['executions']
+    
+    def ingest_events(self, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Inicia los flujos activos que corresponden a cada evento
+        ({event_type, user_id, data}). Los flujos se buscan en el índice en
+        memoria por trigger; las ejecuciones de todos los eventos se guardan
+        con una sola inserción.
+        """
+        trigger_index = self._get_trigger_index()
+        now = datetime.now()
+        
+        executions = []
+        matched_events = 0
+        for event in events:
+            trigger_type = EVENT_TRIGGERS.get(event['event_type'], event['event_type'])
+            entries = trigger_index.get(trigger_type)
+            if not entries:
+                continue
+            matched_events += 1
+            for flow_id, entry_step_id in entries:
+                executions.append({
+                    'flow_id': flow_id,
+                    'user_id': event['user_id'],
+                    'current_step_id': entry_step_id,
+                    'started_at': now,
+                    'last_action_at': now,
+                    'next_run_at': now,
+                    'metadata': {'event_type': event['event_type'], **(event.get('data') or {})}
+                })
+        
+        self._start_executions(executions)
         
-        for flow in active_flows:
-            # Mapeo simple de eventos a triggers
-            trigger_mapping = {
-                'user_registered': 'new_user',
-                'cart_abandoned': 'cart_abandoned',
-                'purchase_completed': 'purchase',
-                'user_birthday': 'birthday',
-                'user_inactive': 'inactive_user'
-            }
+        return {
+            'received': len(events),
+            'matched': matched_events,
+            'executions_started': len(executions),
+            'executions': executions
+        }
+    
+    def _get_trigger_index(self) -> Dict[str, List[tuple]]:
+        """trigger_type -> [(flow_id, id del paso trigger)] de los flujos activos"""
+        # Lectura de una fila: detecta flujos modificados por otros procesos
+        version = self.db.get_flows_version()
+        with self._trigger_index_lock:
+            if self._trigger_index is not None and self._trigger_index_version == version:
+                return self._trigger_index
+        
+        trigger_index = defaultdict(list)
+        for flow in self.db.get_all_flows():
+            if flow['status'] != 'active':
+                continue
+            trigger_step = next((s for s in flow['steps'] if s['type'] == 'trigger'), None)
+            if trigger_step:
+                trigger_index[flow['trigger_type']].append((flow['id'], trigger_step['step_id']))
+        trigger_index = dict(trigger_index)
+        
+        with self._trigger_index_lock:
+            # Se guarda con la versión leída antes de armarlo: si un flujo cambió
+            # mientras tanto, la próxima llamada ve una versión nueva y lo rearma
+            self._trigger_index = trigger_index
+            self._trigger_index_version = version
+        return trigger_index
+    
+    def _start_executions(self, executions: List[Dict[str, Any]]):
+        """Guarda las ejecuciones nuevas (agrega su 'id') y las entrega al planificador"""
+        if not executions:
+            return
+        
+        execution_ids = self.db.create_executions(executions)
+        for execution, execution_id in zip(executions, execution_ids):
+            execution['id'] = execution_id
+            self.scheduler.schedule(execution_id, execution['next_run_at'])
+    
+    def process_scheduled_steps(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Procesa pasos programados que deben ejecutarse ahora
+        La llama el planificador cuando vence alguna ejecución (también puede
+        llamarse periódicamente). Las ejecuciones vencidas se agrupan por
+        (flujo, paso): cada lote de hasta `step_batch_size` usuarios ejecuta el
+        paso una sola vez y avanza por next_steps hasta una espera o el final
+        del flujo; su nuevo estado se guarda con un único executemany. Antes se
+        reclaman en la base, así con varios procesos cada ejecución corre una vez.
+        """
+        now = now or datetime.now()
+        processed = completed = 0
+        
+        with self._processing_lock:
+            due_ids = self.scheduler.pop_due(now)
+            if not due_ids:
+                return {'processed': 0, 'completed': 0}
+            
+            retry_at = now + timedelta(minutes=EXECUTION_RETRY_MINUTES)
+            try:
+                # Las que ya avanzaron, terminaron o reclamó otro proceso no se devuelven
+                claimed = self.db.claim_executions(due_ids, now, now + timedelta(minutes=CLAIM_LEASE_MINUTES))
+                executions = self.db.get_executions(claimed)
+            except Exception as e:
+                print(f"Error al reclamar {len(due_ids)} ejecuciones vencidas: {str(e)}")
+                for execution_id in due_ids:
+                    self.scheduler.schedule(execution_id, retry_at)
+                return {'processed': 0, 'completed': 0}
+            
+            cohorts = defaultdict(list)
+            for execution in executions.values():
+                cohorts[(execution['flow_id'], execution['current_step_id'])].append(execution)
             
-            if flow['trigger_type'] == trigger_mapping.get(event_type):
-                self._start_flow_execution(flow['id'], user_data['user_id'])
+            flows = {}
+            for (flow_id, _), executions in cohorts.items():
+                for start in range(0, len(executions), self.step_batch_size):
+                    batch = executions[start:start + self.step_batch_size]
+                    try:
+                        if flow_id not in flows:
+                            flows[flow_id] = self.db.get_flow(flow_id)
+                        updates = self._advance_batch(batch, flows[flow_id], now)
+                        self.db.advance_executions(updates)
+                    except Exception as e:
+                        print(f"Error al procesar un lote de {len(batch)} ejecuciones del flujo {flow_id}: {str(e)}")
+                        self._retry_batch([execution['id'] for execution in batch], retry_at)
+                        continue
+                    
+                    for update in updates:
+                        if update['completed']:
+                            completed += 1
+                        else:
+                            self.scheduler.schedule(update['id'], update['next_run_at'])
+                    processed += len(updates)
+        
+        return {'processed': processed, 'completed': completed}
     
-    def _start_flow_execution(self, flow_id: str, user_id: str):
-        """Inicia la ejecución de un flujo para un usuario específico"""
-        flow = self.db.get_flow(flow_id)
+    def _retry_batch(self, execution_ids: List[str], retry_at: datetime):
+        """Guarda el reintento de un lote fallido en SQLite y lo entrega al planificador"""
+        try:
+            self.db.reschedule_executions(execution_ids, retry_at)
+        except Exception as e:
+            # Sin el UPDATE, el reintento queda solo en el heap de este proceso
+            print(f"No se pudo guardar el reintento de {len(execution_ids)} ejecuciones: {str(e)}")
+        for execution_id in execution_ids:
+            self.scheduler.schedule(execution_id, retry_at)
+    
+    def _advance_batch(self, executions: List[Dict[str, Any]], flow: Optional[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        """Ejecuta los pasos vencidos de un lote de ejecuciones y devuelve su nuevo estado"""
+        updates = [
+            {
+                'id': execution['id'],
+                'flow_id': execution['flow_id'],
+                'user_id': execution['user_id'],
+                'current_step_id': execution['current_step_id'],
+                'next_run_at': None,
+                'completed': False
+            }
+            for execution in executions
+        ]
         
+        # Flujo eliminado
         if not flow:
-            return
+            for update in updates:
+                update['completed'] = True
+            return updates
         
-        # Encontrar el primer paso (trigger)
-        trigger_step = next((s for s in flow['steps'] if s['type'] == 'trigger'), None)
+        retry_at = now + timedelta(minutes=EXECUTION_RETRY_MINUTES)
         
-        if not trigger_step:
-            return
+        # Flujo pausado: las ejecuciones esperan a que se reactive
+        if flow['status'] != 'active':
+            for update in updates:
+                update['next_run_at'] = retry_at
+            return updates
         
-        # Crear ejecución en la BD
-        execution_data = {
-            'flow_id': flow_id,
-            'user_id': user_id,
-            'current_step_id': trigger_step['step_id'],
-            'started_at': datetime.now(),
-            'last_action_at': datetime.now(),
-            'metadata': {}
-        }
-        
-        # Aquí se guardaría en la BD y se programarían los siguientes pasos
-        # Por ahora solo simulamos el proceso
+        steps = {step['step_id']: step for step in flow['steps']}
+        pending = updates
         
-        return execution_data
+        for _ in range(MAX_STEPS_PER_RUN):
+            if not pending:
+                return updates
+            
+            # Los usuarios del lote que están en el mismo paso lo ejecutan juntos
+            cohorts = defaultdict(list)
+            for update in pending:
+                cohorts[update['current_step_id']].append(update)
+            pending = []
+            
+            for step_id, cohort in cohorts.items():
+                step = steps.get(step_id)
+                if step is None:
+                    for update in cohort:
+                        update['completed'] = True
+                    continue
+                
+                try:
+                    results = self.execute_step_batch(cohort, step)
+                except Exception as e:
+                    print(f"Error al ejecutar el paso {step_id} del flujo {flow['id']} para {len(cohort)} usuarios: {str(e)}")
+                    for update in cohort:
+                        update['next_run_at'] = retry_at
+                    continue
+                
+                run_at = now + timedelta(hours=self._step_delay_hours(step))
+                for update, result in zip(cohort, results):
+                    next_step_id = self._next_step_id(step, result)
+                    if next_step_id not in steps:
+                        update['completed'] = True
+                    elif run_at > now:
+                        update['current_step_id'] = next_step_id
+                        update['next_run_at'] = run_at
+                    else:
+                        update['current_step_id'] = next_step_id
+                        pending.append(update)
+        
+        # Demasiados pasos encadenados sin espera (probable ciclo en el flujo)
+        if pending:
+            print(f"{len(pending)} ejecuciones del flujo {flow['id']} superaron {MAX_STEPS_PER_RUN} pasos sin espera")
+            for update in pending:
+                update['next_run_at'] = retry_at
+        return updates
     
-    def process_scheduled_steps(self):
-        """
-        Procesa pasos programados que deben ejecutarse ahora
-        Esta función se ejecutaría periódicamente (cada minuto, por ejemplo)
-        """
-        # Lógica para verificar ejecuciones pendientes y ejecutar acciones
-        # Por ejemplo: enviar emails, publicar en redes sociales, etc.
-        pass
+    def _next_step_id(self, step: Dict[str, Any], result: Dict[str, Any]) -> Optional[str]:
+        """Paso siguiente; los flujos son secuenciales y se sigue el primer next_step"""
+        if step['type'] == 'condition':
+            return result.get('next_step_id')
+        next_steps = step.get('next_steps') or []
+        return next_steps[0] if next_steps else None
     
-    def execute_step(self, execution_id: str, step_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _step_delay_hours(self, step: Dict[str, Any]) -> float:
+        """Espera entre un paso y el siguiente (pasos delay y triggers con delay_hours)"""
+        config = step.get('config') or {}
+        if step['type'] == 'delay':
+            return float(config.get('hours', 0))
+        if step['type'] == 'trigger':
+            return float(config.get('delay_hours', 0))
+        return 0
+    
+    def execute_step_batch(self, executions: List[Dict[str, Any]], step_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
-        Ejecuta un paso específico del flujo
+        Ejecuta un paso para un lote de ejecuciones que están en él.
+        Emails y posts se despachan una vez para todo el lote; las condiciones
+        se evalúan por usuario. Devuelve un resultado por ejecución.
         """
         step_type = step_data['type']
         
         if step_type == 'email':
-            return self._execute_email_step(step_data)
+            result = self._execute_email_batch(step_data, [e['user_id'] for e in executions])
         elif step_type == 'social_post':
-            return self._execute_social_step(step_data)
+            result = self._execute_social_batch(step_data, [e['user_id'] for e in executions])
         elif step_type == 'delay':
-            return self._schedule_delay(execution_id, step_data)
+            result = self._schedule_delay(None, step_data)
         elif step_type == 'condition':
-            return self._evaluate_condition(execution_id, step_data)
+            return [self._evaluate_condition(e['id'], step_data) for e in executions]
+        else:
+            result = {'status': 'completed'}
         
-        return {'status': 'completed'}
+        return [result] * len(executions)
     
-    def _execute_email_step(self, step_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Ejecuta el envío de un email (simulado)"""
+    def _execute_email_batch(self, step_data: Dict[str, Any], user_ids: List[str]) -> Dict[str, Any]:
+        """Envía el email del paso a todos los usuarios del lote en un solo envío (simulado)"""
         config = step_data['config']
         
-        # Aquí se integraría con un servicio de email real
-        # Por ahora simulamos el envío
+        # Aquí se integraría con el envío masivo del servicio de email
         
         return {
             'status': 'sent',
             'subject': config.get('subject', ''),
+            'recipients': len(user_ids),
             'timestamp': datetime.now().isoformat()
         }
     
-    def _execute_social_step(self, step_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Ejecuta la publicación en redes sociales (simulado)"""
+    def _execute_social_batch(self, step_data: Dict[str, Any], user_ids: List[str]) -> Dict[str, Any]:
+        """Publicación en redes sociales para la cohorte del lote (simulado)"""
         return {
             'status': 'posted',
+            'audience': len(user_ids),
             'timestamp': datetime.now().isoformat()
         }
     
@@ -223,7 +223,7 @@ def get_campaign_detail(campaign_id):
     return {
         "id": campaign['ID'],
         "name": campaign['Nombre'],
-        "date": campaign['Fecha Envío'],
+        "date": campaign['Fecha Envío'].strftime('%Y-%m-%d') if pd.notna(campaign['Fecha Envío']) else None,
         "recipients": int(campaign['Destinatarios']),
         "open_rate": round(campaign['Tasa Apertura'], 2),
         "ctr": round(campaign['CTR'], 2),
@@ -0,0 +1,184 @@
+"""
+Modelo K-Means persistido para la asignación de Cluster_AI.
+
+El scaler (media/escala) y los centroides se guardan versionados en
+`data/snapshots/models`. La asignación diaria es un nearest-centroid
+vectorizado; el reentrenamiento solo ocurre a pedido o cuando la deriva
+supera DRIFT_THRESHOLD, y arranca desde los centroides anteriores.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+from .. import data_handler
+
+MODELS_PATH = data_handler.SNAPSHOT_PATH / "models"
+LATEST_FILE = MODELS_PATH / "kmeans_latest.json"
+
+# Aumento relativo de la inercia media (distancia² al centroide) que dispara un reentrenamiento
+DRIFT_THRESHOLD = 0.25
+
+
+class ClusterModel:
+    """Scaler + centroides de un K-Means ya entrenado."""
+
+    def __init__(self, mean, scale, centroids, version=1, inertia_per_sample=0.0,
+                 n_samples=0, fitted_at=None, warm_start=False):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.version = int(version)
+        self.inertia_per_sample = float(inertia_per_sample)
+        self.n_samples = int(n_samples)
+        self.fitted_at = fitted_at or datetime.now().isoformat()
+        self.warm_start = bool(warm_start)
+
+    @property
+    def n_clusters(self):
+        return self.centroids.shape[0]
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+    def predict(self, X):
+        """Asigna cada fila al centroide más cercano. Devuelve (labels, distancias²)."""
+        Xs = self.transform(X)
+        # ||x - c||² = ||x||² - 2 x·c + ||c||²
+        distances = (
+            np.einsum('ij,ij->i', Xs, Xs)[:, None]
+            - 2.0 * Xs @ self.centroids.T
+            + np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+        )
+        labels = distances.argmin(axis=1)
+        min_distances = np.maximum(distances[np.arange(len(labels)), labels], 0.0)
+        return labels, min_distances
+
+    def drift(self, min_distances) -> float:
+        """Aumento relativo de la inercia media respecto de la observada al entrenar."""
+        if self.inertia_per_sample <= 0 or len(min_distances) == 0:
+            return 0.0
+        return float(np.mean(min_distances) / self.inertia_per_sample - 1.0)
+
+    def info(self):
+        return {
+            "version": self.version,
+            "n_clusters": self.n_clusters,
+            "n_samples": self.n_samples,
+            "inertia_per_sample": round(self.inertia_per_sample, 6),
+            "fitted_at": self.fitted_at,
+            "warm_start": self.warm_start
+        }
+
+    def save(self):
+        """Guarda esta versión del modelo y la marca como la vigente."""
+        MODELS_PATH.mkdir(parents=True, exist_ok=True)
+        model_file = MODELS_PATH / f"kmeans_v{self.version:04d}.npz"
+        tmp = model_file.with_name(f"{model_file.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, mean=self.mean, scale=self.scale, centroids=self.centroids)
+        os.replace(tmp, model_file)
+
+        tmp_latest = LATEST_FILE.with_name(f"{LATEST_FILE.name}.{os.getpid()}.tmp")
+        with open(tmp_latest, 'w', encoding='utf-8') as f:
+            json.dump({**self.info(), "file": model_file.name}, f)
+        os.replace(tmp_latest, LATEST_FILE)
+
+    @classmethod
+    def load(cls) -> Optional['ClusterModel']:
+        """Carga la versión vigente del modelo, o None si no hay ninguna guardada."""
+        try:
+            with open(LATEST_FILE, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with np.load(MODELS_PATH / meta['file']) as arrays:
+                return cls(
+                    arrays['mean'], arrays['scale'], arrays['centroids'],
+                    version=meta['version'],
+                    inertia_per_sample=meta['inertia_per_sample'],
+                    n_samples=meta['n_samples'],
+                    fitted_at=meta['fitted_at'],
+                    warm_start=meta.get('warm_start', False)
+                )
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def fit_model(X, n_clusters=6, previous=None) -> ClusterModel:
+    """
+    Entrena scaler + K-Means. Si hay un modelo previo con el mismo número de
+    clusters, parte de sus centroides (llevados a la nueva escala) con n_init=1.
+    """
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    warm_start = previous is not None and previous.n_clusters == n_clusters
+    if warm_start:
+        raw_centroids = previous.centroids * previous.scale + previous.mean
+        init = (raw_centroids - scaler.mean_) / scaler.scale_
+        kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42)
+    else:
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    kmeans.fit(X_scaled)
+
+    return ClusterModel(
+        scaler.mean_, scaler.scale_, kmeans.cluster_centers_,
+        version=(previous.version + 1) if previous is not None else 1,
+        inertia_per_sample=kmeans.inertia_ / max(len(X_scaled), 1),
+        n_samples=len(X_scaled),
+        warm_start=warm_start
+    )
+
+
+_lock = threading.Lock()
+_current = {'model': None, 'loaded': False}
+
+
+def get_model() -> Optional[ClusterModel]:
+    """Modelo vigente (cargado de disco la primera vez)."""
+    with _lock:
+        if not _current['loaded']:
+            _current['model'] = ClusterModel.load()
+            _current['loaded'] = True
+        return _current['model']
+
+
+def _store(model):
+    try:
+        model.save()
+    except OSError as e:
+        print(f"No se pudo guardar el modelo de clustering: {str(e)}")
+    with _lock:
+        _current['model'] = model
+        _current['loaded'] = True
+
+
+def refit(X, n_clusters=6) -> ClusterModel:
+    """Reentrena el modelo a pedido (warm start desde la versión vigente)."""
+    model = fit_model(X, n_clusters, previous=get_model())
+    _store(model)
+    return model
+
+
+def assign_clusters(X, n_clusters=6, force_refit=False, drift_threshold=DRIFT_THRESHOLD):
+    """
+    Asigna un cluster a cada fila de X con el modelo vigente.
+
+    Entrena si no hay modelo (o cambió `n_clusters`), si se pide `force_refit`
+    o si la deriva supera `drift_threshold`. Devuelve (labels, modelo).
+    """
+    model = get_model()
+
+    if force_refit or model is None or model.n_clusters != n_clusters:
+        model = refit(X, n_clusters)
+        return model.predict(X)[0], model
+
+    labels, min_distances = model.predict(X)
+    if model.drift(min_distances) > drift_threshold:
+        model = refit(X, n_clusters)
+        labels = model.predict(X)[0]
+
+    return labels, model
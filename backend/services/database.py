@@ -1,22 +1,117 @@
 import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 import json
 from typing import List, Optional, Dict, Any
 import uuid
 
+# PRAGMAs de cada conexión: WAL permite lecturas concurrentes con una escritura,
+# synchronous=NORMAL es seguro en WAL y evita un fsync por commit
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",       # ~16 MB de caché de páginas
+    "PRAGMA mmap_size=268435456",     # 256 MB mapeados en memoria
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+# Sentencias preparadas que cada conexión mantiene en caché
+CACHED_STATEMENTS = 256
+BUSY_TIMEOUT_SECONDS = 30
+# SQLite admite como máximo 32766 parámetros por consulta
+_LOOKUP_CHUNK = 900
+
+# Agregados de flow_metrics (por flujo o agrupados por flow_id)
+FLOW_METRICS_AGGREGATES = """
+                SUM(emails_sent) as total_sent,
+                SUM(emails_opened) as total_opened,
+                SUM(emails_clicked) as total_clicked,
+                SUM(conversions) as total_conversions,
+                SUM(revenue_generated) as total_revenue"""
+
+def empty_flow_metrics(flow_id: str) -> Dict[str, Any]:
+    """Métricas de un flujo sin registros en flow_metrics."""
+    return {
+        'flow_id': flow_id,
+        'total_sent': 0,
+        'open_rate': 0,
+        'click_rate': 0,
+        'conversion_rate': 0,
+        'revenue_generated': 0
+    }
+
 class AutomationDB:
     def __init__(self, db_path: str = "automation.db"):
         self.db_path = db_path
-        self.init_database()
+        # Una conexión por thread, reutilizada entre llamadas
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._initialized = False
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def _open_connection(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            cached_statements=CACHED_STATEMENTS,
+            check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    def get_connection(self):
+        """Conexión del thread actual (se abre una sola vez y se reutiliza)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+        if not self._initialized:
+            self._ensure_initialized()
         return conn
     
+    @contextmanager
+    def connection(self):
+        """Conexión del pool: commit al terminar el bloque, rollback si hubo un error."""
+        conn = self.get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def close(self):
+        """Cierra todas las conexiones abiertas por el pool."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
+    def _ensure_initialized(self):
+        # El esquema se crea con la primera consulta, no al instanciar la clase.
+        # get_connection lee la bandera sin el lock, por eso se marca recién
+        # cuando init_database terminó; si falla, la próxima consulta reintenta.
+        with self._init_lock:
+            if self._initialized:
+                return
+            try:
+                self.init_database()
+            except Exception:
+                self._local.conn.rollback()
+                raise
+            self._initialized = True
+    
     def init_database(self):
         """Inicializa las tablas necesarias"""
-        conn = self.get_connection()
+        conn = self._local.conn
         cursor = conn.cursor()
         
         # Tabla de flujos
@@ -46,10 +141,22 @@ class AutomationDB:
                 last_action_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 completed BOOLEAN DEFAULT 0,
                 metadata TEXT,
+                next_run_at TIMESTAMP,
                 FOREIGN KEY (flow_id) REFERENCES automation_flows(id)
             )
         """)
         
+        # Bases creadas antes de que existiera el planificador
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(flow_executions)")}
+        if 'next_run_at' not in columns:
+            cursor.execute("ALTER TABLE flow_executions ADD COLUMN next_run_at TIMESTAMP")
+        
+        # Solo las ejecuciones en curso: las terminadas no ocupan el índice
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_flow_executions_next_run
+            ON flow_executions(next_run_at) WHERE completed = 0
+        """)
+        
         # Tabla de métricas por flujo
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS flow_metrics (
@@ -67,6 +174,22 @@ class AutomationDB:
             )
         """)
         
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_flow_metrics_flow ON flow_metrics(flow_id)")
+        
+        # Versiones compartidas por los procesos que guardan datos en memoria:
+        # flows_version cambia con cada alta, edición o baja de un flujo y
+        # executions_version cuando se agregan o reprograman ejecuciones
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS automation_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        cursor.executemany(
+            "INSERT OR IGNORE INTO automation_meta (key, value) VALUES (?, 0)",
+            [('flows_version',), ('executions_version',)]
+        )
+        
         # Tabla de plantillas
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS flow_templates (
@@ -85,20 +208,18 @@ class AutomationDB:
         """)
         
         conn.commit()
-        conn.close()
         
         # Insertar datos de ejemplo si la BD está vacía
         self._insert_sample_data()
     
     def _insert_sample_data(self):
         """Inserta flujos y plantillas de ejemplo"""
-        conn = self.get_connection()
+        conn = self._local.conn
         cursor = conn.cursor()
         
         # Verificar si ya hay datos
         cursor.execute("SELECT COUNT(*) as count FROM automation_flows")
         if cursor.fetchone()['count'] > 0:
-            conn.close()
             return
         
         # Flujo 1: Bienvenida
@@ -244,30 +365,28 @@ class AutomationDB:
         ))
         
         conn.commit()
-        conn.close()
     
     # CRUD Operations para Flows
     def create_flow(self, flow_data: Dict[str, Any]) -> str:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            flow_id = str(uuid.uuid4())
+            steps_json = json.dumps(flow_data['steps'])
+        
+            cursor.execute("""
+                INSERT INTO automation_flows (id, name, description, status, trigger_type, steps)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                flow_id,
+                flow_data['name'],
+                flow_data['description'],
+                flow_data.get('status', 'draft'),
+                flow_data['trigger_type'],
+                steps_json
+            ))
+            self._bump_version(cursor, 'flows_version')
         
-        flow_id = str(uuid.uuid4())
-        steps_json = json.dumps(flow_data['steps'])
-        
-        cursor.execute("""
-            INSERT INTO automation_flows (id, name, description, status, trigger_type, steps)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            flow_id,
-            flow_data['name'],
-            flow_data['description'],
-            flow_data.get('status', 'draft'),
-            flow_data['trigger_type'],
-            steps_json
-        ))
-        
-        conn.commit()
-        conn.close()
         return flow_id
     
     def get_flow(self, flow_id: str) -> Optional[Dict[str, Any]]:
@@ -276,101 +395,109 @@ class AutomationDB:
         
         cursor.execute("SELECT * FROM automation_flows WHERE id = ?", (flow_id,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return {
-                'id': row['id'],
-                'name': row['name'],
-                'description': row['description'],
-                'status': row['status'],
-                'trigger_type': row['trigger_type'],
-                'steps': json.loads(row['steps']),
-                'users_in_flow': row['users_in_flow'],
-                'total_completed': row['total_completed'],
-                'created_at': row['created_at'],
-                'updated_at': row['updated_at']
-            }
+            return self._flow_from_row(row)
         return None
     
+    @staticmethod
+    def _flow_from_row(row) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'status': row['status'],
+            'trigger_type': row['trigger_type'],
+            'steps': json.loads(row['steps']),
+            'users_in_flow': row['users_in_flow'],
+            'total_completed': row['total_completed'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+    
     def get_all_flows(self) -> List[Dict[str, Any]]:
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM automation_flows ORDER BY created_at DESC")
         rows = cursor.fetchall()
-        conn.close()
         
-        flows = []
-        for row in rows:
-            flows.append({
-                'id': row['id'],
-                'name': row['name'],
-                'description': row['description'],
-                'status': row['status'],
-                'trigger_type': row['trigger_type'],
-                'steps': json.loads(row['steps']),
-                'users_in_flow': row['users_in_flow'],
-                'total_completed': row['total_completed'],
-                'created_at': row['created_at'],
-                'updated_at': row['updated_at']
-            })
-        return flows
+        return [self._flow_from_row(row) for row in rows]
     
     def update_flow(self, flow_id: str, update_data: Dict[str, Any]) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        fields = []
-        values = []
+            fields = []
+            values = []
         
-        if 'name' in update_data:
-            fields.append("name = ?")
-            values.append(update_data['name'])
+            if 'name' in update_data:
+                fields.append("name = ?")
+                values.append(update_data['name'])
         
-        if 'description' in update_data:
-            fields.append("description = ?")
-            values.append(update_data['description'])
+            if 'description' in update_data:
+                fields.append("description = ?")
+                values.append(update_data['description'])
         
-        if 'status' in update_data:
-            fields.append("status = ?")
-            values.append(update_data['status'])
+            if 'status' in update_data:
+                fields.append("status = ?")
+                values.append(update_data['status'])
         
-        if 'steps' in update_data:
-            fields.append("steps = ?")
-            values.append(json.dumps(update_data['steps']))
+            if 'steps' in update_data:
+                fields.append("steps = ?")
+                values.append(json.dumps(update_data['steps']))
         
-        fields.append("updated_at = ?")
-        values.append(datetime.now().isoformat())
+            fields.append("updated_at = ?")
+            values.append(datetime.now().isoformat())
         
-        values.append(flow_id)
+            values.append(flow_id)
         
-        query = f"UPDATE automation_flows SET {', '.join(fields)} WHERE id = ?"
-        cursor.execute(query, values)
+            query = f"UPDATE automation_flows SET {', '.join(fields)} WHERE id = ?"
+            cursor.execute(query, values)
         
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+            success = cursor.rowcount > 0
+            if success:
+                self._bump_version(cursor, 'flows_version')
         return success
     
     def delete_flow(self, flow_id: str) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("DELETE FROM automation_flows WHERE id = ?", (flow_id,))
-        success = cursor.rowcount > 0
+            # Primero las filas que referencian al flujo (foreign_keys=ON)
+            cursor.execute("DELETE FROM flow_executions WHERE flow_id = ?", (flow_id,))
+            cursor.execute("DELETE FROM flow_metrics WHERE flow_id = ?", (flow_id,))
+            cursor.execute("DELETE FROM automation_flows WHERE id = ?", (flow_id,))
+            success = cursor.rowcount > 0
+            if success:
+                self._bump_version(cursor, 'flows_version')
         
-        conn.commit()
-        conn.close()
         return success
     
+    @staticmethod
+    def _bump_version(cursor, key: str):
+        # Dentro de la misma transacción que modifica los datos
+        cursor.execute("UPDATE automation_meta SET value = value + 1 WHERE key = ?", (key,))
+    
+    def _get_version(self, key: str) -> int:
+        conn = self.get_connection()
+        row = conn.execute("SELECT value FROM automation_meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else 0
+    
+    def get_flows_version(self) -> int:
+        """Versión de los flujos, compartida por todos los procesos que usan la base"""
+        return self._get_version('flows_version')
+    
+    def get_executions_version(self) -> int:
+        """Versión de las ejecuciones agregadas o reprogramadas (por cualquier proceso)"""
+        return self._get_version('executions_version')
+    
     def get_templates(self) -> List[Dict[str, Any]]:
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM flow_templates")
         rows = cursor.fetchall()
-        conn.close()
         
         templates = []
         for row in rows:
@@ -394,20 +521,29 @@ class AutomationDB:
         cursor = conn.cursor()
         
         # Obtener métricas agregadas
-        cursor.execute("""
-            SELECT 
-                SUM(emails_sent) as total_sent,
-                SUM(emails_opened) as total_opened,
-                SUM(emails_clicked) as total_clicked,
-                SUM(conversions) as total_conversions,
-                SUM(revenue_generated) as total_revenue
+        cursor.execute(f"""
+            SELECT {FLOW_METRICS_AGGREGATES}
             FROM flow_metrics
             WHERE flow_id = ?
         """, (flow_id,))
         
-        row = cursor.fetchone()
-        conn.close()
+        return self._metrics_from_row(flow_id, cursor.fetchone())
+    
+    def get_all_flow_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Métricas agregadas de todos los flujos con una sola consulta agrupada."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
+        cursor.execute(f"""
+            SELECT flow_id, {FLOW_METRICS_AGGREGATES}
+            FROM flow_metrics
+            GROUP BY flow_id
+        """)
+        
+        return {row['flow_id']: self._metrics_from_row(row['flow_id'], row) for row in cursor.fetchall()}
+    
+    @staticmethod
+    def _metrics_from_row(flow_id: str, row) -> Dict[str, Any]:
         if row and row['total_sent']:
             return {
                 'flow_id': flow_id,
@@ -418,11 +554,136 @@ class AutomationDB:
                 'revenue_generated': row['total_revenue'] or 0
             }
         
-        return {
-            'flow_id': flow_id,
-            'total_sent': 0,
-            'open_rate': 0,
-            'click_rate': 0,
-            'conversion_rate': 0,
-            'revenue_generated': 0
-        }
\ No newline at end of file
+        return empty_flow_metrics(flow_id)
+    
+    # Ejecuciones de flujos
+    def create_executions(self, executions: List[Dict[str, Any]]) -> List[str]:
+        """
+        Guarda ejecuciones nuevas (flow_id, user_id, current_step_id, next_run_at,
+        metadata) y suma los usuarios a users_in_flow de cada flujo.
+        """
+        now = datetime.now().isoformat()
+        execution_ids = [str(uuid.uuid4()) for _ in executions]
+        users_per_flow = Counter(execution['flow_id'] for execution in executions)
+        
+        with self.connection() as conn:
+            conn.executemany("""
+                INSERT INTO flow_executions (id, flow_id, user_id, current_step_id, started_at, last_action_at, next_run_at, metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (
+                    execution_id,
+                    execution['flow_id'],
+                    execution['user_id'],
+                    execution['current_step_id'],
+                    now,
+                    now,
+                    execution['next_run_at'].isoformat(),
+                    json.dumps(execution.get('metadata') or {})
+                )
+                for execution_id, execution in zip(execution_ids, executions)
+            ])
+            conn.executemany(
+                "UPDATE automation_flows SET users_in_flow = users_in_flow + ? WHERE id = ?",
+                [(count, flow_id) for flow_id, count in users_per_flow.items()]
+            )
+            self._bump_version(conn, 'executions_version')
+        
+        return execution_ids
+    
+    def get_scheduled_executions(self, until: datetime) -> List[tuple]:
+        """(id, next_run_at) de las ejecuciones en curso que vencen hasta `until` (incluidas las vencidas)."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT id, next_run_at FROM flow_executions
+            WHERE completed = 0 AND next_run_at <= ?
+        """, (until.isoformat(),))
+        
+        return [(row['id'], row['next_run_at']) for row in cursor.fetchall()]
+    
+    def claim_executions(self, execution_ids: List[str], now: datetime, lease_until: datetime) -> List[str]:
+        """
+        Reclama las ejecuciones en curso que vencen a `now` moviendo su
+        vencimiento a `lease_until`, y devuelve los IDs reclamados. Cada UPDATE
+        es atómico: si varios procesos reclaman la misma ejecución, solo uno la
+        recibe. Si el proceso cae antes de guardar el avance, la ejecución
+        vuelve a vencer al terminar el lease.
+        """
+        claimed = []
+        with self.connection() as conn:
+            for start in range(0, len(execution_ids), _LOOKUP_CHUNK):
+                chunk = execution_ids[start:start + _LOOKUP_CHUNK]
+                placeholders = ', '.join('?' * len(chunk))
+                rows = conn.execute(f"""
+                    UPDATE flow_executions SET next_run_at = ?
+                    WHERE completed = 0 AND next_run_at <= ? AND id IN ({placeholders})
+                    RETURNING id
+                """, [lease_until.isoformat(), now.isoformat(), *chunk]).fetchall()
+                claimed += [row['id'] for row in rows]
+        return claimed
+    
+    def get_executions(self, execution_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        executions = {}
+        for start in range(0, len(execution_ids), _LOOKUP_CHUNK):
+            chunk = execution_ids[start:start + _LOOKUP_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"SELECT * FROM flow_executions WHERE id IN ({placeholders})", chunk)
+            for row in cursor.fetchall():
+                executions[row['id']] = {
+                    'id': row['id'],
+                    'flow_id': row['flow_id'],
+                    'user_id': row['user_id'],
+                    'current_step_id': row['current_step_id'],
+                    'started_at': row['started_at'],
+                    'last_action_at': row['last_action_at'],
+                    'next_run_at': row['next_run_at'],
+                    'completed': bool(row['completed']),
+                    'metadata': json.loads(row['metadata']) if row['metadata'] else {}
+                }
+        return executions
+    
+    def advance_executions(self, updates: List[Dict[str, Any]]):
+        """
+        Guarda en una transacción el nuevo paso y vencimiento de cada ejecución
+        y pasa las terminadas de users_in_flow a total_completed.
+        """
+        if not updates:
+            return
+        
+        now = datetime.now().isoformat()
+        completed_per_flow = Counter(update['flow_id'] for update in updates if update['completed'])
+        
+        with self.connection() as conn:
+            conn.executemany("""
+                UPDATE flow_executions
+                SET current_step_id = ?, next_run_at = ?, last_action_at = ?, completed = ?
+                WHERE id = ?
+            """, [
+                (
+                    update['current_step_id'],
+                    None if update['completed'] else update['next_run_at'].isoformat(),
+                    now,
+                    1 if update['completed'] else 0,
+                    update['id']
+                )
+                for update in updates
+            ])
+            conn.executemany("""
+                UPDATE automation_flows
+                SET users_in_flow = MAX(users_in_flow - ?, 0), total_completed = total_completed + ?
+                WHERE id = ?
+            """, [(count, count, flow_id) for flow_id, count in completed_per_flow.items()])
+    
+    def reschedule_executions(self, execution_ids: List[str], run_at: datetime):
+        """Mueve el vencimiento de ejecuciones en curso (reintentos de lotes fallidos)."""
+        with self.connection() as conn:
+            conn.executemany(
+                "UPDATE flow_executions SET next_run_at = ? WHERE id = ? AND completed = 0",
+                [(run_at.isoformat(), execution_id) for execution_id in execution_ids]
+            )
+            self._bump_version(conn, 'executions_version')
@@ -0,0 +1,143 @@
+"""
+Planificador de las ejecuciones de flujos de automatización.
+
+Las ejecuciones pendientes viven en SQLite (flow_executions.next_run_at,
+indexado). Desde la base solo se cargan al heap las que vencen dentro de la
+ventana actual (`window_seconds`); las demás se leen por rango desde el índice
+cuando la ventana avanza. Las que se agendan con `schedule` entran al heap
+aunque venzan más allá de la ventana. El thread del planificador duerme hasta
+el próximo vencimiento (o el fin de la ventana) y entonces llama a `on_due`,
+que retira las ejecuciones vencidas con `pop_due`.
+
+Varios procesos pueden compartir la base: cada recarga lee todo lo pendiente
+hasta el horizonte (no solo el tramo nuevo), y cuando otro proceso agrega o
+reprograma ejecuciones (executions_version) se recarga antes de que avance la
+ventana. Quién ejecuta cada una lo decide el reclamo atómico en la base
+(AutomationDB.claim_executions), no el heap.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+DEFAULT_WINDOW_SECONDS = 3600
+# Espera antes de reintentar si el procesamiento de una ronda falla
+ERROR_RETRY_SECONDS = 30
+# Cada cuánto se consulta si otro proceso agregó o reprogramó ejecuciones
+RESCAN_SECONDS = 30
+
+
+class ExecutionScheduler:
+    """Heap de (vencimiento, execution_id) cargado por ventanas desde SQLite."""
+
+    def __init__(self, db, on_due: Optional[Callable[[], object]] = None,
+                 window_seconds: float = DEFAULT_WINDOW_SECONDS, rescan_seconds: float = RESCAN_SECONDS):
+        self.db = db
+        self.on_due = on_due
+        self.window_seconds = window_seconds
+        self.rescan_seconds = rescan_seconds
+        self._heap = []
+        # Vencimiento vigente de cada ejecución del heap (las entradas con otro
+        # vencimiento quedaron reemplazadas y se descartan al salir)
+        self._queued = {}
+        # Todas las ejecuciones con next_run_at <= horizonte están en el heap
+        self._horizon = None
+        # Última executions_version leída y cuándo se consultó
+        self._version = None
+        self._checked_at = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """Carga la ventana inicial (incluidas las vencidas) e inicia el thread."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._extend_window(time.time())
+            self._thread = threading.Thread(target=self._run, name="flow-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def schedule(self, execution_id: str, run_at: datetime):
+        """
+        Agrega una ejecución al heap (o cambia su vencimiento). Se conserva
+        aunque venza fuera de la ventana actual; si además se carga desde SQLite,
+        `pop_due` devuelve el ID una sola vez.
+        """
+        ts = run_at.timestamp()
+        with self._cond:
+            if self._push(execution_id, ts) and self._heap[0][1] == execution_id:
+                self._cond.notify()
+
+    def pop_due(self, now: Optional[datetime] = None) -> List[str]:
+        """IDs de las ejecuciones vencidas a `now`, retiradas del heap."""
+        ts = (now or datetime.now()).timestamp()
+        with self._cond:
+            self._extend_window(ts)
+            due = []
+            while self._heap and self._heap[0][0] <= ts:
+                run_ts, execution_id = heapq.heappop(self._heap)
+                if self._queued.get(execution_id) != run_ts:
+                    continue
+                del self._queued[execution_id]
+                due.append(execution_id)
+            return due
+
+    def _push(self, execution_id: str, ts: float) -> bool:
+        if self._queued.get(execution_id) == ts:
+            return False
+        self._queued[execution_id] = ts
+        heapq.heappush(self._heap, (ts, execution_id))
+        return True
+
+    def _executions_changed(self, now_ts: float) -> bool:
+        """Indica, a lo sumo cada `rescan_seconds`, si cambió executions_version."""
+        if self._checked_at is not None and 0 <= now_ts - self._checked_at < self.rescan_seconds:
+            return False
+        self._checked_at = now_ts
+        version = self.db.get_executions_version()
+        changed, self._version = version != self._version, version
+        return changed
+
+    def _extend_window(self, now_ts: float):
+        changed = self._executions_changed(now_ts)
+        # Se adelanta la ventana cuando queda menos de la mitad por recorrer
+        extend = self._horizon is None or now_ts + self.window_seconds / 2 >= self._horizon
+        if not extend and not changed:
+            return
+        horizon = now_ts + self.window_seconds if extend else self._horizon
+        # Todo lo pendiente hasta el horizonte, también lo que otro proceso
+        # agregó por debajo de él o dejó sin terminar
+        for execution_id, next_run_at in self.db.get_scheduled_executions(datetime.fromtimestamp(horizon)):
+            self._push(execution_id, datetime.fromisoformat(next_run_at).timestamp())
+        self._horizon = horizon
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.time()
+                self._extend_window(now)
+                wakeup = min(self._horizon, self._checked_at + self.rescan_seconds)
+                if self._heap:
+                    wakeup = min(wakeup, self._heap[0][0])
+                if wakeup > now:
+                    self._cond.wait(wakeup - now)
+                    continue
+            try:
+                self.on_due()
+            except Exception as e:
+                print(f"Error al procesar los pasos programados: {str(e)}")
+                with self._cond:
+                    self._cond.wait(ERROR_RETRY_SECONDS)
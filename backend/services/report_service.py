@@ -0,0 +1,469 @@
+"""
+Reportes PDF de analytics generados en segundo plano.
+
+`POST /analytics/reports` crea un trabajo que se renderiza en un pool de
+workers; el PDF terminado queda guardado en `data/reports` y se reutiliza
+para cualquier pedido con el mismo (período, fecha, versión de los datos):
+los períodos son ventanas hasta hoy, así que un PDF de otro día no sirve y
+se borra al generar el siguiente. Los PDF
+armados con el contenido de respaldo porque falló la IA solo se entregan al
+trabajo que los generó.
+"""
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Optional
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+
+from . import analytics_service, analytics_ai_service
+from .. import data_handler
+
+REPORTS_PATH = data_handler.DATA_PATH / "reports"
+REPORT_WORKERS = 2
+# Filas por tabla en los listados largos del reporte
+TABLE_CHUNK_ROWS = 200
+# Trabajos terminados que se conservan para consultar su estado y descargar el PDF
+JOB_RETENTION_SECONDS = 3600
+MAX_FINISHED_JOBS = 200
+
+
+def _table_style(align, body_font_size=None, striped=False):
+    """Estilo común de las tablas del reporte (encabezado violeta y grilla)."""
+    commands = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#6366f1')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), align),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12 if align == 'LEFT' else 10),
+    ]
+    if body_font_size:
+        commands.append(('FONTSIZE', (0, 1), (-1, -1), body_font_size))
+    commands += [
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]
+    if striped:
+        commands.append(('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]))
+    return TableStyle(commands)
+
+
+class ReportTemplate:
+    """
+    Plantilla del reporte de analytics. Las hojas de estilo, los estilos de
+    tabla y los anchos de columna se arman una sola vez; en cada render solo
+    se crean los flowables que dependen de los datos.
+    """
+
+    METRICS_COL_WIDTHS = [3*inch, 2*inch]
+    CAMPAIGNS_COL_WIDTHS = [2.2*inch, 0.8*inch, 0.8*inch, 0.8*inch, 0.6*inch, 0.8*inch]
+    SEGMENTS_COL_WIDTHS = [2*inch, 1.5*inch, 1.5*inch, 1.5*inch]
+
+    def __init__(self):
+        self.styles = getSampleStyleSheet()
+        self.normal = self.styles['Normal']
+        self.italic = self.styles['Italic']
+
+        # Estilos personalizados
+        self.title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=self.styles['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor('#6366f1'),
+            spaceAfter=30,
+            alignment=TA_CENTER
+        )
+        self.heading_style = ParagraphStyle(
+            'CustomHeading',
+            parent=self.styles['Heading2'],
+            fontSize=16,
+            textColor=colors.HexColor('#1e293b'),
+            spaceAfter=12,
+            spaceBefore=12
+        )
+
+        self.metrics_table_style = _table_style('LEFT')
+        self.campaigns_table_style = _table_style('CENTER', body_font_size=8, striped=True)
+        self.segments_table_style = _table_style('CENTER')
+
+    def _heading(self, text):
+        return Paragraph(text, self.heading_style)
+
+    def _table(self, rows, col_widths, style):
+        # repeatRows: en tablas de varias páginas el encabezado se repite
+        table = Table(rows, colWidths=col_widths, repeatRows=1)
+        table.setStyle(style)
+        return table
+
+    def _tables(self, rows, col_widths, style):
+        """
+        Una tabla por cada TABLE_CHUNK_ROWS filas: ReportLab vuelve a medir las
+        filas restantes en cada salto de página, así el costo queda lineal.
+        """
+        header, body = rows[0], rows[1:]
+        if len(body) <= TABLE_CHUNK_ROWS:
+            return [self._table(rows, col_widths, style)]
+        return [
+            self._table([header] + body[start:start + TABLE_CHUNK_ROWS], col_widths, style)
+            for start in range(0, len(body), TABLE_CHUNK_ROWS)
+        ]
+
+    def metrics_flowables(self, overview):
+        metrics_data = [
+            ['Métrica', 'Valor'],
+            ['Total Conversiones', f"{overview['total_conversions']:,}"],
+            ['Total Enviados', f"{overview['total_sent']:,}"],
+            ['Tasa de Apertura', f"{overview['open_rate']}%"],
+            ['CTR', f"{overview['ctr']}%"],
+            ['Tasa de Conversión', f"{overview['conversion_rate']}%"],
+            ['ROI', f"{overview['roi']}x"],
+            ['Total Campañas', str(overview.get('total_campaigns', 'N/A'))]
+        ]
+        return [
+            self._heading("Métricas Principales"),
+            self._table(metrics_data, self.METRICS_COL_WIDTHS, self.metrics_table_style),
+            Spacer(1, 0.4*inch),
+        ]
+
+    def insights_flowables(self, insights):
+        story = [self._heading("Insights de Inteligencia Artificial")]
+
+        # Mejor hora de envío
+        best_time = insights.get('best_send_time', {})
+        story.append(Paragraph(
+            f"<b>Mejor Momento de Envío:</b> {best_time.get('day', 'N/A')} a las {best_time.get('time', 'N/A')} "
+            f"({best_time.get('improvement', 'N/A')} de mejora en apertura)",
+            self.normal
+        ))
+        story.append(Spacer(1, 0.1*inch))
+
+        # Segmento más rentable
+        top_seg = insights.get('top_segment', {})
+        story.append(Paragraph(
+            f"<b>Segmento Más Rentable:</b> {top_seg.get('name', 'N/A')} "
+            f"(CLV ${top_seg.get('clv', 0):,})",
+            self.normal
+        ))
+        story.append(Spacer(1, 0.1*inch))
+
+        # Alerta de churn
+        churn = insights.get('churn_alert', {})
+        story.append(Paragraph(
+            f"<b>Alerta:</b> {churn.get('users', 0):,} usuarios en riesgo de abandono. "
+            f"Acción recomendada: {churn.get('action', 'N/A')}",
+            self.normal
+        ))
+        story.append(Spacer(1, 0.3*inch))
+
+        # Recomendaciones
+        story.append(self._heading("Recomendaciones Estratégicas"))
+        recommendations = insights.get('recommendations', [])
+        for i, rec in enumerate(recommendations[:5], 1):
+            story.append(Paragraph(
+                f"<b>{i}. {rec.get('title', '')}:</b> {rec.get('description', '')} "
+                f"(Impacto: {rec.get('impact', 'medio')})",
+                self.normal
+            ))
+            story.append(Spacer(1, 0.1*inch))
+
+        story.append(Spacer(1, 0.3*inch))
+        return story
+
+    def campaigns_flowables(self, campaigns):
+        campaigns_data = [['Campaña', 'Canal', 'Enviados', 'Apertura', 'CTR', 'Conversión']]
+        for camp in campaigns[:10]:
+            campaigns_data.append([
+                camp.get('name', '')[:30],
+                camp.get('channel', ''),
+                f"{camp.get('sent', 0):,}",
+                f"{camp.get('open_rate', 0)}%",
+                f"{camp.get('ctr', 0)}%",
+                f"{camp.get('conversion_rate', 0)}%"
+            ])
+        return [
+            self._heading("Top 10 Campañas del Período"),
+            self._table(campaigns_data, self.CAMPAIGNS_COL_WIDTHS, self.campaigns_table_style),
+        ]
+
+    def segments_flowables(self, segments):
+        segments_data = [['Segmento', 'Usuarios', 'CLV Promedio', 'Tasa Conversión']]
+        for seg in segments:
+            segments_data.append([
+                seg.get('segment', ''),
+                f"{seg.get('users', 0):,}",
+                f"${seg.get('clv', 0):,.2f}",
+                f"{seg.get('conversion_rate', 0)}%"
+            ])
+        return [
+            self._heading("Análisis por Segmentos de Usuario"),
+            *self._tables(segments_data, self.SEGMENTS_COL_WIDTHS, self.segments_table_style),
+            Spacer(1, 0.3*inch),
+        ]
+
+    def trends_flowables(self, trends):
+        story = [self._heading("Tendencias Detectadas")]
+        for trend in trends:
+            story.append(Paragraph(
+                f"<b>{trend.get('trend', '')}:</b> {trend.get('insight', '')}",
+                self.normal
+            ))
+            story.append(Spacer(1, 0.1*inch))
+        return story
+
+    def render(self, output, period, overview, campaigns, segments, insights, summary):
+        """Escribe el reporte en `output`. Devuelve la cantidad de páginas generadas."""
+        doc = SimpleDocTemplate(output, pagesize=A4)
+
+        # Título
+        story = [
+            Paragraph("Reporte de Análisis de Marketing", self.title_style),
+            Paragraph(f"Período: {period} | Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", self.normal),
+            Spacer(1, 0.3*inch),
+        ]
+
+        # Resumen Ejecutivo
+        story += [self._heading("Resumen Ejecutivo"), Paragraph(summary, self.normal), Spacer(1, 0.3*inch)]
+
+        story += self.metrics_flowables(overview)
+        story += self.insights_flowables(insights)
+        story += self.campaigns_flowables(campaigns)
+        story.append(PageBreak())
+        story += self.segments_flowables(segments)
+        story += self.trends_flowables(insights.get('trends', []))
+
+        # Footer
+        story.append(Spacer(1, 0.5*inch))
+        story.append(Paragraph(
+            "Este reporte fue generado automáticamente por OmniMark Analytics con asistencia de IA",
+            self.italic
+        ))
+
+        doc.build(story)
+        return doc.page
+
+
+# Se construye una vez al importar el módulo (al iniciar el servidor)
+report_template = ReportTemplate()
+
+
+def render_analytics_pdf(period: str, output, data_version: Optional[str] = None) -> bool:
+    """
+    Calcula las métricas del período, pide los insights de IA y escribe el PDF
+    en `output`. Devuelve False si la IA falló y se usó el contenido de respaldo.
+    """
+    users_df, campaigns_df, social_df = data_handler.load_data()
+
+    if campaigns_df is None or users_df is None or social_df is None:
+        raise RuntimeError("No se pudieron cargar los datos. Verifique que los archivos CSV existan en la carpeta 'data'.")
+
+    service = analytics_service.AnalyticsService(users_df, campaigns_df, social_df, data_version=data_version)
+
+    # Obtener todos los datos
+    overview = service.get_overview_metrics(period)
+    campaigns = service.get_top_campaigns(period, limit=10)
+    segments = service.get_segment_performance()
+    analytics_data = analytics_service.get_analytics_data(users_df, campaigns_df, social_df, period, service=service)
+
+    # Obtener insights de IA
+    ai_service = analytics_ai_service.AnalyticsAIService()
+    insights = ai_service.generate_insights(analytics_data)
+    summary = ai_service.generate_report_summary(analytics_data)
+
+    report_template.render(output, period, overview, campaigns, segments, insights, summary)
+    return not ai_service.ai_failed
+
+
+def benchmark_render(segment_rows: int = 5000, repeat: int = 3) -> Dict:
+    """
+    Mide el tiempo de render de un reporte con una tabla de segmentos de
+    `segment_rows` filas (datos sintéticos, sin IA ni carga de CSV).
+    """
+    overview = {'total_conversions': 0, 'total_sent': 0, 'open_rate': 0, 'ctr': 0,
+                'conversion_rate': 0, 'roi': 0, 'total_campaigns': 0}
+    segments = [
+        {'segment': f"Segmento {i}", 'users': i, 'clv': float(i), 'conversion_rate': 10.0}
+        for i in range(segment_rows)
+    ]
+
+    timings = []
+    pages = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = report_template.render(io.BytesIO(), 'benchmark', overview, [], segments, {}, "Benchmark")
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    return {
+        'segment_rows': segment_rows,
+        'pages': pages,
+        'seconds': round(best, 4),
+        'seconds_per_page': round(best / max(pages, 1), 6)
+    }
+
+
+class ReportJob:
+    """Trabajo de generación de un reporte PDF."""
+
+    def __init__(self, period: str, report_date: str, data_version: str):
+        self.id = uuid.uuid4().hex
+        self.period = period
+        # Día del que el período cuenta hacia atrás (YYYY-MM-DD)
+        self.report_date = report_date
+        self.data_version = data_version
+        self.status = 'pending'
+        self.file = None
+        self.error = None
+        # PDF con contenido de respaldo (la IA falló): no se reutiliza
+        self.ai_fallback = False
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.finished_monotonic = None
+        self._done = threading.Event()
+
+    def finish(self, file=None, error=None, ai_fallback=False):
+        self.file = file
+        self.error = error
+        self.ai_fallback = ai_fallback
+        self.status = 'error' if error else 'done'
+        self.finished_at = datetime.now().isoformat()
+        self.finished_monotonic = time.monotonic()
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def key(self):
+        return (self.period, self.report_date, self.data_version)
+
+    @property
+    def filename(self) -> str:
+        return f"reporte_analytics_{self.period}_{self.report_date.replace('-', '')}.pdf"
+
+    def info(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'period': self.period,
+            'report_date': self.report_date,
+            'data_version': self.data_version,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'ai_fallback': self.ai_fallback,
+            'download_url': f"/api/v1/analytics/reports/{self.id}"
+        }
+
+
+class ReportJobManager:
+    """
+    Cola de reportes: renderiza en un pool de threads y guarda cada PDF como
+    artefacto en disco. Un pedido repetido para el mismo (período, fecha,
+    versión de los datos) devuelve el trabajo existente en lugar de generar otro.
+    """
+
+    def __init__(self, storage=REPORTS_PATH, workers: int = REPORT_WORKERS,
+                 retention_seconds: float = JOB_RETENTION_SECONDS, max_finished_jobs: int = MAX_FINISHED_JOBS):
+        self.storage = storage
+        self.retention_seconds = retention_seconds
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reports")
+
+    def artifact_path(self, period: str, report_date: str, data_version: str):
+        return self.storage / f"reporte_analytics_{period}_{report_date}_{data_version}.pdf"
+
+    def submit(self, period: str) -> ReportJob:
+        key = (period, date.today().isoformat(), data_handler.get_data_version())
+
+        with self._lock:
+            self._prune()
+            job = self._by_key.get(key)
+            if job is not None and job.status != 'error' and not job.ai_fallback:
+                return job
+
+            job = ReportJob(*key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+
+        artifact = self.artifact_path(*key)
+        if artifact.exists():
+            # Artefacto de una ejecución anterior del servidor
+            job.finish(file=artifact)
+        else:
+            self._executor.submit(self._run, job)
+        return job
+
+    def _prune(self):
+        """Descarta los trabajos terminados más viejos que la retención o que exceden el máximo."""
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished_monotonic is not None),
+            key=lambda job: job.finished_monotonic
+        )
+        cutoff = time.monotonic() - self.retention_seconds
+        excess = len(finished) - self.max_finished_jobs
+        for position, job in enumerate(finished):
+            if job.finished_monotonic >= cutoff and position >= excess:
+                break
+            del self._jobs[job.id]
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            if job.ai_fallback and job.file is not None:
+                # El PDF de respaldo pertenece solo a este trabajo
+                job.file.unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: ReportJob):
+        job.status = 'running'
+        artifact = self.artifact_path(*job.key)
+        tmp = artifact.with_name(f"{artifact.name}.{os.getpid()}.{job.id}.tmp")
+        try:
+            self.storage.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                complete = render_analytics_pdf(
+                    job.period, f, data_version=data_handler.get_data_version(data_handler.CAMPAIGNS_FILE)
+                )
+            if not complete:
+                # Sin IA por un error transitorio: el PDF no se guarda como artefacto reutilizable
+                fallback = artifact.with_name(f"{artifact.stem}.{job.id}.fallback.pdf")
+                os.replace(tmp, fallback)
+                job.finish(file=fallback, ai_fallback=True)
+                return
+            os.replace(tmp, artifact)
+            self._remove_old_artifacts(artifact, job.period)
+            job.finish(file=artifact)
+        except Exception as e:
+            print(f"Error al generar el reporte {job.id}: {str(e)}")
+            if tmp.exists():
+                tmp.unlink()
+            job.finish(error=str(e))
+
+    def _remove_old_artifacts(self, artifact, period: str):
+        """Borra los PDF del período de otros días o versiones de los datos."""
+        for path in self.storage.glob(f"reporte_analytics_{period}_*.pdf"):
+            # Los PDF de respaldo se borran al descartar su trabajo
+            if path != artifact and not path.name.endswith('.fallback.pdf'):
+                path.unlink(missing_ok=True)
+
+
+report_jobs = ReportJobManager()
+
+
+if __name__ == '__main__':
+    for rows in (100, 5000, 50000):
+        print(benchmark_render(rows, repeat=1))
@@ -0,0 +1,105 @@
+"""
+Caché de respuestas JSON para endpoints de solo lectura.
+
+Cada entrada se guarda ya serializada junto con su ETag. Las entradas
+vencidas se siguen sirviendo durante `stale_ttl` mientras se recalculan en
+segundo plano (stale-while-revalidate); al superar `max_entries` se descarta
+la usada hace más tiempo (LRU).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+DEFAULT_TTL = 30
+DEFAULT_STALE_TTL = 300
+DEFAULT_MAX_ENTRIES = 128
+
+
+class CachedResponse:
+    """Cuerpo JSON serializado de una respuesta, con su ETag y fecha de cálculo."""
+
+    def __init__(self, body: bytes, created_at: float):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.created_at = created_at
+
+    @classmethod
+    def from_payload(cls, payload) -> 'CachedResponse':
+        # Misma serialización que JSONResponse
+        body = json.dumps(
+            jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        return cls(body, time.monotonic())
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Indica si el cliente ya tiene esta versión (cabecera If-None-Match)."""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or self.etag in tags or f'W/{self.etag}' in tags
+
+
+class ResponseCache:
+    """Caché LRU con TTL y refresco en segundo plano."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, stale_ttl: float = DEFAULT_STALE_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, workers: int = 2):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="response-cache")
+
+    def get(self, key: Hashable, compute: Callable[[], object]) -> CachedResponse:
+        """
+        Devuelve la respuesta cacheada para `key`. Si está vencida pero dentro de
+        `stale_ttl` se devuelve igual y se agenda su recálculo; si no existe (o es
+        demasiado vieja) se calcula en el momento con `compute`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.created_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(self._refresh, key, compute)
+                    return entry
+
+        entry = CachedResponse.from_payload(compute())
+        self._store(key, entry)
+        return entry
+
+    def _refresh(self, key, compute):
+        try:
+            self._store(key, CachedResponse.from_payload(compute()))
+        except Exception as e:
+            # Se sigue sirviendo la versión anterior hasta el próximo intento
+            print(f"Error al refrescar la caché de {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
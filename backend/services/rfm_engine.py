@@ -0,0 +1,159 @@
+"""
+Motor de scoring RFM basado en cortes de quintiles.
+
+Los cortes se calculan una vez por versión del dataset (selección O(n) con
+np.nanquantile, sin ordenar la columna completa) y los scores se asignan con
+un searchsorted vectorizado. Para la ingesta por bloques, KLLSketch estima
+los mismos cortes en memoria acotada.
+"""
+import threading
+
+import numpy as np
+
+# Cortes internos de los quintiles: score 1..5
+RFM_QUANTILES = (0.2, 0.4, 0.6, 0.8)
+RFM_COLUMNS = ('R_Score', 'F_Score', 'M_Score')
+
+
+def raw_rfm_values(churn, purchases, clv):
+    """Valores crudos R/F/M. R usa la inversa del Riesgo Churn como proxy de recency."""
+    return {
+        'R_Score': 100 - np.asarray(churn, dtype=np.float64),
+        'F_Score': np.asarray(purchases, dtype=np.float64),
+        'M_Score': np.asarray(clv, dtype=np.float64),
+    }
+
+
+def exact_breakpoints(values):
+    """
+    Cortes exactos de quintiles de `values`, o None si la columna no tiene
+    valores positivos (en ese caso todos los usuarios reciben score 1).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0 or np.isnan(values).all() or np.nanmax(values) <= 0:
+        return None
+    return np.nanquantile(values, RFM_QUANTILES)
+
+
+def assign_scores(values, breakpoints):
+    """
+    Score 1-5 de cada valor según los cortes (intervalos cerrados por la
+    derecha, como pd.qcut). Los NaN reciben el score mínimo. Sin empates
+    coincide con pd.qcut(rank(method='first')); con empates los valores
+    iguales reciben el mismo score en vez de repartirse por orden de fila.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if breakpoints is None:
+        return np.ones(len(values), dtype=np.int64)
+    scores = np.searchsorted(breakpoints, values, side='left') + 1
+    scores[np.isnan(values)] = 1
+    return scores
+
+
+def score_rfm(raw_values, breakpoints):
+    """Scores R/F/M y el RFM_Score combinado para un diccionario de valores crudos."""
+    scores = {col: assign_scores(raw_values[col], breakpoints[col]) for col in RFM_COLUMNS}
+    scores['RFM_Score'] = scores['R_Score'] + scores['F_Score'] + scores['M_Score']
+    return scores
+
+
+_lock = threading.Lock()
+_breakpoints_cache = {}
+
+
+def get_breakpoints(raw_values, data_version=None):
+    """
+    Cortes de quintiles por columna. Con `data_version` se calculan una sola vez
+    por versión del dataset y se reutilizan en las siguientes llamadas.
+    """
+    if data_version is not None:
+        with _lock:
+            cached = _breakpoints_cache.get(data_version)
+        if cached is not None:
+            return cached
+
+    breakpoints = {col: exact_breakpoints(raw_values[col]) for col in RFM_COLUMNS}
+
+    if data_version is not None:
+        with _lock:
+            # Solo interesa la versión vigente
+            _breakpoints_cache.clear()
+            _breakpoints_cache[data_version] = breakpoints
+    return breakpoints
+
+
+class KLLSketch:
+    """
+    Sketch de cuantiles aproximados estilo KLL: una jerarquía de compactadores
+    donde cada nivel guarda elementos con peso 2^nivel. Memoria O(k log(n/k)),
+    admite actualización por bloques y merge entre sketches. El error de rango
+    normalizado de cada cuantil queda por debajo de RANK_ERROR_FACTOR / k con
+    alta probabilidad (en la práctica ~1.5 / k).
+    """
+
+    RANK_ERROR_FACTOR = 4
+
+    def __init__(self, k=1024, seed=42):
+        self.k = k
+        self.n = 0
+        self.max_value = -np.inf
+        self.compactors = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(int(np.ceil(self.k * (2.0 / 3.0) ** depth)), 2)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.max_value = max(self.max_value, float(values.max()))
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, items in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], items])
+        self.n += other.n
+        self.max_value = max(self.max_value, other.max_value)
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            items = self.compactors[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                items = np.sort(items)
+                # Con cantidad impar, el último elemento se queda en este nivel
+                leftover = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                promoted = items[int(self.rng.integers(2))::2]
+                self.compactors[level] = leftover
+                self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], promoted])
+            level += 1
+
+    def quantiles(self, qs):
+        items = np.concatenate(self.compactors)
+        if len(items) == 0:
+            return np.full(len(qs), np.nan)
+        weights = np.concatenate([
+            np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(self.compactors)
+        ])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        ranks = np.asarray(qs, dtype=np.float64) * cumulative[-1]
+        positions = np.minimum(np.searchsorted(cumulative, ranks, side='left'), len(items) - 1)
+        return items[positions]
+
+    def breakpoints(self):
+        """Cortes aproximados de quintiles (None si no hay valores positivos)."""
+        if self.n == 0 or self.max_value <= 0:
+            return None
+        return self.quantiles(RFM_QUANTILES)
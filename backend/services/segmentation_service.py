@@ -1,94 +1,322 @@
+import contextlib
+import copy
+import json
+import operator
+import os
+import threading
 import pandas as pd
 import numpy as np
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from .. import data_handler
+from .. import data_handler, feature_store
+from . import cluster_model, rfm_engine, user_segment_store
 
-def calculate_rfm_scores(users_df):
+def calculate_rfm_scores(users_df, features=None, breakpoints=None):
     """
     Calcula scores RFM (Recency, Frequency, Monetary) para cada usuario.
     Como no tenemos fecha de última compra, usamos inversión de Engagement y Riesgo Churn.
+    Los valores se leen de la matriz de features mapeada, sin copiar `users_df`, y
+    cada score 1-5 se asigna con los cortes de quintiles de `breakpoints`
+    (si no se pasan, se calculan sobre estos mismos usuarios).
     """
-    df = users_df.copy()
+    if features is None:
+        features = feature_store.get_user_features(users_df)
+    df = users_df.copy(deep=False)
     
-    # R (Recency) - Usar inversa del Riesgo Churn como proxy
-    # Alto riesgo churn = baja recency
-    df['R_Score'] = 100 - df['Riesgo Churn']
+    raw_values = rfm_engine.raw_rfm_values(
+        features.column('Riesgo Churn'), features.column('Total Compras'), features.column('CLV')
+    )
+    if breakpoints is None:
+        breakpoints = rfm_engine.get_breakpoints(raw_values)
     
-    # F (Frequency) - Total de Compras
-    df['F_Score'] = df['Total Compras']
-    
-    # M (Monetary) - CLV (Customer Lifetime Value)
-    df['M_Score'] = df['CLV']
-    
-    # Normalizar scores a escala 1-5
-    for col in ['R_Score', 'F_Score', 'M_Score']:
-        if df[col].max() > 0:
-            df[col] = pd.qcut(df[col].rank(method='first'), q=5, labels=[1, 2, 3, 4, 5])
-        else:
-            df[col] = 1
-    
-    # RFM Score combinado
-    df['RFM_Score'] = df['R_Score'].astype(int) + df['F_Score'].astype(int) + df['M_Score'].astype(int)
+    for col, scores in rfm_engine.score_rfm(raw_values, breakpoints).items():
+        df[col] = scores
     
     return df
 
-def apply_kmeans_clustering(users_df, n_clusters=6):
+def apply_kmeans_clustering(users_df, n_clusters=6, features=None, force_refit=False):
     """
     Aplica K-Means clustering para segmentación automática.
+    Usa el modelo persistido (nearest-centroid); solo reentrena a pedido,
+    si no existe modelo o si la deriva supera el umbral.
     """
-    df = users_df.copy()
+    if features is None:
+        features = feature_store.get_user_features(users_df)
+    df = users_df.copy(deep=False)
     
-    # Seleccionar features para clustering
-    features = ['Engagement Score', 'Total Compras', 'CLV', 'Riesgo Churn']
-    X = df[features].fillna(0)
+    # Features para clustering (FEATURE_COLUMNS), leídas de la matriz mapeada
+    X = features.matrix
+    if np.isnan(X).any():
+        X = np.nan_to_num(X, nan=0.0)
     
-    # Normalizar datos
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    labels, model = cluster_model.assign_clusters(X, n_clusters=n_clusters, force_refit=force_refit)
+    df['Cluster_AI'] = labels
     
-    # Aplicar K-Means
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    df['Cluster_AI'] = kmeans.fit_predict(X_scaled)
-    
-    return df, kmeans
+    return df, model
 
-def classify_segment(row):
-    """
-    Clasifica un usuario en un segmento basado en reglas de negocio + RFM.
-    """
+# Reglas de segmentación de negocio, evaluadas en orden: gana la primera que
+# se cumple. Cada regla es una lista de alternativas (OR) y cada alternativa
+# una lista de condiciones (columna, operador, valor) que deben cumplirse todas (AND).
+SEGMENT_RULES = [
     # Regla 1: VIP/Champions (Alto valor, alta frecuencia, bajo riesgo)
-    if row['CLV'] > 1000 and row['Total Compras'] >= 5 and row['Riesgo Churn'] < 30:
-        return 'VIP Champions'
-    
+    ('VIP Champions', [[('CLV', '>', 1000), ('Total Compras', '>=', 5), ('Riesgo Churn', '<', 30)]]),
     # Regla 2: Leales (Compras regulares, engagement medio-alto)
-    elif row['Total Compras'] >= 2 and row['Engagement Score'] > 40 and row['Riesgo Churn'] < 50:
-        return 'Leales'
-    
+    ('Leales', [[('Total Compras', '>=', 2), ('Engagement Score', '>', 40), ('Riesgo Churn', '<', 50)]]),
     # Regla 3: En Riesgo (Antes activos, ahora alto riesgo)
-    elif row['Riesgo Churn'] >= 70:
-        return 'En Riesgo'
-    
+    ('En Riesgo', [[('Riesgo Churn', '>=', 70)]]),
     # Regla 4: Promesa (Nuevos con potencial - 1 compra, engagement alto)
-    elif row['Total Compras'] == 1 and row['Engagement Score'] > 50:
-        return 'Promesa'
-    
+    ('Promesa', [[('Total Compras', '==', 1), ('Engagement Score', '>', 50)]]),
     # Regla 5: Hibernando (Ocasionales, bajo engagement)
-    elif row['Tipo Usuario'] == 'occasional' and row['Engagement Score'] < 30:
-        return 'Hibernando'
-    
+    ('Hibernando', [[('Tipo Usuario', '==', 'occasional'), ('Engagement Score', '<', 30)]]),
     # Regla 6: Perdidos (Inactivos)
-    elif row['Tipo Usuario'] == 'inactive' or (row['Total Compras'] == 0 and row['Engagement Score'] < 20):
-        return 'Perdidos'
-    
-    # Default: Ocasionales
-    else:
-        return 'Ocasionales'
+    ('Perdidos', [[('Tipo Usuario', '==', 'inactive')], [('Total Compras', '==', 0), ('Engagement Score', '<', 20)]]),
+]
+
+# Default: Ocasionales
+DEFAULT_SEGMENT = 'Ocasionales'
+
+_RULE_OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+def _rule_mask(df, alternatives):
+    """Máscara booleana de una regla sobre todas las filas de `df`."""
+    mask = np.zeros(len(df), dtype=bool)
+    for conditions in alternatives:
+        branch = np.ones(len(df), dtype=bool)
+        for column, op, value in conditions:
+            branch &= np.asarray(_RULE_OPERATORS[op](df[column], value), dtype=bool)
+        mask |= branch
+    return mask
+
+def classify_segments(df, rules=None, default=DEFAULT_SEGMENT):
+    """
+    Clasifica todos los usuarios en segmentos de negocio de forma vectorizada.
+    Evalúa cada regla como una máscara booleana y respeta la prioridad de `rules`.
+    """
+    rules = SEGMENT_RULES if rules is None else rules
+    masks = [_rule_mask(df, alternatives) for _, alternatives in rules]
+    names = [name for name, _ in rules]
+    return pd.Series(np.select(masks, names, default=default), index=df.index, dtype=object)
+
+def classify_segment(row):
+    """
+    Clasifica un usuario en un segmento basado en reglas de negocio + RFM.
+    """
+    for name, alternatives in SEGMENT_RULES:
+        if any(all(_RULE_OPERATORS[op](row[column], value) for column, op, value in conditions)
+               for conditions in alternatives):
+            return name
+    return DEFAULT_SEGMENT
+
+# Versión del artefacto de segmentación: incrementar al cambiar el algoritmo o el payload
+SEGMENTATION_ARTIFACT_VERSION = 3
+ARTIFACTS_PATH = data_handler.SNAPSHOT_PATH / "segmentation"
+
+SEGMENTATION_MODES = ('batch', 'streaming')
+
+_artifact_lock = threading.Lock()
+_artifacts = {}
+
+def _artifact_key(mode):
+    return f"v{SEGMENTATION_ARTIFACT_VERSION}-{mode}-{data_handler.get_data_version(data_handler.USERS_FILE)}"
+
+def _read_artifact(key):
+    try:
+        with open(ARTIFACTS_PATH / f"{key}.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_artifact(key, mode, payload):
+    """Guarda el artefacto de forma atómica y elimina los de versiones anteriores del mismo modo."""
+    try:
+        ARTIFACTS_PATH.mkdir(parents=True, exist_ok=True)
+        target = ARTIFACTS_PATH / f"{key}.json"
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, target)
+        for old in ARTIFACTS_PATH.glob(f"*-{mode}-*.json"):
+            if old != target:
+                old.unlink(missing_ok=True)
+    except OSError as e:
+        print(f"No se pudo guardar el artefacto de segmentación: {str(e)}")
+
+def get_segmentation_data(force_refresh=False, refit_model=False, mode='batch'):
+    """
+    Devuelve los datos completos para la vista de segmentación.
+
+    El resultado se guarda como artefacto versionado, identificado por la huella
+    del dataset de usuarios: solo se recalcula (RFM, K-Means, clasificación)
+    cuando el dataset cambia o si se pide explícitamente con `force_refresh`.
+    Con `refit_model` además se reentrena el modelo de clustering.
+    `mode='streaming'` procesa el CSV por bloques (ver compute_segmentation_data_streaming).
+    """
+    if mode not in SEGMENTATION_MODES:
+        return {"status": "error", "error": f"Modo de segmentación desconocido: {mode}"}
+
+    key = _artifact_key(mode)
+
+    with _artifact_lock:
+        if not (force_refresh or refit_model):
+            cached = _artifacts.get(mode)
+            if cached and cached[0] == key:
+                return copy.deepcopy(cached[1])
+            payload = _read_artifact(key)
+            if payload is not None:
+                _artifacts[mode] = (key, payload)
+                return copy.deepcopy(payload)
+
+        if mode == 'streaming':
+            payload = compute_segmentation_data_streaming(store_version=key)
+        else:
+            payload = compute_segmentation_data(refit_model=refit_model, store_version=key)
+        if payload.get("status") == "success":
+            _write_artifact(key, mode, payload)
+            _artifacts[mode] = (key, payload)
+        return copy.deepcopy(payload)
+
+def ensure_user_segments(mode='batch'):
+    """Recalcula la segmentación de `mode` si su índice por usuario no corresponde a la versión vigente del dataset."""
+    if user_segment_store.get_version(mode) != _artifact_key(mode):
+        payload = get_segmentation_data(force_refresh=True, mode=mode)
+        if payload.get("status") != "success":
+            raise RuntimeError(payload.get("error", "No se pudo calcular la segmentación"))
+
+def get_user_segments(user_ids, mode='batch'):
+    """
+    Segmento, cluster y scores RFM de los usuarios pedidos, leídos del índice por ID.
+    Por defecto se usa el índice de la segmentación batch (la de /segmentation);
+    si no corresponde a la versión vigente del dataset, se recalcula antes.
+    """
+    users = user_segment_store.get_users(user_ids, mode, version=_artifact_key(mode))
+    if users is None:
+        ensure_user_segments(mode)
+        users = user_segment_store.get_users(user_ids, mode)
+    return users
+
+def iter_user_segments(batch_size=10000, mode='batch'):
+    """Todos los usuarios del índice de `mode` (ID, segmento, cluster y scores RFM), por lotes de tuplas."""
+    ensure_user_segments(mode)
+    return user_segment_store.iter_users(batch_size, mode)
+
+def _segment_aggregates(df):
+    """Sumas y conteos por segmento (mergeables entre bloques)."""
+    return df.groupby('Segmento', sort=False).agg(
+        usuarios=('Segmento', 'size'),
+        clv_sum=('CLV', 'sum'),
+        engagement_sum=('Engagement Score', 'sum'),
+        churn_sum=('Riesgo Churn', 'sum'),
+        compras_sum=('Total Compras', 'sum'),
+        rfm_sum=('RFM_Score', 'sum'),
+    ).astype(float)
+
+def _build_segmentation_payload(stats, totals, segmentos_ia, ml_info):
+    """
+    Arma el payload de /segmentation a partir de la tabla de agregados por segmento
+    (índice: segmento; columnas: usuarios y sumas) y de los totales globales.
+    """
+    total_clientes = int(totals['total_clientes'])
+    clv_total = totals['clv_total']
+    clv_promedio = round(totals['clv_pos_sum'] / totals['clv_pos_count'], 2) if clv_total > 0 and totals['clv_pos_count'] > 0 else 0
+
+    def metrics(segmento):
+        if segmento in stats.index and stats.at[segmento, 'usuarios'] > 0:
+            row = stats.loc[segmento]
+            n = row['usuarios']
+            return {
+                'usuarios': int(n),
+                'porcentaje': round(n / total_clientes * 100, 1),
+                'clv_promedio': round(row['clv_sum'] / n, 2),
+                'clv_total': round(row['clv_sum'], 2),
+                'engagement_promedio': round(row['engagement_sum'] / n, 1),
+                'riesgo_churn_promedio': round(row['churn_sum'] / n, 1),
+                'compras_promedio': round(row['compras_sum'] / n, 2),
+                'rfm_score_promedio': round(row['rfm_sum'] / n, 1),
+            }
+        return {'usuarios': 0, 'porcentaje': 0.0, 'clv_promedio': 0, 'clv_total': 0.0, 'engagement_promedio': 0,
+                'riesgo_churn_promedio': 0, 'compras_promedio': 0, 'rfm_score_promedio': 0}
+
+    segments_summary = {segmento: metrics(segmento) for segmento in stats.index if stats.at[segmento, 'usuarios'] > 0}
+
+    vip = metrics('VIP Champions')
+    churn = metrics('En Riesgo')
+    promesa = metrics('Promesa')
+    leales = metrics('Leales')
+    hibernando = metrics('Hibernando')
+    perdidos = metrics('Perdidos')
+
+    counts = stats['usuarios'][stats['usuarios'] > 0].sort_values(ascending=False, kind='stable')
+    clv_by_segment = stats['clv_sum'][stats['usuarios'] > 0].sort_index()
 
-def get_segmentation_data():
+    return {
+        "status": "success",
+        "kpis": {
+            "total_clientes": total_clientes,
+            "segmentos_activos": len(segments_summary),
+            "clv_promedio": clv_promedio,
+            "clv_total": round(clv_total, 2),
+            "segmentos_ia": segmentos_ia
+        },
+        "segments": {
+            "compradores_vip": {k: vip[k] for k in ('usuarios', 'porcentaje', 'clv_promedio', 'clv_total', 'engagement_promedio', 'compras_promedio')},
+            "en_riesgo_churn": {
+                "usuarios": churn['usuarios'],
+                "porcentaje": churn['porcentaje'],
+                "clv_potencial_perdido": churn['clv_total'],
+                "riesgo_promedio": churn['riesgo_churn_promedio'],
+                "engagement_promedio": churn['engagement_promedio']
+            },
+            "promesa": {
+                "usuarios": promesa['usuarios'],
+                "porcentaje": promesa['porcentaje'],
+                "engagement_promedio": promesa['engagement_promedio'],
+                "clv_promedio": promesa['clv_promedio'],
+                "potencial_estimado": round(promesa['usuarios'] * clv_promedio, 2) if clv_promedio > 0 else 0
+            },
+            "leales": {k: leales[k] for k in ('usuarios', 'porcentaje', 'clv_promedio', 'engagement_promedio', 'compras_promedio')},
+            "hibernando": {
+                "usuarios": hibernando['usuarios'],
+                "porcentaje": hibernando['porcentaje'],
+                "engagement_promedio": hibernando['engagement_promedio'],
+                "potencial_recuperacion": round(hibernando['usuarios'] * (clv_promedio * 0.5), 2)
+            },
+            "perdidos": {
+                "usuarios": perdidos['usuarios'],
+                "porcentaje": perdidos['porcentaje'],
+                "engagement_promedio": perdidos['engagement_promedio'],
+                "valor_perdido": perdidos['clv_total']
+            }
+        },
+        "segments_summary": segments_summary,
+        "charts": {
+            "segment_distribution": [
+                {"segment": k, "count": int(v), "percentage": round(v / total_clientes * 100, 1)}
+                for k, v in counts.items()
+            ],
+            "clv_by_segment": [
+                {"segment": k, "clv_total": round(v, 2)}
+                for k, v in clv_by_segment.items()
+            ]
+        },
+        "ml_info": {
+            "kmeans_clusters": segmentos_ia,
+            "rfm_calculated": True,
+            **ml_info
+        }
+    }
+
+def compute_segmentation_data(refit_model=False, store_version=None):
     """
     Calcula los datos completos para la vista de segmentación.
     Incluye RFM, ML Clustering, y métricas avanzadas.
+    Con `store_version` además vuelca el segmento de cada usuario al índice por ID.
     """
     users_df, _, _ = data_handler.load_data()
 
@@ -96,147 +324,128 @@ def get_segmentation_data():
         return {"error": "No se pudieron cargar los datos de usuarios."}
 
     try:
+        features = feature_store.get_user_features(users_df)
+        raw_rfm = rfm_engine.raw_rfm_values(
+            features.column('Riesgo Churn'), features.column('Total Compras'), features.column('CLV')
+        )
+        breakpoints = rfm_engine.get_breakpoints(raw_rfm, data_handler.get_data_version(data_handler.USERS_FILE))
+        
         # Aplicar RFM Scoring
-        users_df = calculate_rfm_scores(users_df)
+        users_df = calculate_rfm_scores(users_df, features, breakpoints)
         
         # Aplicar K-Means Clustering
-        users_df, kmeans_model = apply_kmeans_clustering(users_df)
+        users_df, kmeans_model = apply_kmeans_clustering(users_df, features=features, force_refit=refit_model)
         
         # Clasificar en segmentos de negocio
-        users_df['Segmento'] = users_df.apply(classify_segment, axis=1)
-        
-        # --- KPIs Generales ---
-        total_clientes = int(users_df.shape[0])
-        clv_total = users_df['CLV'].sum()
-        clv_promedio = round(users_df[users_df['CLV'] > 0]['CLV'].mean(), 2) if users_df['CLV'].sum() > 0 else 0
-        
-        # Contar segmentos únicos
-        segmentos_activos = users_df['Segmento'].nunique()
-        segmentos_ia = users_df['Cluster_AI'].nunique()
+        users_df['Segmento'] = classify_segments(users_df)
         
-        # --- Análisis por Segmento ---
-        segments_summary = {}
+        if store_version is not None:
+            with user_segment_store.bulk_writer(store_version, mode='batch') as write:
+                write(user_segment_store.frame_rows(users_df))
         
-        for segmento in users_df['Segmento'].unique():
-            seg_data = users_df[users_df['Segmento'] == segmento]
-            
-            segments_summary[segmento] = {
-                "usuarios": int(seg_data.shape[0]),
-                "porcentaje": round(seg_data.shape[0] / total_clientes * 100, 1),
-                "clv_promedio": round(seg_data['CLV'].mean(), 2),
-                "clv_total": round(seg_data['CLV'].sum(), 2),
-                "engagement_promedio": round(seg_data['Engagement Score'].mean(), 1),
-                "riesgo_churn_promedio": round(seg_data['Riesgo Churn'].mean(), 1),
-                "compras_promedio": round(seg_data['Total Compras'].mean(), 2),
-                "rfm_score_promedio": round(seg_data['RFM_Score'].mean(), 1)
-            }
+        # --- Agregados por segmento: una sola pasada (groupby) ---
+        stats = _segment_aggregates(users_df)
         
-        # --- Segmentos Específicos para la UI ---
+        clv = users_df['CLV']
+        totals = {
+            'total_clientes': int(users_df.shape[0]),
+            'clv_total': float(clv.sum()),
+            'clv_pos_sum': float(clv[clv > 0].sum()),
+            'clv_pos_count': int((clv > 0).sum())
+        }
+        segmentos_ia = int(users_df['Cluster_AI'].nunique())
         
-        # 1. VIP Champions
-        vip_segment = users_df[users_df['Segmento'] == 'VIP Champions']
-        compradores_vip = {
-            "usuarios": int(vip_segment.shape[0]),
-            "porcentaje": round(vip_segment.shape[0] / total_clientes * 100, 1),
-            "clv_promedio": round(vip_segment['CLV'].mean(), 2) if len(vip_segment) > 0 else 0,
-            "clv_total": round(vip_segment['CLV'].sum(), 2),
-            "engagement_promedio": round(vip_segment['Engagement Score'].mean(), 1) if len(vip_segment) > 0 else 0,
-            "compras_promedio": round(vip_segment['Total Compras'].mean(), 2) if len(vip_segment) > 0 else 0
+        return _build_segmentation_payload(stats, totals, segmentos_ia, {"model_version": kmeans_model.version})
+    except Exception as e:
+        return {
+            "status": "error",
+            "error": f"Error al procesar datos de segmentación: {str(e)}"
         }
 
-        # 2. En Riesgo de Churn
-        churn_segment = users_df[users_df['Segmento'] == 'En Riesgo']
-        en_riesgo_churn = {
-            "usuarios": int(churn_segment.shape[0]),
-            "porcentaje": round(churn_segment.shape[0] / total_clientes * 100, 1),
-            "clv_potencial_perdido": round(churn_segment['CLV'].sum(), 2),
-            "riesgo_promedio": round(churn_segment['Riesgo Churn'].mean(), 1) if len(churn_segment) > 0 else 0,
-            "engagement_promedio": round(churn_segment['Engagement Score'].mean(), 1) if len(churn_segment) > 0 else 0
-        }
+# --- Modo streaming (listas de millones de usuarios) ---
 
-        # 3. Promesa (Alto Potencial)
-        promesa_segment = users_df[users_df['Segmento'] == 'Promesa']
-        promesa = {
-            "usuarios": int(promesa_segment.shape[0]),
-            "porcentaje": round(promesa_segment.shape[0] / total_clientes * 100, 1),
-            "engagement_promedio": round(promesa_segment['Engagement Score'].mean(), 1) if len(promesa_segment) > 0 else 0,
-            "clv_promedio": round(promesa_segment['CLV'].mean(), 2) if len(promesa_segment) > 0 else 0,
-            "potencial_estimado": round(promesa_segment.shape[0] * clv_promedio, 2) if clv_promedio > 0 else 0
-        }
+STREAMING_CHUNK_SIZE = 200_000
+STREAMING_BATCH_SIZE = 4096
 
-        # 4. Leales
-        leales_segment = users_df[users_df['Segmento'] == 'Leales']
-        leales = {
-            "usuarios": int(leales_segment.shape[0]),
-            "porcentaje": round(leales_segment.shape[0] / total_clientes * 100, 1),
-            "clv_promedio": round(leales_segment['CLV'].mean(), 2) if len(leales_segment) > 0 else 0,
-            "engagement_promedio": round(leales_segment['Engagement Score'].mean(), 1) if len(leales_segment) > 0 else 0,
-            "compras_promedio": round(leales_segment['Total Compras'].mean(), 2) if len(leales_segment) > 0 else 0
-        }
-        
-        # 5. Hibernando
-        hibernando_segment = users_df[users_df['Segmento'] == 'Hibernando']
-        hibernando = {
-            "usuarios": int(hibernando_segment.shape[0]),
-            "porcentaje": round(hibernando_segment.shape[0] / total_clientes * 100, 1),
-            "engagement_promedio": round(hibernando_segment['Engagement Score'].mean(), 1) if len(hibernando_segment) > 0 else 0,
-            "potencial_recuperacion": round(hibernando_segment.shape[0] * (clv_promedio * 0.5), 2)
-        }
+_STREAMING_COLUMNS = ['ID', 'Tipo Usuario'] + feature_store.FEATURE_COLUMNS
 
-        # 6. Perdidos
-        perdidos_segment = users_df[users_df['Segmento'] == 'Perdidos']
-        perdidos = {
-            "usuarios": int(perdidos_segment.shape[0]),
-            "porcentaje": round(perdidos_segment.shape[0] / total_clientes * 100, 1),
-            "engagement_promedio": round(perdidos_segment['Engagement Score'].mean(), 1) if len(perdidos_segment) > 0 else 0,
-            "valor_perdido": round(perdidos_segment['CLV'].sum(), 2)
-        }
-        
-        # --- Datos para gráficos ---
-        
-        # Distribución de segmentos
-        segment_distribution = users_df['Segmento'].value_counts().to_dict()
-        segment_distribution_list = [
-            {"segment": k, "count": int(v), "percentage": round(v/total_clientes*100, 1)} 
-            for k, v in segment_distribution.items()
-        ]
-        
-        # CLV por segmento
-        clv_by_segment = users_df.groupby('Segmento')['CLV'].sum().to_dict()
-        clv_by_segment_list = [
-            {"segment": k, "clv_total": round(v, 2)} 
-            for k, v in clv_by_segment.items()
-        ]
+def _iter_user_chunks(chunksize):
+    return pd.read_csv(data_handler.USERS_FILE, encoding='utf-8', usecols=_STREAMING_COLUMNS, chunksize=chunksize)
 
-        return {
-            "status": "success",
-            "kpis": {
-                "total_clientes": total_clientes,
-                "segmentos_activos": segmentos_activos,
-                "clv_promedio": clv_promedio,
-                "clv_total": round(clv_total, 2),
-                "segmentos_ia": segmentos_ia
-            },
-            "segments": {
-                "compradores_vip": compradores_vip,
-                "en_riesgo_churn": en_riesgo_churn,
-                "promesa": promesa,
-                "leales": leales,
-                "hibernando": hibernando,
-                "perdidos": perdidos
-            },
-            "segments_summary": segments_summary,
-            "charts": {
-                "segment_distribution": segment_distribution_list,
-                "clv_by_segment": clv_by_segment_list
-            },
-            "ml_info": {
-                "kmeans_clusters": segmentos_ia,
-                "rfm_calculated": True
-            }
-        }
+def _chunk_features(chunk):
+    return chunk[feature_store.FEATURE_COLUMNS].fillna(0).to_numpy(dtype=np.float64)
+
+def _raw_rfm_values(chunk):
+    return rfm_engine.raw_rfm_values(chunk['Riesgo Churn'], chunk['Total Compras'], chunk['CLV'])
+
+def compute_segmentation_data_streaming(chunksize=STREAMING_CHUNK_SIZE, n_clusters=6, batch_size=STREAMING_BATCH_SIZE,
+                                        store_version=None):
+    """
+    Calcula la segmentación leyendo usuarios.csv por bloques, con memoria acotada.
+
+    1. Ajusta el scaler y alimenta sketches KLL para estimar los quintiles RFM.
+    2. Entrena MiniBatchKMeans con mini-lotes, clasifica y acumula las métricas por segmento.
+    3. Asigna clusters para contar los clusters efectivamente usados y, con
+       `store_version`, vuelca el segmento de cada usuario al índice por ID.
+
+    Devuelve el mismo payload que compute_segmentation_data.
+    """
+    try:
+        scaler = StandardScaler()
+        sketches = {col: rfm_engine.KLLSketch() for col in rfm_engine.RFM_COLUMNS}
+
+        for chunk in _iter_user_chunks(chunksize):
+            scaler.partial_fit(_chunk_features(chunk))
+            for col, values in _raw_rfm_values(chunk).items():
+                sketches[col].update(values)
+
+        if not hasattr(scaler, 'n_samples_seen_'):
+            return {"status": "error", "error": "No hay usuarios para segmentar."}
+
+        breakpoints = {col: sketch.breakpoints() for col, sketch in sketches.items()}
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=batch_size, n_init=3)
+
+        stats = None
+        totals = {'total_clientes': 0, 'clv_total': 0.0, 'clv_pos_sum': 0.0, 'clv_pos_count': 0}
+        pending = np.empty((0, len(feature_store.FEATURE_COLUMNS)))
+
+        for chunk in _iter_user_chunks(chunksize):
+            X_scaled = scaler.transform(_chunk_features(chunk))
+            # partial_fit necesita al menos n_clusters filas en el primer lote
+            pending = np.vstack([pending, X_scaled]) if len(pending) else X_scaled
+            for start in range(0, len(pending) - batch_size + 1, batch_size):
+                kmeans.partial_fit(pending[start:start + batch_size])
+            pending = pending[(len(pending) // batch_size) * batch_size:]
+
+            rfm = rfm_engine.score_rfm(_raw_rfm_values(chunk), breakpoints)['RFM_Score']
+            chunk = chunk.assign(RFM_Score=rfm, Segmento=classify_segments(chunk))
+            chunk_stats = _segment_aggregates(chunk)
+            stats = chunk_stats if stats is None else stats.add(chunk_stats, fill_value=0)
+
+            clv = chunk['CLV']
+            totals['total_clientes'] += len(chunk)
+            totals['clv_total'] += float(clv.sum())
+            totals['clv_pos_sum'] += float(clv[clv > 0].sum())
+            totals['clv_pos_count'] += int((clv > 0).sum())
+
+        if len(pending) >= n_clusters or not hasattr(kmeans, 'cluster_centers_'):
+            kmeans.partial_fit(pending)
+
+        used_clusters = np.zeros(n_clusters, dtype=bool)
+        with contextlib.ExitStack() as stack:
+            write = stack.enter_context(user_segment_store.bulk_writer(store_version, mode='streaming')) if store_version else None
+            for chunk in _iter_user_chunks(chunksize):
+                labels = kmeans.predict(scaler.transform(_chunk_features(chunk)))
+                used_clusters[np.unique(labels)] = True
+                if write is not None:
+                    scores = rfm_engine.score_rfm(_raw_rfm_values(chunk), breakpoints)
+                    write(user_segment_store.frame_rows(chunk.assign(
+                        Segmento=classify_segments(chunk), Cluster_AI=labels, **scores
+                    )))
+
+        return _build_segmentation_payload(stats, totals, int(used_clusters.sum()), {"mode": "streaming"})
     except Exception as e:
         return {
             "status": "error",
             "error": f"Error al procesar datos de segmentación: {str(e)}"
-        }
\ No newline at end of file
+        }
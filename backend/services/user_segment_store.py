@@ -0,0 +1,208 @@
+import sqlite3
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# Base directory for backend (project root)
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DB_PATH = os.path.join(BASE_DIR, 'data', 'segmentation.db')
+
+# SQLite admite como máximo 32766 parámetros por consulta
+_LOOKUP_CHUNK = 900
+
+USER_SEGMENT_COLUMNS = ('user_id', 'segmento', 'cluster_ai', 'r_score', 'f_score', 'm_score', 'rfm_score')
+
+# Cada modo de segmentación (batch, streaming) tiene su propio índice: los
+# clusters de un modo no son comparables con los del otro
+DEFAULT_MODE = 'batch'
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+# Conexión por thread (y por archivo) de las consultas por usuario
+_local = threading.local()
+
+
+def get_db_connection():
+    # Ensure directory exists
+    data_dir = os.path.dirname(DB_PATH)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir, exist_ok=True)
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    _ensure_schema(conn)
+    return conn
+
+
+def _thread_connection():
+    """
+    Conexión del thread actual (se abre una sola vez y se reutiliza). La usan
+    las consultas puntuales; las escrituras y los recorridos completos abren
+    la suya con get_db_connection.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(DB_PATH)
+    if conn is None:
+        conn = connections[DB_PATH] = get_db_connection()
+    return conn
+
+
+def _ensure_schema(conn):
+    with _schema_lock:
+        if DB_PATH in _schema_ready:
+            return
+        # WAL: las consultas por usuario no se bloquean mientras se reescribe la tabla
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Índices anteriores, sin columna de modo: son derivados y se reconstruyen
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(user_segments)")}
+        if columns and 'mode' not in columns:
+            conn.execute("DROP TABLE user_segments")
+            conn.execute("DROP TABLE IF EXISTS user_segments_meta")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_segments (
+            mode TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            segmento TEXT NOT NULL,
+            cluster_ai INTEGER,
+            r_score INTEGER,
+            f_score INTEGER,
+            m_score INTEGER,
+            rfm_score INTEGER,
+            PRIMARY KEY (mode, user_id)
+        ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_segments_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''')
+        conn.commit()
+        _schema_ready.add(DB_PATH)
+
+
+def _row_to_dict(row, version):
+    return {
+        'user_id': row['user_id'],
+        'segmento': row['segmento'],
+        'cluster_ai': row['cluster_ai'],
+        'r_score': row['r_score'],
+        'f_score': row['f_score'],
+        'm_score': row['m_score'],
+        'rfm_score': row['rfm_score'],
+        'data_version': version
+    }
+
+
+def _version_key(mode):
+    return f"version:{mode}"
+
+
+@contextmanager
+def bulk_writer(version: str, mode: str = DEFAULT_MODE):
+    """
+    Reemplaza el índice de `mode` dentro de una única transacción.
+    Entrega una función `write(rows)` que recibe tuplas
+    (user_id, segmento, cluster_ai, r, f, m, rfm); se puede llamar por bloques.
+    Los lectores siguen viendo la versión anterior hasta el commit.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM user_segments WHERE mode = ?", (mode,))
+
+        def write(rows: Iterable[tuple]):
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_segments (mode, user_id, segmento, cluster_ai, r_score, f_score, m_score, rfm_score) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((mode,) + tuple(row) for row in rows)
+            )
+
+        yield write
+        conn.execute(
+            "INSERT OR REPLACE INTO user_segments_meta (key, value) VALUES (?, ?)", (_version_key(mode), version)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def frame_rows(df):
+    """Tuplas para `bulk_writer` a partir de un DataFrame segmentado (ID, Segmento, Cluster_AI, scores)."""
+    return zip(
+        df['ID'].astype(str).tolist(),
+        df['Segmento'].astype(str).tolist(),
+        df['Cluster_AI'].astype(int).tolist(),
+        df['R_Score'].astype(int).tolist(),
+        df['F_Score'].astype(int).tolist(),
+        df['M_Score'].astype(int).tolist(),
+        df['RFM_Score'].astype(int).tolist()
+    )
+
+
+def _read_version(conn, mode):
+    row = conn.execute("SELECT value FROM user_segments_meta WHERE key = ?", (_version_key(mode),)).fetchone()
+    return row['value'] if row else None
+
+
+def get_version(mode: str = DEFAULT_MODE) -> Optional[str]:
+    return _read_version(_thread_connection(), mode)
+
+
+def get_user(user_id: str, mode: str = DEFAULT_MODE) -> Optional[Dict]:
+    return get_users([user_id], mode).get(user_id)
+
+
+def get_users(user_ids: List[str], mode: str = DEFAULT_MODE, version: Optional[str] = None) -> Optional[Dict[str, Dict]]:
+    """
+    Segmento, cluster y scores RFM de cada ID encontrado en el índice de `mode`
+    (búsqueda por clave primaria). Con `version`, devuelve None si el índice
+    guardado es de otra versión; la verificación y la lectura se hacen en la
+    misma transacción, sobre la misma instantánea.
+    """
+    conn = _thread_connection()
+    conn.execute("BEGIN")
+    try:
+        stored_version = _read_version(conn, mode)
+        if version is not None and stored_version != version:
+            return None
+
+        found = {}
+        unique_ids = list(dict.fromkeys(user_ids))
+        for start in range(0, len(unique_ids), _LOOKUP_CHUNK):
+            chunk = unique_ids[start:start + _LOOKUP_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT * FROM user_segments WHERE mode = ? AND user_id IN ({placeholders})", [mode] + chunk
+            ).fetchall()
+            for row in rows:
+                found[row['user_id']] = _row_to_dict(row, stored_version)
+        return found
+    finally:
+        conn.commit()
+
+
+def iter_users(batch_size: int = 10000, mode: str = DEFAULT_MODE):
+    """
+    Recorre el índice de `mode` en orden de user_id, en lotes de `batch_size`
+    tuplas con las columnas de USER_SEGMENT_COLUMNS (sin cargarlo entero en memoria).
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            f"SELECT {', '.join(USER_SEGMENT_COLUMNS)} FROM user_segments WHERE mode = ? ORDER BY user_id",
+            (mode,)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+    finally:
+        conn.close()
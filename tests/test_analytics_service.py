@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from backend.services import analytics_service
+
+CAMPAIGNS = pd.DataFrame({
+    "ID": ["CAMP_EMAIL_0002", "CAMP_EMAIL_0001"],
+    "Fecha Envío": pd.to_datetime(["2025-10-20", "2025-10-01"]),
+    "Destinatarios": [1000, 2000],
+    "Conversiones": [2, 5],
+    "Revenue": [150.0, 90.5],
+})
+COLS = analytics_service.bind_schema("campaigns", tuple(CAMPAIGNS.columns))
+START = pd.Timestamp("2025-09-01")
+NEW_CAMPAIGN = pd.DataFrame({
+    "ID": ["CAMP_EMAIL_0003"],
+    "Fecha Envío": pd.to_datetime(["2025-10-25"]),
+    "Destinatarios": [500],
+    "Conversiones": [7],
+    "Revenue": [40.0],
+})
+
+
+def _service(campaigns, data_version):
+    return analytics_service.AnalyticsService(None, campaigns, None, data_version=data_version)
+
+
+def test_campaign_index_is_shared_per_data_version(monkeypatch):
+    built = []
+    original = analytics_service.CampaignIndex
+
+    def counting_index(*args, **kwargs):
+        built.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(analytics_service, "CampaignIndex", counting_index)
+    monkeypatch.setattr(analytics_service, "_index_cache", {"key": None, "index": None})
+
+    first = _service(CAMPAIGNS, "v1").campaign_index
+    assert _service(CAMPAIGNS, "v1").campaign_index is first
+    assert len(built) == 1
+
+    # Una versión nueva del dataset rearma el índice con sus filas
+    updated = pd.concat([CAMPAIGNS, CAMPAIGNS.assign(ID="CAMP_EMAIL_0003")], ignore_index=True)
+    second = _service(updated, "v2").campaign_index
+    assert second is not first
+    assert len(second.since(pd.Timestamp("2025-10-15"))) == 2
+    assert len(built) == 2
+
+    # Sin versión no se comparte
+    assert _service(CAMPAIGNS, None).campaign_index is not first
+
+
+@pytest.fixture
+def rollup_cache(monkeypatch):
+    built = []
+    from_frame = analytics_service.DailyRollup.from_frame.__func__
+
+    def counting_from_frame(cls, campaigns_df, cols):
+        built.append(len(campaigns_df))
+        return from_frame(cls, campaigns_df, cols)
+
+    monkeypatch.setattr(analytics_service.DailyRollup, "from_frame", classmethod(counting_from_frame))
+    monkeypatch.setattr(analytics_service, "_rollup_cache", {"version": None, "rollup": None})
+    analytics_service.get_daily_rollup(CAMPAIGNS, COLS, "v1")
+    return built
+
+
+def _totals(campaigns_df, version):
+    return analytics_service.get_daily_rollup(campaigns_df, COLS, version).totals(START)
+
+
+def test_appended_rows_extend_the_rollup(rollup_cache):
+    appended = pd.concat([CAMPAIGNS, NEW_CAMPAIGN], ignore_index=True)
+
+    totals = _totals(appended, "v2")
+
+    assert rollup_cache == [2]
+    assert totals["conversions"] == 14 and totals["campaigns"] == 3
+    assert totals == analytics_service.DailyRollup.from_frame(appended, COLS).totals(START)
+    # El cubo anterior no se modifica
+    assert _totals(CAMPAIGNS, "v1")["conversions"] == 7
+
+
+@pytest.mark.parametrize("changed", [
+    CAMPAIGNS.assign(Conversiones=CAMPAIGNS["Conversiones"] + 1000),
+    pd.concat([CAMPAIGNS.assign(Revenue=[0.0, 90.5]), NEW_CAMPAIGN], ignore_index=True),
+    CAMPAIGNS.iloc[:1],
+])
+def test_edited_or_truncated_rows_rebuild_the_rollup(rollup_cache, changed):
+    totals = _totals(changed, "v2")
+
+    assert rollup_cache == [2, len(changed)]
+    expected = analytics_service.DailyRollup(COLS)
+    expected.add_campaigns(changed)
+    assert totals == expected.totals(START)
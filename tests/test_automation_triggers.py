@@ -0,0 +1,50 @@
+from backend.services.automation_service import AutomationService
+from backend.services.database import AutomationDB
+
+FLOW = {
+    "name": "Bienvenida",
+    "description": "",
+    "status": "active",
+    "trigger_type": "encuesta_respondida",
+    "steps": [
+        {"step_id": "step1", "type": "trigger", "name": "Trigger", "config": {}, "next_steps": ["step2"]},
+        {"step_id": "step2", "type": "email", "name": "Email", "config": {"subject": "Hola"}, "next_steps": []},
+    ],
+}
+
+# Los eventos sin mapeo en EVENT_TRIGGERS activan el trigger de igual nombre
+EVENT = {"event_type": "encuesta_respondida", "user_id": "USER_1"}
+
+
+def _service(db_path):
+    return AutomationService(db=AutomationDB(db_path))
+
+
+def test_trigger_index_sees_flows_changed_by_other_processes(tmp_path):
+    db_path = str(tmp_path / "automation.db")
+    worker = _service(db_path)
+    other = _service(db_path)
+
+    assert worker.ingest_events([EVENT])["executions_started"] == 0
+
+    flow_id = other.create_flow(FLOW)["flow_id"]
+    assert worker.ingest_events([EVENT])["executions_started"] == 1
+
+    other.toggle_flow_status(flow_id)
+    assert worker.ingest_events([EVENT])["executions_started"] == 0
+
+    other.toggle_flow_status(flow_id)
+    other.delete_flow(flow_id)
+    assert worker.ingest_events([EVENT])["executions_started"] == 0
+
+
+def test_unchanged_flows_reuse_the_trigger_index(tmp_path, monkeypatch):
+    service = _service(str(tmp_path / "automation.db"))
+    service.create_flow(FLOW)
+    service.ingest_events([EVENT])
+
+    def fail():
+        raise AssertionError("el índice no debería rearmarse")
+
+    monkeypatch.setattr(service.db, "get_all_flows", fail)
+    assert service.ingest_events([EVENT, EVENT])["executions_started"] == 2
@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+from backend import data_handler
+from backend.services import campaigns_service
+
+CAMPAIGNS_CSV = (
+    "ID,Nombre,Fecha Envío,Destinatarios,Tasa Apertura,CTR,Conversiones,Revenue\n"
+    "CAMP_EMAIL_0021,Te extrañamos,2025-10-23,3070,19.05,5.25,2,181.47\n"
+    "CAMP_EMAIL_0005,Novedades,2025-10-12,5212,25.86,3.67,5,849.79\n"
+)
+
+
+@pytest.fixture
+def campaigns_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_handler, "SNAPSHOT_PATH", tmp_path / "snapshots")
+    path = tmp_path / data_handler.CAMPAIGNS_FILE.name
+    path.write_text(CAMPAIGNS_CSV, encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("from_snapshot", [False, True])
+def test_rates_keep_csv_precision(campaigns_csv, from_snapshot):
+    if from_snapshot:
+        data_handler.build_snapshot(campaigns_csv)
+    df = data_handler._load_dataset(campaigns_csv)
+
+    assert df['Tasa Apertura'].dtype == 'float64'
+    assert df['Tasa Apertura'].iloc[0] == 19.05
+
+
+def test_old_snapshot_formats_are_replaced(campaigns_csv):
+    data_handler.SNAPSHOT_PATH.mkdir(parents=True)
+    legacy = data_handler.SNAPSHOT_PATH / "campanas_email.feather"
+    legacy.write_bytes(b"")
+
+    target = data_handler.build_snapshot(campaigns_csv)
+
+    assert target.exists()
+    assert not legacy.exists()
+
+
+def test_campaign_detail_date_is_iso_day(campaigns_csv, monkeypatch):
+    campaigns = data_handler._load_dataset(campaigns_csv)
+    monkeypatch.setattr(data_handler, "load_data", lambda: (None, campaigns, None))
+
+    detail = campaigns_service.get_campaign_detail("CAMP_EMAIL_0021")
+
+    assert detail["date"] == "2025-10-23"
+    assert detail["open_rate"] == 19.05
+    assert pd.api.types.is_datetime64_any_dtype(campaigns['Fecha Envío'])
+
+
+def test_registry_views_do_not_modify_the_shared_frame(campaigns_csv):
+    registry = data_handler.DatasetRegistry()
+
+    view = registry.get(campaigns_csv, data_handler._load_dataset)
+    view.loc[0, 'Tasa Apertura'] = 0.0
+    view['Extra'] = 1
+
+    fresh = registry.get(campaigns_csv, data_handler._load_dataset)
+    assert fresh['Tasa Apertura'].iloc[0] == 19.05
+    assert 'Extra' not in fresh.columns
+
+
+def test_registry_reloads_changed_files(campaigns_csv):
+    registry = data_handler.DatasetRegistry()
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        return data_handler._load_dataset(path)
+
+    registry.get(campaigns_csv, loader)
+    registry.get(campaigns_csv, loader)
+    assert len(calls) == 1
+
+    campaigns_csv.write_text(CAMPAIGNS_CSV + "CAMP_EMAIL_0030,Nuevo,2025-10-25,100,10.0,1.0,0,0\n", encoding="utf-8")
+    assert len(registry.get(campaigns_csv, loader)) == 3
+    assert len(calls) == 2
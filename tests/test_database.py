@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from backend.services.database import AutomationDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = AutomationDB(str(tmp_path / "automation.db"))
+    yield db
+    db.close()
+
+
+def test_other_threads_wait_for_the_schema(db, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    init_database = db.init_database
+
+    def slow_init():
+        started.set()
+        release.wait(timeout=5)
+        init_database()
+
+    monkeypatch.setattr(db, "init_database", slow_init)
+    first = threading.Thread(target=db.get_connection)
+    first.start()
+    assert started.wait(timeout=5)
+
+    flows = []
+    second = threading.Thread(target=lambda: flows.extend(db.get_all_flows()))
+    second.start()
+    second.join(timeout=0.2)
+    # Mientras se crea el esquema la segunda consulta espera en vez de fallar
+    assert second.is_alive()
+
+    release.set()
+    first.join(timeout=5)
+    second.join(timeout=5)
+    assert flows
+
+
+def test_failed_initialization_is_retried(db, monkeypatch):
+    init_database = db.init_database
+    calls = []
+
+    def flaky_init():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        init_database()
+
+    monkeypatch.setattr(db, "init_database", flaky_init)
+
+    with pytest.raises(RuntimeError):
+        db.get_connection()
+    assert db.get_all_flows()
+    assert len(calls) == 2
@@ -0,0 +1,78 @@
+import json
+
+import pandas as pd
+import pytest
+
+from backend import data_handler, feature_store
+
+USERS = pd.DataFrame({
+    "ID": ["USER_1", "USER_2", "USER_3", "USER_4"],
+    "Engagement Score": [10.0, 20.0, 30.0, 40.0],
+    "Total Compras": [1, 2, 3, 4],
+    "CLV": [100.0, 200.0, 300.0, 400.0],
+    "Riesgo Churn": [0.1, 0.2, 0.3, 0.4],
+})
+
+
+def test_matches_compares_every_id():
+    features = feature_store.UserFeatureMatrix.from_frame(USERS)
+    assert features.matches(USERS)
+
+    # Mismo largo y mismos extremos, filas del medio en otro orden
+    reordered = USERS.iloc[[0, 2, 1, 3]].reset_index(drop=True)
+    assert not features.matches(reordered)
+
+    edited = USERS.assign(ID=["USER_1", "USER_9", "USER_3", "USER_4"])
+    assert not features.matches(edited)
+
+
+def _from_registry(users_df, signature):
+    """Copia de `users_df` con el origen que le asigna el registro de datasets."""
+    df = users_df.copy()
+    df.attrs[data_handler.SOURCE_ATTR] = {
+        "path": str(data_handler.USERS_FILE), "signature": signature, "rows": len(df),
+    }
+    return df
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    for name in ("FEATURES_FILE", "IDS_FILE", "META_FILE"):
+        monkeypatch.setattr(feature_store, name, tmp_path / getattr(feature_store, name).name)
+    monkeypatch.setattr(feature_store.data_handler, "SNAPSHOT_PATH", tmp_path)
+    monkeypatch.setattr(feature_store, "_current", {"signature": None, "features": None})
+    return feature_store
+
+
+def test_misaligned_frame_gets_its_own_matrix(store, monkeypatch):
+    stale = store.UserFeatureMatrix.from_frame(USERS)
+    monkeypatch.setattr(store, "_current", {"signature": [1, 1], "features": stale})
+
+    reordered = _from_registry(USERS.iloc[[0, 2, 1, 3]].reset_index(drop=True), [1, 1])
+    features = store.get_user_features(reordered)
+
+    assert features is not stale
+    assert features.row("USER_2")[0] == 20.0
+    assert list(features.column("Engagement Score")) == [10.0, 30.0, 20.0, 40.0]
+
+
+def test_matrix_is_saved_under_the_signature_of_its_frame(store, monkeypatch):
+    # El CSV ya cambió en disco: la firma actual del archivo no se consulta
+    monkeypatch.setattr(data_handler.registry, "file_signature", lambda path: (9, 9))
+
+    features = store.get_user_features(_from_registry(USERS, [1, 1]))
+
+    assert features.matches(USERS)
+    assert json.loads(store.META_FILE.read_text())["signature"] == [1, 1]
+
+    newer = _from_registry(USERS.assign(CLV=[1.0, 2.0, 3.0, 4.0]), [2, 2])
+    assert list(store.get_user_features(newer).column("CLV")) == [1.0, 2.0, 3.0, 4.0]
+    assert json.loads(store.META_FILE.read_text())["signature"] == [2, 2]
+
+
+def test_frames_outside_the_registry_are_not_persisted(store):
+    features = store.get_user_features(USERS)
+    subset = store.get_user_features(_from_registry(USERS, [1, 1]).iloc[:2])
+
+    assert len(features) == 4 and len(subset) == 2
+    assert not store.META_FILE.exists()
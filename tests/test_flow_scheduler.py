@@ -0,0 +1,191 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.services.automation_service import AutomationService, CLAIM_LEASE_MINUTES, EXECUTION_RETRY_MINUTES
+from backend.services.database import AutomationDB
+from backend.services.flow_scheduler import ExecutionScheduler
+
+FLOW_STEPS = [
+    {"step_id": "step1", "type": "trigger", "name": "Trigger", "config": {}, "next_steps": ["step2"]},
+    {"step_id": "step2", "type": "email", "name": "Email", "config": {"subject": "Hola"}, "next_steps": []},
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "automation.db")
+
+
+def _service(db_path):
+    service = AutomationService(db=AutomationDB(db_path))
+    # Cada ronda consulta si otro proceso agregó ejecuciones
+    service.scheduler.rescan_seconds = 0
+    return service
+
+
+def _start(service, now):
+    flow_id = service.db.create_flow({
+        "name": "Flujo de prueba",
+        "description": "",
+        "status": "active",
+        "trigger_type": "new_user",
+        "steps": FLOW_STEPS,
+    })
+    execution = {
+        "flow_id": flow_id,
+        "user_id": "USER_1",
+        "current_step_id": "step1",
+        "next_run_at": now,
+    }
+    service._start_executions([execution])
+    return execution["id"]
+
+
+def _next_run_at(service, execution_id):
+    return datetime.fromisoformat(service.db.get_executions([execution_id])[execution_id]["next_run_at"])
+
+
+def test_failed_batch_is_persisted_and_retried(db_path, monkeypatch):
+    service = _service(db_path)
+    now = datetime.now()
+    execution_id = _start(service, now)
+
+    def fail(updates):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(service.db, "advance_executions", fail)
+    assert service.process_scheduled_steps(now) == {"processed": 0, "completed": 0}
+    monkeypatch.undo()
+
+    retry_at = now + timedelta(minutes=EXECUTION_RETRY_MINUTES)
+    assert _next_run_at(service, execution_id) == retry_at
+
+    assert service.process_scheduled_steps(retry_at - timedelta(seconds=1))["processed"] == 0
+    assert service.process_scheduled_steps(retry_at) == {"processed": 1, "completed": 1}
+
+
+def test_failed_batch_is_retried_after_restart(db_path, monkeypatch):
+    service = _service(db_path)
+    now = datetime.now()
+    execution_id = _start(service, now)
+
+    monkeypatch.setattr(service.db, "advance_executions", lambda updates: 1 / 0)
+    service.process_scheduled_steps(now)
+    monkeypatch.undo()
+
+    # Un proceso nuevo solo conoce lo guardado en SQLite
+    restarted = _service(db_path)
+    retry_at = now + timedelta(minutes=EXECUTION_RETRY_MINUTES)
+    assert restarted.process_scheduled_steps(retry_at) == {"processed": 1, "completed": 1}
+    assert restarted.db.get_executions([execution_id])[execution_id]["completed"]
+
+
+def test_failed_step_is_retried(db_path, monkeypatch):
+    service = _service(db_path)
+    now = datetime.now()
+    execution_id = _start(service, now)
+
+    def fail(executions, step):
+        raise RuntimeError("proveedor de email caído")
+
+    monkeypatch.setattr(service, "execute_step_batch", fail)
+    assert service.process_scheduled_steps(now) == {"processed": 1, "completed": 0}
+    monkeypatch.undo()
+
+    retry_at = now + timedelta(minutes=EXECUTION_RETRY_MINUTES)
+    assert _next_run_at(service, execution_id) == retry_at
+    assert service.process_scheduled_steps(retry_at) == {"processed": 1, "completed": 1}
+
+
+class _EmptyDB:
+    def get_scheduled_executions(self, until):
+        return []
+
+    def get_executions_version(self):
+        return 0
+
+
+def test_schedule_keeps_entries_beyond_the_window():
+    scheduler = ExecutionScheduler(_EmptyDB(), window_seconds=60)
+    now = datetime.now()
+    assert scheduler.pop_due(now) == []
+
+    run_at = now + timedelta(hours=2)
+    scheduler.schedule("exec-1", run_at)
+    scheduler.schedule("exec-1", run_at)
+
+    assert scheduler.pop_due(run_at - timedelta(seconds=1)) == []
+    assert scheduler.pop_due(run_at) == ["exec-1"]
+
+
+def test_due_executions_run_each_step_once_per_batch(db_path, monkeypatch):
+    service = AutomationService(step_batch_size=2, db=AutomationDB(db_path))
+    now = datetime.now()
+    flow_id = service.db.create_flow({
+        "name": "Flujo de prueba",
+        "description": "",
+        "status": "active",
+        "trigger_type": "new_user",
+        "steps": FLOW_STEPS,
+    })
+    service._start_executions([
+        {"flow_id": flow_id, "user_id": f"USER_{i}", "current_step_id": "step1", "next_run_at": now}
+        for i in range(5)
+    ])
+
+    sent = []
+    execute_email_batch = service._execute_email_batch
+
+    def record(step_data, user_ids):
+        sent.append(len(user_ids))
+        return execute_email_batch(step_data, user_ids)
+
+    monkeypatch.setattr(service, "_execute_email_batch", record)
+
+    assert service.process_scheduled_steps(now) == {"processed": 5, "completed": 5}
+    assert sorted(sent) == [1, 2, 2]
+
+
+def test_each_execution_runs_in_a_single_process(db_path):
+    first, second = _service(db_path), _service(db_path)
+    now = datetime.now()
+    _start(first, now)
+
+    # Ambos procesos tienen la ejecución en su heap
+    assert second.scheduler.pop_due(now - timedelta(seconds=1)) == []
+    results = [first.process_scheduled_steps(now), second.process_scheduled_steps(now)]
+
+    assert sorted(result["processed"] for result in results) == [0, 1]
+
+
+def test_executions_added_below_the_horizon_by_other_processes_are_loaded(db_path):
+    worker, other = _service(db_path), _service(db_path)
+    now = datetime.now()
+    assert worker.scheduler.pop_due(now) == []
+
+    # La otra ejecución vence dentro de la ventana ya cargada por `worker`
+    execution_id = _start(other, now + timedelta(minutes=5))
+
+    assert worker.process_scheduled_steps(now + timedelta(minutes=5)) == {"processed": 1, "completed": 1}
+    assert worker.db.get_executions([execution_id])[execution_id]["completed"]
+    assert other.process_scheduled_steps(now + timedelta(minutes=5))["processed"] == 0
+
+
+def test_claims_of_a_crashed_process_are_retaken(db_path):
+    worker = _service(db_path)
+    now = datetime.now()
+    execution_id = _start(worker, now)
+    assert worker.scheduler.pop_due(now - timedelta(seconds=1)) == []
+
+    # Otro proceso la reclamó y cayó sin guardar el avance
+    crashed = AutomationDB(db_path)
+    lease_until = now + timedelta(minutes=CLAIM_LEASE_MINUTES)
+    assert crashed.claim_executions([execution_id], now, lease_until) == [execution_id]
+    assert crashed.claim_executions([execution_id], now, lease_until) == []
+
+    assert worker.process_scheduled_steps(now)["processed"] == 0
+    # La próxima recarga de la ventana la encuentra con el lease vencido
+    reload_at = now + timedelta(seconds=worker.scheduler.window_seconds / 2)
+    assert worker.process_scheduled_steps(reload_at) == {"processed": 1, "completed": 1}
@@ -0,0 +1,99 @@
+import time
+from datetime import date
+
+import pytest
+
+from backend.services import report_service
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Reemplaza el render real: cada llamada escribe un PDF mínimo y usa el próximo resultado de la IA."""
+    calls = []
+    results = []
+
+    def fake_render(period, output, data_version=None):
+        calls.append(period)
+        output.write(b"%PDF-1.4 prueba")
+        return results.pop(0) if results else True
+
+    monkeypatch.setattr(report_service, "render_analytics_pdf", fake_render)
+    monkeypatch.setattr(report_service.data_handler, "get_data_version", lambda *paths: "abc123")
+    return calls, results
+
+
+def _artifact(manager, period, report_date=None):
+    return manager.artifact_path(period, report_date or date.today().isoformat(), "abc123")
+
+
+def _finished(job):
+    assert job.wait(timeout=5)
+    return job
+
+
+def test_fallback_render_is_not_reused(tmp_path, renders):
+    calls, results = renders
+    manager = report_service.ReportJobManager(storage=tmp_path)
+
+    results.append(False)
+    first = _finished(manager.submit("30days"))
+    assert first.status == 'done' and first.ai_fallback
+    assert not _artifact(manager, "30days").exists()
+
+    second = _finished(manager.submit("30days"))
+    assert second is not first
+    assert not second.ai_fallback
+    assert _artifact(manager, "30days").exists()
+    assert len(calls) == 2
+
+    # El artefacto completo sí se reutiliza, también desde otro proceso
+    assert manager.submit("30days") is second
+    other = report_service.ReportJobManager(storage=tmp_path)
+    assert _finished(other.submit("30days")).file == _artifact(manager, "30days")
+    assert len(calls) == 2
+
+
+def test_finished_jobs_are_evicted(tmp_path, renders):
+    manager = report_service.ReportJobManager(storage=tmp_path, max_finished_jobs=2)
+
+    jobs = [_finished(manager.submit(period)) for period in ("7days", "30days", "3months", "year")]
+
+    # Cada submit descarta lo que excede el máximo antes de agregar su trabajo
+    assert manager.get(jobs[0].id) is None
+    assert manager.get(jobs[1].id) is jobs[1]
+
+    _finished(manager.submit("7days"))
+    assert manager.get(jobs[1].id) is None
+    assert [manager.get(job.id) for job in jobs[2:]] == jobs[2:]
+
+
+def test_expired_jobs_and_fallback_files_are_removed(tmp_path, renders):
+    calls, results = renders
+    manager = report_service.ReportJobManager(storage=tmp_path, retention_seconds=0.05)
+
+    results.append(False)
+    job = _finished(manager.submit("7days"))
+    assert job.file.exists()
+
+    time.sleep(0.1)
+    _finished(manager.submit("30days"))
+
+    assert manager.get(job.id) is None
+    assert not job.file.exists()
+
+
+def test_artifacts_are_keyed_by_day_and_replaced(tmp_path, renders, monkeypatch):
+    calls, results = renders
+    yesterday = _artifact(report_service.ReportJobManager(storage=tmp_path), "7days", "2025-10-22")
+    yesterday.write_bytes(b"%PDF-1.4 ayer")
+    other_period = _artifact(report_service.ReportJobManager(storage=tmp_path), "30days", "2025-10-22")
+    other_period.write_bytes(b"%PDF-1.4 ayer")
+
+    # El PDF de ayer no se sirve: la ventana del período cambió
+    job = _finished(report_service.ReportJobManager(storage=tmp_path).submit("7days"))
+    assert job.file == _artifact(report_service.ReportJobManager(storage=tmp_path), "7days")
+    assert job.report_date == date.today().isoformat()
+    assert len(calls) == 1
+
+    assert not yesterday.exists()
+    assert other_period.exists()
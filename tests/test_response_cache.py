@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routers import analytics
+from backend.services.response_cache import CachedResponse, ResponseCache
+
+
+def _counter(values):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return values[min(len(calls), len(values)) - 1]
+
+    return compute, calls
+
+
+def test_fresh_entries_are_not_recomputed():
+    cache = ResponseCache(ttl=60)
+    compute, calls = _counter([{"total": 1}])
+
+    first = cache.get("overview", compute)
+    assert cache.get("overview", compute) is first
+    assert first.body == b'{"total":1}'
+    assert len(calls) == 1
+
+
+def test_stale_entries_are_served_while_refreshing():
+    cache = ResponseCache(ttl=0, stale_ttl=60)
+    refreshed = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        if len(calls) > 1:
+            refreshed.set()
+        return {"total": len(calls)}
+
+    first = cache.get("overview", compute)
+    assert cache.get("overview", compute) is first
+    assert refreshed.wait(timeout=5)
+    cache._executor.shutdown(wait=True)
+    assert cache._entries["overview"].body == b'{"total":2}'
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.get(key, lambda: {"key": key})
+    cache.get("a", lambda: {})
+    cache.get("c", lambda: {"key": "c"})
+
+    assert list(cache._entries) == ["a", "c"]
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"otro"', False),
+    ("*", True),
+])
+def test_if_none_match(header, expected):
+    assert CachedResponse.from_payload({"total": 1}).matches(header) is expected
+
+
+def test_if_none_match_accepts_weak_and_listed_tags():
+    entry = CachedResponse.from_payload({"total": 1})
+    assert entry.matches(f'W/{entry.etag}')
+    assert entry.matches(f'"otro", {entry.etag}')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    def fake_analytics(users_df, campaigns_df, social_df, period, data_version=None):
+        calls.append(period)
+        return {"period": period, "total_revenue": 181.47}
+
+    monkeypatch.setattr(analytics, "response_cache", ResponseCache())
+    monkeypatch.setattr(analytics, "_load_datasets", lambda: (None, None, None))
+    monkeypatch.setattr(analytics, "_campaigns_version", lambda: "v1")
+    monkeypatch.setattr(analytics.data_handler, "get_data_version", lambda *paths: "v1")
+    monkeypatch.setattr(analytics.analytics_service, "get_analytics_data", fake_analytics)
+
+    app = FastAPI()
+    app.include_router(analytics.router, prefix="/api/v1")
+    return TestClient(app), calls
+
+
+def test_matching_etag_returns_304(client):
+    http, calls = client
+
+    response = http.get("/api/v1/analytics/overview?period=7days")
+    assert response.status_code == 200
+    assert response.json() == {"period": "7days", "total_revenue": 181.47}
+    etag = response.headers["etag"]
+
+    cached = http.get("/api/v1/analytics/overview?period=7days", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert calls == ["7days"]
+
+    other = http.get("/api/v1/analytics/overview?period=year", headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert calls == ["7days", "year"]
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.services import rfm_engine
+
+
+def _qcut_by_rank(values):
+    """Scoring original: quintiles sobre el ranking (los empates se reparten por orden de fila)."""
+    ranks = pd.Series(values).rank(method='first')
+    return pd.qcut(ranks, q=5, labels=[1, 2, 3, 4, 5]).astype(int).to_numpy()
+
+
+@pytest.mark.parametrize("n", [5, 37, 1000, 30001])
+def test_untied_scores_match_qcut(n):
+    values = np.random.default_rng(n).permutation(np.linspace(1, 500, n))
+
+    scores = rfm_engine.assign_scores(values, rfm_engine.exact_breakpoints(values))
+
+    assert np.array_equal(scores, _qcut_by_rank(values))
+
+
+def test_tied_values_share_a_score():
+    values = np.array([0, 0, 0, 0, 1, 1, 2, 3, 3, 10], dtype=np.float64)
+
+    scores = rfm_engine.assign_scores(values, rfm_engine.exact_breakpoints(values))
+
+    # Cortes: 0, 0.6, 1.4, 3 -> cada valor cae en un solo intervalo
+    assert scores.tolist() == [1, 1, 1, 1, 3, 3, 4, 4, 4, 5]
+    assert _qcut_by_rank(values).tolist() == [1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+
+
+def test_scores_are_monotonic_with_ties():
+    values = np.random.default_rng(7).integers(0, 6, 5000).astype(np.float64)
+
+    scores = rfm_engine.assign_scores(values, rfm_engine.exact_breakpoints(values))
+
+    order = np.argsort(values, kind='stable')
+    assert (np.diff(scores[order]) >= 0).all()
+    for value in np.unique(values):
+        assert len(np.unique(scores[values == value])) == 1
+
+
+def test_missing_and_non_positive_columns_get_the_minimum_score():
+    assert rfm_engine.exact_breakpoints(np.zeros(10)) is None
+    assert rfm_engine.assign_scores(np.zeros(3), None).tolist() == [1, 1, 1]
+
+    values = np.array([np.nan, 1, 2, 3, 4, 5], dtype=np.float64)
+    scores = rfm_engine.assign_scores(values, rfm_engine.exact_breakpoints(values))
+    assert scores[0] == 1
+
+
+def _rank_error(values, estimates):
+    """Mayor distancia entre el rango normalizado de cada estimación y su cuantil."""
+    ordered = np.sort(values)
+    errors = []
+    for q, estimate in zip(rfm_engine.RFM_QUANTILES, estimates):
+        lo = np.searchsorted(ordered, estimate, side='left') / len(values)
+        hi = np.searchsorted(ordered, estimate, side='right') / len(values)
+        errors.append(0.0 if lo <= q <= hi else min(abs(lo - q), abs(hi - q)))
+    return max(errors)
+
+
+@pytest.mark.parametrize("k", [256, 1024])
+@pytest.mark.parametrize("seed", range(5))
+def test_sketch_quantiles_stay_within_the_rank_error_bound(k, seed):
+    rng = np.random.default_rng(seed)
+    values = np.concatenate([rng.lognormal(size=150_000), rng.integers(0, 20, 50_000)])
+    rng.shuffle(values)
+
+    sketch = rfm_engine.KLLSketch(k=k, seed=seed)
+    for chunk in np.array_split(values, 40):
+        sketch.update(chunk)
+
+    bound = rfm_engine.KLLSketch.RANK_ERROR_FACTOR / k
+    estimates = sketch.breakpoints()
+    assert _rank_error(values, estimates) <= bound
+    assert np.allclose(estimates, np.quantile(values, rfm_engine.RFM_QUANTILES), rtol=0.05)
+    assert sum(len(items) for items in sketch.compactors) < 3 * k
+
+
+def test_merged_sketches_stay_within_the_rank_error_bound():
+    values = np.random.default_rng(3).normal(50, 10, 200_000)
+    left, right = rfm_engine.KLLSketch(k=512, seed=1), rfm_engine.KLLSketch(k=512, seed=2)
+    left.update(values[:120_000])
+    right.update(values[120_000:])
+    left.merge(right)
+
+    assert left.n == len(values)
+    assert _rank_error(values, left.breakpoints()) <= rfm_engine.KLLSketch.RANK_ERROR_FACTOR / 512
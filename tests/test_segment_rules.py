@@ -0,0 +1,82 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.services import segmentation_service
+
+
+def _reference_segment(row):
+    """Reglas originales, escritas como cadena de if/elif."""
+    if row['CLV'] > 1000 and row['Total Compras'] >= 5 and row['Riesgo Churn'] < 30:
+        return 'VIP Champions'
+    elif row['Total Compras'] >= 2 and row['Engagement Score'] > 40 and row['Riesgo Churn'] < 50:
+        return 'Leales'
+    elif row['Riesgo Churn'] >= 70:
+        return 'En Riesgo'
+    elif row['Total Compras'] == 1 and row['Engagement Score'] > 50:
+        return 'Promesa'
+    elif row['Tipo Usuario'] == 'occasional' and row['Engagement Score'] < 30:
+        return 'Hibernando'
+    elif row['Tipo Usuario'] == 'inactive' or (row['Total Compras'] == 0 and row['Engagement Score'] < 20):
+        return 'Perdidos'
+    else:
+        return 'Ocasionales'
+
+
+# Valores justo antes, en y después de cada umbral de SEGMENT_RULES
+BOUNDARIES = {
+    'CLV': [0.0, 999.99, 1000.0, 1000.01, np.nan],
+    'Total Compras': [0, 1, 2, 4, 5, 6],
+    'Riesgo Churn': [29.99, 30.0, 49.99, 50.0, 69.99, 70.0, 70.01, np.nan],
+    'Engagement Score': [19.99, 20.0, 29.99, 30.0, 40.0, 40.01, 50.0, 50.01, np.nan],
+    'Tipo Usuario': ['occasional', 'inactive', 'active'],
+}
+
+
+def _boundary_frame():
+    return pd.DataFrame(list(itertools.product(*BOUNDARIES.values())), columns=list(BOUNDARIES))
+
+
+def _random_frame(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CLV': rng.choice([999, 1000, 1001], n) + rng.integers(-1, 2, n) * 0.5,
+        'Total Compras': rng.integers(0, 8, n),
+        'Riesgo Churn': rng.integers(0, 101, n).astype(float),
+        'Engagement Score': rng.integers(0, 101, n).astype(float),
+        'Tipo Usuario': rng.choice(['occasional', 'inactive', 'active', 'regular'], n),
+    })
+
+
+def _assert_same_labels(df):
+    expected = df.apply(_reference_segment, axis=1)
+
+    vectorized = segmentation_service.classify_segments(df)
+    assert vectorized.index.equals(df.index)
+    assert vectorized.tolist() == expected.tolist()
+    assert df.apply(segmentation_service.classify_segment, axis=1).tolist() == expected.tolist()
+
+
+def test_boundary_values_match_the_row_rules():
+    df = _boundary_frame()
+    _assert_same_labels(df)
+    # La grilla cubre todos los segmentos
+    assert set(segmentation_service.classify_segments(df)) == {
+        name for name, _ in segmentation_service.SEGMENT_RULES
+    } | {segmentation_service.DEFAULT_SEGMENT}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_random_frames_match_the_row_rules(seed):
+    _assert_same_labels(_random_frame(5000, seed))
+
+
+def test_loaded_dtypes_match_the_row_rules():
+    # Como llegan desde el snapshot: Tipo Usuario categórica y un índice no contiguo
+    df = _boundary_frame()
+    df['Tipo Usuario'] = df['Tipo Usuario'].astype('category')
+    df['Total Compras'] = df['Total Compras'].astype('int32')
+    df.index = df.index * 3 + 7
+    _assert_same_labels(df)
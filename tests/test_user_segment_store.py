@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+from backend.services import segmentation_service, user_segment_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(user_segment_store, "DB_PATH", str(tmp_path / "segmentation.db"))
+    return user_segment_store
+
+
+def _write(store, version, mode, rows):
+    with store.bulk_writer(version, mode=mode) as write:
+        write(rows)
+
+
+def test_streaming_index_does_not_overwrite_batch(store):
+    _write(store, "v3-batch-abc", "batch", [("USER_000001", "Leales", 0, 3, 4, 5, 12)])
+    _write(store, "v3-streaming-abc", "streaming", [("USER_000001", "Leales", 4, 3, 4, 5, 12)])
+
+    user = store.get_user("USER_000001")
+    assert user["cluster_ai"] == 0
+    assert user["data_version"] == "v3-batch-abc"
+    assert store.get_user("USER_000001", mode="streaming")["cluster_ai"] == 4
+
+    assert store.get_version() == "v3-batch-abc"
+    assert store.get_version("streaming") == "v3-streaming-abc"
+    assert [rows for rows in store.iter_users()] == [[("USER_000001", "Leales", 0, 3, 4, 5, 12)]]
+
+
+def test_rewriting_a_mode_replaces_only_that_mode(store):
+    _write(store, "b1", "batch", [("U1", "Leales", 0, 1, 1, 1, 3), ("U2", "Perdidos", 1, 1, 1, 1, 3)])
+    _write(store, "s1", "streaming", [("U1", "Leales", 2, 1, 1, 1, 3)])
+    _write(store, "s2", "streaming", [("U3", "Promesa", 5, 1, 1, 1, 3)])
+
+    assert set(store.get_users(["U1", "U2", "U3"])) == {"U1", "U2"}
+    assert set(store.get_users(["U1", "U2", "U3"], mode="streaming")) == {"U3"}
+
+
+def test_legacy_index_without_mode_is_rebuilt(store):
+    conn = sqlite3.connect(store.DB_PATH)
+    conn.execute("CREATE TABLE user_segments (user_id TEXT PRIMARY KEY, segmento TEXT NOT NULL, cluster_ai INTEGER, "
+                 "r_score INTEGER, f_score INTEGER, m_score INTEGER, rfm_score INTEGER) WITHOUT ROWID")
+    conn.execute("CREATE TABLE user_segments_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("INSERT INTO user_segments_meta VALUES ('version', 'v3-streaming-abc')")
+    conn.commit()
+    conn.close()
+
+    assert store.get_version() is None
+    assert store.get_version("streaming") is None
+
+
+def test_user_segments_require_the_batch_index(store, monkeypatch):
+    monkeypatch.setattr(segmentation_service, "_artifact_key", lambda mode: f"v3-{mode}-abc")
+    _write(store, "v3-streaming-abc", "streaming", [("U1", "Leales", 4, 1, 1, 1, 3)])
+
+    computed = []
+
+    def fake_segmentation(force_refresh=False, refit_model=False, mode="batch"):
+        computed.append(mode)
+        _write(store, f"v3-{mode}-abc", mode, [("U1", "Leales", 0, 1, 1, 1, 3)])
+        return {"status": "success"}
+
+    monkeypatch.setattr(segmentation_service, "get_segmentation_data", fake_segmentation)
+
+    assert segmentation_service.get_user_segments(["U1"])["U1"]["cluster_ai"] == 0
+    assert computed == ["batch"]
+
+    # Con el índice batch vigente no se vuelve a calcular
+    segmentation_service.get_user_segments(["U1"])
+    assert computed == ["batch"]
+
+
+def test_lookups_reuse_the_thread_connection_and_see_new_writes(store, monkeypatch):
+    _write(store, "b1", "batch", [("U1", "Leales", 0, 1, 1, 1, 3)])
+    assert store.get_user("U1")["cluster_ai"] == 0
+
+    opened = []
+    with monkeypatch.context() as patch:
+        patch.setattr(store, "get_db_connection", lambda: opened.append(1) or sqlite3.connect(":memory:"))
+        store.get_version()
+        store.get_users(["U1"])
+    assert opened == []
+
+    # La escritura usa otra conexión; la del thread ve el commit en la próxima consulta
+    _write(store, "b2", "batch", [("U1", "Perdidos", 3, 1, 1, 1, 3)])
+    assert store.get_user("U1")["cluster_ai"] == 3
+    assert store.get_user("U1")["data_version"] == "b2"
+
+
+def test_lookup_checks_the_version_with_the_same_read(store):
+    _write(store, "b1", "batch", [("U1", "Leales", 0, 1, 1, 1, 3)])
+
+    assert store.get_users(["U1"], version="b2") is None
+    assert store.get_users(["U1"], version="b1")["U1"]["data_version"] == "b1"